@@ -6,51 +6,69 @@
     functionality.
 """
 
-import os
-
-from sphinx.util import logging
-
-from . import doxy
-from . import directives
-from .collector import DoxyCollector
+# The Sphinx parts of the extension (antidox.directives, antidox.projects and
+# antidox.collector) are imported by setup(), so that importing the
+# standalone modules (antidox.doxy, antidox.shell, etc) does not import
+# Sphinx and docutils.
 
 __author__ = "Juan I Carrano"
 __copyright__ = "Copyright 2018, Freie Universität Berlin"
 
 
-logger = logging.getLogger(__name__)
-
+def prepare_env(app):
+    """Handler for ``builder-inited``.
 
-def load_db(app):
-    cfgdir = app.config.antidox_doxy_xml_dir
-
-    cfgdir_time = os.path.getmtime(cfgdir) if os.path.exists(cfgdir) else None
-
-    logger.debug("Doxy XML last modified: %s", cfgdir_time)
+    Nothing is loaded here: the DB of each project, including the default
+    one, is loaded by :py:meth:`directives.DoxyDomain.get_db` the first time
+    it is used, so builds that do not need Doxygen data do not pay for it.
+    """
+    from . import projects
 
     env = app.env
 
-    if (not hasattr(env, "antidox_db")
-        or cfgdir_time is None
-        or not hasattr(env, "antidox_db_date")
-        or env.antidox_db_date < cfgdir_time):
+    # Forget projects that are no longer configured.
+    env.antidox_projects = {
+        name: loaded for name, loaded
+        in getattr(env, "antidox_projects", {}).items()
+        if projects.is_configured(app.config, name)}
 
-        logger.info("(Re-)Reading Doxygen DB")
-        env.antidox_db = doxy.DoxyDB(cfgdir)
-        env.antidox_db_date = cfgdir_time
+    if not hasattr(env, "antidox_db"):
+        env.antidox_db = None
+        env.antidox_db_date = None
 
-    app.emit("antidox-db-loaded", env.antidox_db)
+    # project -> (quick_signature, state, date), see DoxyDomain._source_date
+    if not hasattr(env, "antidox_source_dates"):
+        env.antidox_source_dates = {}
 
 
 def setup(app):
+    from . import directives
+    from . import projects
+    from .collector import DoxyCollector
+
     app.add_config_value("antidox_doxy_xml_dir", "", 'env')
     app.add_config_value("antidox_xml_stylesheet", "", 'env')
+    app.add_config_value("antidox_doxy_sqlite3", "", 'env')
+    app.add_config_value("antidox_doxy_tagfile", "", 'env')
+    app.add_config_value("antidox_daemon_socket", "", '')
+    app.add_config_value("antidox_index_file", "", '')
+    app.add_config_value("antidox_prebuilt_index", "", '')
+    app.add_config_value("antidox_db_backend", "sqlite", '')
+    app.add_config_value("antidox_render_threads", 0, '')
+    app.add_config_value("antidox_prefetch_threads", 2, '')
+    app.add_config_value("antidox_prefetch", [], '')
+    app.add_config_value("antidox_shard_size", 100, 'env')
+    app.add_config_value("antidox_projects", {}, 'env')
+    app.add_config_value("antidox_default_project", projects.DEFAULT, 'env')
     app.add_event("antidox-include-default")
     app.add_event("antidox-include-children")
     app.add_event("antidox-db-loaded")
 
-    # TODO: provide support for multiple Doxygen projects
-    app.connect("builder-inited", load_db)
+    app.connect("builder-inited", prepare_env)
+    app.connect("builder-inited", directives.prefetch_hot_compounds)
+    app.connect("build-finished", directives.report_prefetch)
+    app.connect("env-before-read-docs", directives.generate_shards)
+    app.connect("env-before-read-docs", directives.prescan_targets)
     app.add_env_collector(DoxyCollector)
 
     # app.add_directive('doxy', directives.CAuto)
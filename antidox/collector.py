@@ -6,9 +6,12 @@
     modified.
 """
 
+import itertools
 
 from sphinx.environment.collectors import EnvironmentCollector
 
+from . import projects
+
 __author__ = "Juan I Carrano"
 __copyright__ = "Copyright 2018, Freie Universität Berlin"
 
@@ -19,25 +22,73 @@ class DoxyCollector(EnvironmentCollector):
     with directories.
     In the future this could be made smarter about what to rebuild and what not
     to.
+
+    Dependencies on the default project are kept in
+    ``env.antidox_dependencies`` and those on named projects in
+    ``env.antidox_project_dependencies``, by project name.
     """
     def merge_other(self, app, env, docnames, other):
         app.env.antidox_dependencies.update(other.antidox_dependencies)
 
+        for project, deps in other.antidox_project_dependencies.items():
+            app.env.antidox_project_dependencies.setdefault(
+                                                    project, set()).update(deps)
+
+        # Keep the projects that were loaded by the worker, so that they do
+        # not have to be loaded again in the next build.
+        for project, loaded in other.antidox_projects.items():
+            app.env.antidox_projects.setdefault(project, loaded)
+
+        for project, known in other.antidox_source_dates.items():
+            app.env.antidox_source_dates.setdefault(project, known)
+
+        if other.antidox_db is not None and app.env.antidox_db is None:
+            app.env.antidox_db = other.antidox_db
+            app.env.antidox_db_date = other.antidox_db_date
+
     def clear_doc(self, app, env, docname):
         app.env.antidox_dependencies.discard(docname)
 
+        for deps in app.env.antidox_project_dependencies.values():
+            deps.discard(docname)
+
     def get_outdated_docs(self, app, env, added, changed, removed):
         if not hasattr(app.env, "antidox_dependencies"):
             app.env.antidox_dependencies = set()
+        if not hasattr(app.env, "antidox_project_dependencies"):
+            app.env.antidox_project_dependencies = {}
+
+        domain = app.env.get_domain('doxy')
+        outdated = set()
+
+        # Only the projects that some document depends on are checked.
+        for project, deps in itertools.chain(
+                [(projects.DEFAULT, app.env.antidox_dependencies)],
+                app.env.antidox_project_dependencies.items()):
+            if not deps:
+                continue
+
+            try:
+                date = domain.project_date(project)
+            except projects.UnknownProject:
+                date = None
+
+            outdated.update(docname for docname in deps
+                            if docname not in app.env.all_docs
+                            or date is None
+                            or app.env.all_docs[docname] < date)
 
-        return [docname for docname in app.env.antidox_dependencies
-                if docname not in app.env.all_docs
-                or app.env.all_docs[docname] < app.env.antidox_db_date]
+        return list(outdated)
 
     def process_doc(self, *args):
         pass
 
     @staticmethod
-    def note_dependency(env):
-        """Mark the current document as depending on the doxygen database."""
-        env.antidox_dependencies.add(env.docname)
+    def note_dependency(env, project=projects.DEFAULT):
+        """Mark the current document as depending on the doxygen database of
+        a project."""
+        if project:
+            env.antidox_project_dependencies.setdefault(
+                                            project, set()).add(env.docname)
+        else:
+            env.antidox_dependencies.add(env.docname)
@@ -0,0 +1,410 @@
+"""
+    antidox.daemon
+    ~~~~~~~~~~~~~~
+
+    Long running index server. The daemon builds (or restores) a DoxyDB once
+    and answers queries over a Unix domain socket, so that repeated Sphinx
+    builds, parallel workers and shell sessions do not have to ingest the
+    Doxygen XML or warm up their XML caches again.
+
+    Start it with::
+
+      antidox-daemon -s /tmp/antidox.sock path/to/xml
+
+    and point the ``antidox_daemon_socket`` config value (or the shell's
+    ``connect`` command) to the same socket.
+
+    Wire format: each message is a 4-byte big endian length followed by a
+    :py:mod:`marshal`-encoded tuple. Requests are ``(method, args)``, responses
+    are ``(True, result)`` or ``(False, (exception_name, args))``. Only plain
+    Python types travel over the wire: refids are sent as strings, kinds as
+    integers and XML trees as serialized bytes.
+"""
+
+import os
+import argparse
+import functools
+import logging
+import marshal
+import pickle
+import selectors
+import socket
+import struct
+import threading
+import time
+import zipfile
+
+from lxml import etree as ET
+
+from . import doxy
+from . import watch
+from . import xmlsource
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+
+
+class DaemonError(Exception):
+    """Raised by the client when the server reports an unexpected error or
+    the connection is broken."""
+    pass
+
+
+# Exceptions that are forwarded to the client and re-raised there.
+_FORWARDED_ERRORS = {cls.__name__: cls for cls in (
+    doxy.RefError, doxy.InvalidTarget, doxy.AmbiguousTarget,
+    doxy.DoxyFormatError, doxy.ConsistencyError, ValueError,
+    NotImplementedError)}
+
+
+def _encode_error(e):
+    name = type(e).__name__
+    if name not in _FORWARDED_ERRORS:
+        name = DaemonError.__name__
+
+    args = tuple(([str(r) for r in a] if isinstance(a, list) else str(a))
+                 for a in e.args)
+
+    return name, args
+
+
+def _decode_error(name, args):
+    cls = _FORWARDED_ERRORS.get(name, DaemonError)
+
+    if cls is doxy.AmbiguousTarget and len(args) > 1:
+        args = (args[0], [doxy.RefId(r) for r in args[1]]) + tuple(args[2:])
+
+    return cls(*args)
+
+
+def _send(sock, obj):
+    payload = marshal.dumps(obj)
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise DaemonError("Connection closed by peer")
+        chunks.append(chunk)
+        n -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def _recv(sock):
+    size, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return marshal.loads(_recv_exactly(sock, size))
+
+
+def _result_tuple(r):
+    return (str(r.refid), r.name, r.kind.value)
+
+
+def _result_from_tuple(t):
+    refid, name, kind = t
+    return doxy.SearchResult(doxy.RefId(refid), name, doxy.Kind(kind))
+
+
+def _opt_kind(k):
+    return None if k is None else doxy.Kind(k)
+
+
+class DoxyServer:
+    """Serve DoxyDB queries over a Unix socket.
+
+    All requests are handled in a single thread (using a selector to
+    multiplex connections) because DoxyDB is not thread safe. Queries are
+    fast, so this is not a bottleneck.
+
+    If the DB was built from an XML directory, the modification times and
+    sizes of its files (see antidox.xmlsource.scan) are checked when a
+    client connects, at most once every check_interval seconds. The DB is
+    rebuilt once the files have stayed unchanged for settle seconds (like
+    antidox.watch.Watcher does). If the rebuild fails, the old DB keeps
+    being served and the rebuild is tried again later.
+    """
+    def __init__(self, db, socket_path, tree_cache_size=1024,
+                 check_interval=1.0, settle=2.0):
+        self.db = db
+        self.socket_path = socket_path
+        self.check_interval = check_interval
+        self.settle = settle
+
+        self._xml_state = self._scan_xml()
+        self._last_check = time.monotonic()
+        # Changed state that is waiting to settle, and when it was first seen.
+        self._pending = None
+        self._pending_since = None
+
+        self._tree_xml = functools.lru_cache(maxsize=tree_cache_size)(
+                                                        self._serialize_tree)
+
+        self._handlers = {
+            "ping": lambda: True,
+            "get": lambda refid: self._get(refid),
+            "find": lambda kinds, no_parent: [
+                _result_tuple(r) for r in self.db.find(
+                    kinds and [doxy.Kind(k) for k in kinds], no_parent)],
+            "find_parents": lambda refid: [
+                _result_tuple(r) for r in self.db.find_parents(refid)],
+            "find_children": lambda refid: tuple(
+                [_result_tuple(r) for r in rs]
+                for rs in self.db.find_children(refid)),
+            "resolve_target": lambda target, scope: str(
+                self.db.resolve_target(target, scope)),
+            "resolve_name": lambda kind, name, scope: str(
+                self.db.resolve_name(_opt_kind(kind), name, scope)),
+            "refid_to_target": lambda refid: tuple(
+                self.db.refid_to_target(refid)),
+            "guess_desctype": lambda refid: self.db.guess_desctype(refid),
+            "get_tree": lambda refid: self._tree_xml(refid),
+        }
+
+    def _scan_xml(self):
+        """Get the state of the XML files, or None if the DB has no XML or it
+        cannot be read."""
+        if not getattr(self.db, "_xml_dir", None):
+            return None
+
+        try:
+            return xmlsource.scan(self.db._xml_dir)
+        except (OSError, zipfile.BadZipFile):
+            return None
+
+    def _check_fresh(self):
+        """Rebuild the DB if any XML file changed and the change settled.
+
+        The directory's own modification time is not enough: Doxygen
+        rewrites existing files in place.
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        current = self._scan_xml()
+
+        if current is None or current == self._xml_state:
+            self._pending = None
+            return
+
+        if current != self._pending:
+            self._pending = current
+            self._pending_since = now
+
+        if now - self._pending_since < self.settle:
+            return
+
+        doxy.clear_caches()
+        try:
+            db = doxy.DoxyDB(self.db._xml_dir, self.db.backend,
+                             self.db.doxy_sqlite3)
+        except watch.BUILD_ERRORS as e:
+            # Keep _xml_state as it is, so that the rebuild is retried.
+            logger.warning("Cannot rebuild the index, serving the old one: "
+                           "%s", e)
+            return
+
+        # Doxygen may have started again while we were reading.
+        if self._scan_xml() != current:
+            return
+
+        self.db = db
+        self._xml_state = current
+        self._pending = None
+        self._tree_xml.cache_clear()
+
+    def _get(self, refid):
+        name, kind = self.db.get(refid)
+        return name, kind.value
+
+    def _serialize_tree(self, refid):
+        return ET.tostring(self.db.get_tree(refid), with_tail=False)
+
+    def handle(self, method, args):
+        """Execute a request and return the response tuple."""
+        handler = self._handlers.get(method)
+        if handler is None:
+            return False, (DaemonError.__name__,
+                           ("Unknown method: %s" % method,))
+
+        try:
+            result = handler(*args)
+        except Exception as e:
+            # Errors not in _FORWARDED_ERRORS are reported as DaemonError
+            return False, _encode_error(e)
+
+        return True, result
+
+    def _serve_one(self, conn):
+        try:
+            method, args = _recv(conn)
+            _send(conn, self.handle(method, args))
+        except (DaemonError, OSError, EOFError, ValueError):
+            return False
+
+        return True
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen()
+
+        sel = selectors.DefaultSelector()
+        sel.register(listener, selectors.EVENT_READ)
+
+        try:
+            while True:
+                for key, _ in sel.select():
+                    if key.fileobj is listener:
+                        conn, _addr = listener.accept()
+                        self._check_fresh()
+                        sel.register(conn, selectors.EVENT_READ)
+                    elif not self._serve_one(key.fileobj):
+                        sel.unregister(key.fileobj)
+                        key.fileobj.close()
+        finally:
+            sel.close()
+            listener.close()
+            os.unlink(self.socket_path)
+
+
+class DoxyClient:
+    """Drop-in replacement for DoxyDB that forwards queries to a DoxyServer.
+
+    Only the query interface is provided (there is no direct SQL access). The
+    connection is opened lazily and re-opened after a fork, so instances can
+    be pickled with the Sphinx environment and used by parallel workers.
+    """
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._sock = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'socket_path': self.socket_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['socket_path'])
+
+    def _connect(self):
+        if self._sock is not None:
+            self._sock.close()
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.socket_path)
+        self._pid = os.getpid()
+
+    def _call(self, method, *args):
+        with self._lock:
+            if self._sock is None or self._pid != os.getpid():
+                self._connect()
+
+            try:
+                _send(self._sock, (method, args))
+                ok, result = _recv(self._sock)
+            except (OSError, DaemonError):
+                self._sock.close()
+                self._sock = None
+                raise
+
+        if not ok:
+            raise _decode_error(*result)
+
+        return result
+
+    def ping(self):
+        """Check that the server is alive. Raises OSError if it is not."""
+        return self._call("ping")
+
+    def get(self, refid):
+        name, kind = self._call("get", str(refid))
+        return doxy.ElementRow(name, doxy.Kind(kind))
+
+    def find(self, kinds=None, no_parent=False):
+        return (_result_from_tuple(t) for t in self._call(
+            "find", kinds and [k.value for k in kinds], no_parent))
+
+    def find_parents(self, refid):
+        return (_result_from_tuple(t)
+                for t in self._call("find_parents", str(refid)))
+
+    def find_children(self, refid):
+        return [[_result_from_tuple(t) for t in rs] or ()
+                for rs in self._call("find_children", str(refid))]
+
+    def resolve_target(self, target, scope=None):
+        return doxy.RefId(self._call("resolve_target", str(target),
+                                     scope and str(scope)))
+
+    def resolve_name(self, kind, name, scope=None):
+        return doxy.RefId(self._call("resolve_name", kind and kind.value,
+                                     name, scope and str(scope)))
+
+    def refid_to_target(self, refid):
+        return doxy.Target(*self._call("refid_to_target", str(refid)))
+
+    def guess_desctype(self, refid):
+        return self._call("guess_desctype", str(refid))
+
+    def get_tree(self, refid):
+        return ET.fromstring(self._call("get_tree", str(refid)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="antidox index daemon")
+
+    parser.add_argument('-s', '--socket', required=True,
+                        help="Path of the Unix socket to listen on.")
+    parser.add_argument('-r', '--restore', action="store_true",
+                        help="Interpret 'source' as a pickled DB (as "
+                             "produced by the shell's 'dump' command.)")
+    parser.add_argument('--tree-cache', type=int, default=1024,
+                        help="Number of serialized XML trees to keep in "
+                             "memory.")
+    parser.add_argument('-b', '--backend', choices=doxy.BACKENDS,
+                        default="sqlite", help="DB storage backend.")
+    parser.add_argument('--doxy-sqlite3',
+                        help="Build the index from the database created by "
+                             "Doxygen's GENERATE_SQLITE3 option.")
+    parser.add_argument('-i', '--check-interval', type=float, default=1.0,
+                        help="Minimum time in seconds between checks of the "
+                             "XML files.")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Time in seconds that the XML files must be "
+                             "left unmodified before the index is rebuilt.")
+    parser.add_argument('source', help="Doxygen XML directory")
+
+    ns = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s")
+
+    if ns.restore:
+        with open(ns.source, "rb") as f:
+            db = pickle.load(f)
+    else:
+        db = doxy.DoxyDB(ns.source, ns.backend, ns.doxy_sqlite3)
+
+    server = DoxyServer(db, ns.socket, ns.tree_cache, ns.check_interval,
+                        ns.settle)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
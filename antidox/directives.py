@@ -8,11 +8,16 @@
 
 """
 
+import copy
+import os
+import posixpath
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from lxml import etree as ET
 from docutils.parsers.rst import Directive, directives
-from docutils.nodes import Text, Structural, literal, Element, paragraph
+from docutils.nodes import (Text, Structural, literal, Element, paragraph,
+                            compound)
 from sphinx.util import logging
 from sphinx.util.nodes import split_explicit_title, nested_parse_with_titles
 from sphinx.locale import _ as _locale
@@ -21,7 +26,10 @@ from sphinx import addnodes
 import sphinx.errors
 
 from . import doxy
-from .xtransform import get_stylesheet
+from . import projects
+from .stubs import update_file
+from .prefetch import Prefetcher
+from .xtransform import get_stylesheet, annotate, needs_db
 from .nodes import (nodeclass_from_tag, PlaceHolder, DeferredPlaceholder,
                     FakeRoot)
 from .collector import DoxyCollector
@@ -37,14 +45,39 @@ class InvalidEntity(sphinx.errors.SphinxError):
     pass
 
 
-ENTITY_RE = re.compile(r"(?:!(?P<refid>[\w-]+))|(?:(?P<kind>\w+)?\[(?P<name>[-\w]+)\])|(?P<target>[^[]\S*)")
+_executor = None
+_executor_key = None
+
+
+def _get_executor(workers):
+    """Get the thread pool used to render children.
+
+    Threads do not survive a fork, so when Sphinx reads documents in parallel
+    each process needs its own pool.
+    """
+    global _executor, _executor_key
+
+    key = (os.getpid(), workers)
+    if _executor_key != key:
+        _executor = ThreadPoolExecutor(workers)
+        _executor_key = key
+
+    return _executor
+
+
+ENTITY_RE = re.compile(r"(?:\{(?P<project>[-.\w]+)\})?(?:(?:!(?P<refid>[\w-]+))|(?:(?P<kind>\w+)?\[(?P<name>[-\w]+)\])|(?P<target>[^[{]\S*))")
 """Regular expression for references to entities.
 
 Catches either target strings (a/b.h::c), kind[name] strings or refid strings
-(prefixed with an exclamation mark "!").
+(prefixed with an exclamation mark "!"). Any of them can be prefixed by the
+name of a project in braces, as in ``{net}a/b.h::c``.
 
 Capture groups:
 
+``project``
+    The name of the project (see :py:mod:`antidox.projects`), or None if
+    it was not given.
+
 ``refid``:
     If the string starts with "!", then returns the rest of it, unmodified.
 
@@ -72,6 +105,73 @@ def _get_current_scope(env):
     return scope
 
 
+def _get_current_project(env):
+    """Get the project of the entity that is being currently documented, or
+    the default project if not inside a doxy:c directive."""
+    project_stack = env.ref_context.get('doxy:project')
+
+    return project_stack[-1] if project_stack else projects.DEFAULT
+
+
+def entity_project(env, ref_spec):
+    """Get the name of the project a reference (parsed with ENTITY_RE)
+    points to.
+
+    References without an explicit project refer to the project currently
+    being documented, or else to ``antidox_default_project``.
+    """
+    if ref_spec['project'] is not None:
+        return ref_spec['project']
+
+    if env.ref_context.get('doxy:project'):
+        return _get_current_project(env)
+
+    return env.config.antidox_default_project
+
+
+class ResolutionCache:
+    """Candidates for targets and names, computed in bulk before the documents
+    are read (see :py:func:`prescan_targets`.)
+
+    Since only the candidates are stored, the final choice (and the error
+    reporting) is done by the DB for the actual scope in which the reference
+    is found. Lookups for references that were not pre-scanned are forwarded
+    to the DB.
+    """
+    def __init__(self, db, targets, names):
+        self.db = db
+        self.targets = targets
+        self.names = names
+
+    def resolve_target(self, target, scope):
+        target = doxy.Target(target)
+
+        try:
+            candidates = self.targets[target]
+        except KeyError:
+            return self.db.resolve_target(target, scope)
+
+        return self.db.pick_candidate(candidates, target, scope)
+
+    def resolve_name(self, kind, name, scope):
+        try:
+            candidates = self.names[(kind, name)]
+        except KeyError:
+            return self.db.resolve_name(kind, name, scope)
+
+        return self.db.pick_candidate(candidates, (kind, name), scope)
+
+
+def _get_resolver(env, project):
+    """Return the resolution cache if it is valid for the project's DB, else
+    return the DB itself."""
+    domain = env.get_domain('doxy')
+    db = domain.get_db(project)
+    cache = domain.resolution_caches.get(project)
+
+    return cache if cache is not None and cache.db is db else db
+
+
 def resolve_refstr(env, ref_str):
     """Transform a reference string (see :py:data:`ENTITY_RE`) into a RefId.
     If ref_str is already a refid, it is still validated.
@@ -80,7 +180,8 @@ def resolve_refstr(env, ref_str):
     -------
 
     ref: RefId for the element
-    ref_spec: re.Match object, the result of parsing ref_str.
+    ref_spec: re.Match object, the result of parsing ref_str. Use
+        entity_project() to find out the project of the entity.
     """
 
     ref_spec = ENTITY_RE.fullmatch(ref_str)
@@ -88,27 +189,355 @@ def resolve_refstr(env, ref_str):
     if ref_spec is None:
         raise InvalidEntity("Cannot parse entity: %s" % ref_str)
 
-    scope = _get_current_scope(env)
+    project = entity_project(env, ref_spec)
 
-    db = env.antidox_db
+    # The scope is only meaningful inside its own project.
+    scope = (_get_current_scope(env)
+             if project == _get_current_project(env) else 0)
+
+    db = env.get_domain('doxy').get_db(project)
+    resolver = _get_resolver(env, project)
 
     target = ref_spec['target']
     refid_s = ref_spec['refid']
 
     if target:
-        ref = db.resolve_target(target, scope)
+        ref = resolver.resolve_target(target, scope)
     elif refid_s:
         # just validate that the reference is valid
         ref = doxy.RefId(refid_s)
         db.get(ref)
     else:
         kind_s = ref_spec['kind']
-        ref = db.resolve_name(kind_s and doxy.Kind.from_attr(kind_s),
-                              ref_spec['name'], scope)
+        ref = resolver.resolve_name(kind_s and doxy.Kind.from_attr(kind_s),
+                                    ref_spec['name'], scope)
 
     return ref, ref_spec
 
 
+_DIRECTIVE_ARG_RE = re.compile(r"^[ \t]*\.\.[ \t]+doxy:c::[ \t]*(\S+)",
+                               re.MULTILINE)
+_ROLE_TEXT_RE = re.compile(r":doxy:r:`([^`]+)`")
+
+
+def _scan_refstrs(text):
+    """Extract the reference strings in doxy:c directive arguments and doxy:r
+    roles from reST source."""
+    for m in _DIRECTIVE_ARG_RE.finditer(text):
+        yield m[1]
+
+    for m in _ROLE_TEXT_RE.finditer(text):
+        _, _, target = split_explicit_title(m[1].strip())
+        target = target.strip()
+        yield target[1:] if target.startswith("~") else target
+
+
+_HOT_COMPOUND_RE = re.compile(r"(?:\{(?P<project>[-.\w]+)\})?(?P<refid>[\w-]+)")
+
+
+def prefetch_hot_compounds(app):
+    """Handler for ``builder-inited``.
+
+    Start loading the XML of the compounds listed in ``antidox_prefetch``.
+    Compounds are defined in their own files, so this does not need the DB.
+    """
+    domain = app.env.get_domain('doxy')
+
+    for entry in app.config.antidox_prefetch:
+        match = _HOT_COMPOUND_RE.fullmatch(entry)
+        if match is None:
+            logger.warning("Invalid entry in antidox_prefetch: %s", entry)
+            continue
+
+        project = (match['project'] if match['project'] is not None
+                   else app.config.antidox_default_project)
+
+        try:
+            prefetcher = domain.get_prefetcher(project)
+        except projects.UnknownProject as e:
+            logger.warning("Invalid entry in antidox_prefetch: %s", e)
+            continue
+
+        if (prefetcher is not None
+                and not prefetcher.prefetch(match['refid'],
+                                            match['refid'] + ".xml")):
+            break
+
+
+def report_prefetch(app, exception):
+    """Handler for ``build-finished``. Log the prefetching statistics."""
+    domain = app.env.get_domain('doxy')
+
+    for project, prefetcher in sorted(domain._prefetchers.items()):
+        if prefetcher is not None and prefetcher.queued:
+            logger.info("antidox prefetch%s: %s",
+                        " ({})".format(project) if project else "",
+                        prefetcher.report())
+
+
+SHARD_DIR = "_shards"
+"""Directory (next to the document) where shards are generated."""
+
+_SHARD_MARKER_PREFIX = ".. Generated by antidox from "
+_SHARD_MARKER_SUFFIX = ". Do not edit.\n"
+_SHARD_MARKER = _SHARD_MARKER_PREFIX + "{}" + _SHARD_MARKER_SUFFIX
+
+_SHARDED_DIRECTIVE_RE = re.compile(
+    r"^(?P<indent>[ \t]*)\.\.[ \t]+doxy:c::[ \t]*(?P<arg>\S+)[ \t]*\n"
+    r"(?P<options>(?:(?P=indent)[ \t]+:[-\w]+:.*\n)*)", re.MULTILINE)
+_OPTION_RE = re.compile(
+    r"^[ \t]+:(?P<name>[-\w]+):[ \t]*(?P<value>.*?)[ \t]*$", re.MULTILINE)
+
+
+def shard_docnames(docname, ref, n_children, size):
+    """Names of the documents where the children of an entity are
+    documented when the ``shard`` option is given (see generate_shards.)
+
+    Parameters
+    ----------
+
+    docname: document containing the directive.
+    ref: RefId of the entity.
+    n_children: number of children.
+    size: maximum number of children per shard.
+    """
+    base = posixpath.join(posixpath.dirname(docname), SHARD_DIR,
+                          "{}-{}-".format(posixpath.basename(docname), ref))
+
+    return ["{}{}".format(base, i + 1)
+            for i in range((n_children + size - 1) // size)]
+
+
+def _is_shard(docname):
+    return posixpath.basename(posixpath.dirname(docname)) == SHARD_DIR
+
+
+def _shard_owner(filename):
+    """Return the document a shard was generated from, or None if the file
+    was not generated by generate_shards."""
+    try:
+        with open(filename, encoding="utf-8") as f:
+            line = f.readline()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    if (line.startswith(_SHARD_MARKER_PREFIX)
+            and line.endswith(_SHARD_MARKER_SUFFIX)):
+        return line[len(_SHARD_MARKER_PREFIX):-len(_SHARD_MARKER_SUFFIX)]
+
+    return None
+
+
+def _may_be_orphan(env, docname):
+    """Check, by its name only, whether the document a shard was generated
+    from may no longer exist."""
+    owner_dir = posixpath.dirname(posixpath.dirname(docname))
+    name = posixpath.basename(docname)
+
+    return not any(posixpath.join(owner_dir, name[:i]) in env.found_docs
+                   for i, c in enumerate(name) if c == "-")
+
+
+def _format_option(name, value):
+    if isinstance(value, (list, tuple)):
+        value = " ".join(value)
+
+    return "   :{}:{}\n".format(name, " " + value if value else "")
+
+
+def _render_shard(docname, title, project, children):
+    lines = [_SHARD_MARKER.format(docname), "\n", title, "\n",
+             "=" * len(title), "\n"]
+
+    for refid, options in children:
+        lines.append("\n.. doxy:c:: {}!{}\n".format(
+                        "{%s}" % project if project else "", refid))
+        lines.extend(_format_option(name, value)
+                     for name, value in sorted(options.items()))
+
+    return "".join(lines)
+
+
+def generate_shards(app, env, docnames):
+    """Handler for ``env-before-read-docs``.
+
+    Generate the documents for the children of the :rst:dir:`doxy:c`
+    directives that have the ``shard`` option. Each one documents up to
+    ``shard`` (or :confval:`antidox_shard_size`) children, which are split in
+    the same way by the directive, and can then be read in parallel.
+
+    Only the documents that are about to be read are scanned, so nothing is
+    done if they do not use the option, and the DB is only loaded if some
+    directive is sharded. Shards are only written if their content changed,
+    and those that were written are added to the documents to read. Shards
+    that are no longer generated by their document, or whose document was
+    removed, are deleted, but only if they start with the marker written by
+    this function.
+    """
+    shards_by_dir = {}
+    for docname in env.found_docs:
+        if _is_shard(docname):
+            shards_by_dir.setdefault(posixpath.dirname(docname),
+                                     []).append(docname)
+
+    written = set()
+    stale = set()
+
+    for docname in docnames:
+        if _is_shard(docname):
+            continue
+
+        try:
+            with open(env.doc2path(docname),
+                      encoding=app.config.source_encoding) as f:
+                text = f.read() + "\n"
+        except OSError:
+            continue
+
+        generated = set()
+
+        if ":shard:" in text:
+            for m in _SHARDED_DIRECTIVE_RE.finditer(text):
+                options = {o["name"]: o["value"] or None
+                           for o in _OPTION_RE.finditer(m["options"])}
+                if "shard" in options:
+                    generated.update(_generate_shards_of(
+                        app, docname, m["arg"], options, written))
+
+        shard_dir = posixpath.join(posixpath.dirname(docname), SHARD_DIR)
+        prefix = posixpath.join(shard_dir, posixpath.basename(docname) + "-")
+
+        stale.update(
+            d for d in shards_by_dir.get(shard_dir, ())
+            if d.startswith(prefix) and d not in generated
+            and _shard_owner(env.doc2path(d)) == docname)
+
+    for docnames_in_dir in shards_by_dir.values():
+        stale.update(
+            d for d in docnames_in_dir
+            if d not in written and _may_be_orphan(env, d)
+            and _shard_owner(env.doc2path(d)) is not None)
+
+    for docname in stale:
+        os.remove(env.doc2path(docname))
+        env.found_docs.discard(docname)
+
+        if docname in env.all_docs:
+            app.emit('env-purge-doc', env, docname)
+            env.clear_doc(docname)
+
+    if written or stale:
+        env.found_docs.update(written)
+        docnames[:] = sorted((set(docnames) | written) - stale)
+
+
+def _generate_shards_of(app, docname, ref_str, raw_options, written):
+    """Write the shards for a directive found by generate_shards. Return
+    their docnames and add the ones that were written to the "written"
+    set."""
+    env = app.env
+
+    try:
+        options = {name: DoxyExtractor.option_spec[name](value)
+                   for name, value in raw_options.items()
+                   if name in DoxyExtractor.option_spec}
+        ref, ref_spec = resolve_refstr(env, ref_str)
+        project = entity_project(env, ref_spec)
+    except (ValueError, TypeError, doxy.RefError, sphinx.errors.SphinxError):
+        # Let the directive report the error.
+        return []
+
+    context_stack = env.ref_context.setdefault('doxy:refid', [])
+    context_stack.append(ref)
+    project_stack = env.ref_context.setdefault('doxy:project', [])
+    project_stack.append(project)
+
+    try:
+        inclusion_list = _get_inclusion_list(app, ref, options)
+        name = env.get_domain('doxy').get_db(project).get(ref)['name']
+    finally:
+        context_stack.pop()
+        project_stack.pop()
+
+    size = options["shard"] or app.config.antidox_shard_size
+    docnames = shard_docnames(docname, ref, len(inclusion_list), size)
+
+    for i, shard in enumerate(docnames):
+        filename = env.doc2path(shard)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        title = "{} ({}/{})".format(name, i + 1, len(docnames))
+        if (update_file(filename, _render_shard(
+                    docname, title, ref_spec['project'],
+                    inclusion_list[i * size:(i + 1) * size]))
+                or shard not in env.all_docs):
+            written.add(shard)
+
+    return docnames
+
+
+def prescan_targets(app, env, docnames):
+    """Handler for ``env-before-read-docs``.
+
+    Extract all references from the documents that are about to be read and
+    resolve them in bulk, so that directives and roles only have to do a
+    dictionary lookup. See :py:class:`ResolutionCache`.
+
+    This loads the DB of every project that is referenced.
+    """
+    domain = env.get_domain('doxy')
+    default_project = app.config.antidox_default_project
+
+    # project -> (targets, names)
+    refs = {}
+
+    for docname in docnames:
+        try:
+            with open(env.doc2path(docname),
+                      encoding=app.config.source_encoding) as f:
+                text = f.read()
+        except OSError:
+            continue
+
+        for ref_str in _scan_refstrs(text):
+            ref_spec = ENTITY_RE.fullmatch(ref_str)
+            if ref_spec is None:
+                continue
+
+            project = (ref_spec['project'] if ref_spec['project'] is not None
+                       else default_project)
+            targets, names = refs.setdefault(project, (set(), set()))
+
+            if ref_spec['target']:
+                targets.add(doxy.Target(ref_spec['target']))
+            elif ref_spec['name']:
+                kind_s = ref_spec['kind']
+                try:
+                    kind = kind_s and doxy.Kind.from_attr(kind_s)
+                except NotImplementedError:
+                    # Let the directive report the error.
+                    continue
+                names.add((kind, ref_spec['name']))
+
+    for project, (targets, names) in refs.items():
+        if not projects.is_configured(app.config, project):
+            # Let the directive report the error.
+            continue
+
+        db = domain.get_db(project)
+
+        if not hasattr(db, "resolve_targets_bulk"):
+            continue
+
+        logger.verbose("antidox: pre-resolving %d targets and %d names%s",
+                       len(targets), len(names),
+                       " in project %s" % project if project else "")
+
+        domain.resolution_caches[project] = ResolutionCache(
+                                    db, db.resolve_targets_bulk(targets),
+                                    db.resolve_names_bulk(names))
+
+
 class _Universal:
     """Container containing everything."""
     def __contains__(self, k):
@@ -152,7 +581,7 @@ def default_inclusion_policy(app, this, options):
     Flag options are inherited by default. Some kinds ("struct" and "enum", will
     have "children" set by default.)
     """
-    db = app.env.antidox_db
+    db = app.env.get_domain('doxy').get_db(_get_current_project(app.env))
 
     no_children = _empty_to_universe(options.get('no-children'))
     yes_children = _empty_to_universe(options.get('children'))
@@ -187,15 +616,77 @@ def default_inclusion_policy(app, this, options):
         return inclusion_list
 
 
+def _get_inclusion_list(app, ref, options, emit_default=True,
+                        emit_children=True):
+    """Get the list of (refid, options) tuples for the children of an entity,
+    from the ``antidox-include-default`` event or default_inclusion_policy.
+    Events are not emitted if emit_default/emit_children are false, which
+    should only be done if they have no listeners."""
+    ev_result = (app.emit_firstresult("antidox-include-default", ref, options)
+                 if emit_default else None)
+    inclusion_list = (ev_result if ev_result is not None else
+                      (default_inclusion_policy(app, ref, options) or []))
+
+    if emit_children:
+        app.emit_firstresult("antidox-include-children",
+                             ref, options, inclusion_list)
+
+    return inclusion_list
+
+
 def string_list(argument):
     """Parse a list of strings. If no argument is given, return an empty
     list."""
     return argument.split() if argument is not None else []
 
 
+def shard_size(argument):
+    """Parse the number of children per shard. If no argument is given,
+    return 0 (meaning "use antidox_shard_size".)"""
+    return directives.positive_int(argument) if argument else 0
+
+
 _STR2BOOL = {"false": False, "true": True}
 
 
+class _Expansion:
+    """State shared by a directive and all the children it includes, which
+    belong to the same project: the DB, the stylesheet, whether the
+    inclusion events have listeners and the node classes for each tag.
+    """
+    def __init__(self, env, project):
+        domain = env.get_domain('doxy')
+
+        self.domain = domain
+        self.db = domain.get_db(project)
+        self.stylesheet, self.style_fn = domain.get_stylesheet(project)
+        self.prefetcher = domain.get_prefetcher(project)
+
+        # Events without listeners are not emitted at all.
+        listeners = env.app.events.listeners
+        self.emit_include_default = bool(
+                                listeners.get("antidox-include-default"))
+        self.emit_include_children = bool(
+                                listeners.get("antidox-include-children"))
+
+        self._node_classes = {}
+
+    def node_class(self, tag):
+        """Return the node class for a tag (see nodeclass_from_tag), whether
+        it is a Text node and its list attributes."""
+        try:
+            return self._node_classes[tag]
+        except KeyError:
+            pass
+
+        nclass = nodeclass_from_tag(tag)
+        entry = self._node_classes[tag] = (
+                    nclass, issubclass(nclass, Text),
+                    getattr(nclass, "list_attributes", ()))
+
+        return entry
+
+
 class DoxyExtractor(Directive):
     """
     Auto-document any doxygen entity:
@@ -224,11 +715,26 @@ class DoxyExtractor(Directive):
         'hidedoc': directives.flag,
         'children': string_list,
         'no-children': string_list,
+        'shard': shard_size,
     }
 
     _flag_parameters = [opt for opt, typ in option_spec.items()
                         if typ == directives.flag]
 
+    project = None
+    """Name of the project of the entity. This is set by run(), or by the
+    parent directive for children (whose argument is a RefId)."""
+
+    prerendered = None
+    """Tuple with the XML tree of the entity and the output of the
+    stylesheet, if they were already computed by the parent directive (see
+    _prerender.)"""
+
+    element_tree = None
+    """XML tree of the entity, set by run_reference()."""
+
+    _expansion = None
+
     @property
     def env(self):
         """Shortcut to get this document's environment."""
@@ -236,8 +742,16 @@ class DoxyExtractor(Directive):
 
     @property
     def db(self):
-        """Get the DoxyDB object."""
-        return self.env.antidox_db
+        """Get the DoxyDB object of the entity's project."""
+        return self._shared.db
+
+    @property
+    def _shared(self):
+        """_Expansion object, shared with the parent directive, if any."""
+        if self._expansion is None:
+            self._expansion = _Expansion(self.env, self.project)
+
+        return self._expansion
 
     @staticmethod
     def _attr_to_obj(attr_string):
@@ -268,18 +782,19 @@ class DoxyExtractor(Directive):
         special = {}
 
         if etree.getroot() is None:
-            logger.warn("Template produced no elements for %s",
-                        self.arguments[0])
+            logger.warning("Template produced no elements for %s",
+                           self.arguments[0])
             return [], special
 
+        node_class = self._shared.node_class
+
         for action, elem in ET.iterwalk(etree, events=("start", "end")):
             if action == "start":
-                nclass = nodeclass_from_tag(elem.tag)
+                nclass, is_text, list_attributes = node_class(elem.tag)
 
-                arg = elem.text if issubclass(nclass, Text) else ''
+                arg = elem.text if is_text else ''
 
                 # automatically handle list attributes
-                list_attributes = getattr(nclass, "list_attributes", ())
                 filtered_attrs = {k: (v.split("|")
                                       if k in list_attributes
                                       else self._attr_to_obj(v))
@@ -357,10 +872,160 @@ class DoxyExtractor(Directive):
 
         return nodes
 
-    def _options_to_params(self):
-        return {k: 'true()' if k in self.options else 'false()'
+    def _get_tree(self, ref):
+        """Get the XML of an entity, waiting for it if it is being
+        prefetched."""
+        prefetcher = self._shared.prefetcher
+        if prefetcher is not None:
+            prefetcher.wait(ref)
+
+        return self.db.get_tree(ref)
+
+    def _options_to_params(self, options=None):
+        options = self.options if options is None else options
+        return {k: 'true()' if k in options else 'false()'
                 for k in self._flag_parameters}
 
+    def _find_children(self, ref, inclusion_list):
+        """Find the trees of the children that are defined in the same file
+        as this entity inside this entity's tree.
+
+        The tree is searched once for all the children, instead of searching
+        the whole file for each child, as get_tree() does.
+
+        Returns
+        -------
+        trees: List with the element of each child, or None if it was not
+            found.
+        """
+        trees = [None] * len(inclusion_list)
+
+        # A daemon client does not tell which file an entity comes from.
+        if self.element_tree is None or not isinstance(self.db, doxy.DoxyDB):
+            return trees
+
+        try:
+            this_file = self.db.xml_file(ref)
+        except (doxy.RefError, doxy.DoxyFormatError):
+            return trees
+
+        positions = {}
+        for i, (refid, _) in enumerate(inclusion_list):
+            try:
+                if self.db.xml_file(refid) == this_file:
+                    positions.setdefault(str(refid), []).append(i)
+            except (doxy.RefError, doxy.DoxyFormatError):
+                pass
+
+        for element in self.element_tree.iter("memberdef", "enumvalue"):
+            if not positions:
+                break
+            for i in positions.pop(element.get("id"), ()):
+                trees[i] = element
+
+        return trees
+
+    @staticmethod
+    def _transform(stylesheet, job):
+        """Apply the stylesheet for _prerender. Errors are not raised here:
+        the child directive will run into them again and report them."""
+        element_tree, params = job
+        try:
+            return element_tree, stylesheet(element_tree, **params)
+        except (ET.XSLTApplyError, doxy.RefError, doxy.DoxyFormatError,
+                ValueError):
+            # DB errors can only come from the extension functions called
+            # by a custom stylesheet, and those are not run in the pool.
+            return None
+
+    def _prerender(self, ref, inclusion_list):
+        """Apply the stylesheet to the children of this entity.
+
+        Children defined in the same file as this entity are taken from its
+        tree (see _find_children) instead of each child directive fetching
+        its own tree.
+
+        Each child is still transformed separately. The templates match the
+        element being rendered as the document root (e.g. "/memberdef"), and
+        the options are global stylesheet parameters, so a single transform
+        of this entity cannot render its children, neither with the default
+        stylesheet nor with the ones that import it. The fixed cost of a
+        transform is small next to the conversion of its output into nodes.
+
+        lxml releases the GIL while running a XSLT, so with the default
+        stylesheet all the children are fetched and then transformed in
+        parallel by a thread pool. The trees are fetched and annotated on
+        this thread beforehand, since the DB may not be used from other
+        threads. For the same reason, only trees that the stylesheet can
+        render without calling back into the DB (see xtransform.needs_db)
+        are transformed here; custom stylesheets may call the DB anywhere,
+        so they are not run in the pool.
+
+        Parameters
+        ----------
+        ref: RefId of this entity.
+        inclusion_list: list of (refid, options) tuples.
+
+        Returns
+        -------
+        results: List with a tuple (element_tree, output of the stylesheet)
+            for each child, or None if it has to be computed by the child
+            directive (for example, because there was an error, which the
+            child will report.)
+        """
+        workers = (self.env.config.antidox_render_threads
+                   or os.cpu_count() or 1)
+        domain = self._shared.domain
+        stylesheet = self._shared.stylesheet
+        pooled = (workers >= 2 and len(inclusion_list) >= 2
+                  and isinstance(stylesheet, ET.XSLT)
+                  and not self._shared.style_fn)
+
+        trees = self._find_children(ref, inclusion_list)
+
+        domain.prefetch(self.project,
+                        [refid for (refid, _), element_tree
+                         in zip(inclusion_list, trees)
+                         if element_tree is None])
+
+        if pooled:
+            for i, (refid, _) in enumerate(inclusion_list):
+                if trees[i] is None:
+                    try:
+                        trees[i] = self._get_tree(refid)
+                    except (doxy.RefError, doxy.DoxyFormatError):
+                        pass
+
+        # The annotated copies are separate documents, so the jobs can run
+        # concurrently even if the trees overlap. annotate() may return the
+        # same copy twice if a child is included twice, and it is not safe
+        # to transform it from two threads.
+        jobs = []
+        seen = set()
+        for element_tree, (refid, options) in zip(trees, inclusion_list):
+            if element_tree is not None:
+                element_tree = annotate(element_tree, self.db)
+                if needs_db(element_tree):
+                    element_tree = None
+                elif element_tree in seen:
+                    element_tree = copy.deepcopy(element_tree)
+                else:
+                    seen.add(element_tree)
+
+            jobs.append((element_tree, self._options_to_params(options))
+                        if element_tree is not None else None)
+
+        if not pooled:
+            return [self._transform(stylesheet, job) if job is not None
+                    else None for job in jobs]
+
+        executor = _get_executor(workers)
+        futures = [executor.submit(self._transform, stylesheet, job)
+                   if job is not None else None for job in jobs]
+
+        return [future.result() if future is not None else None
+                for future in futures]
+
     def run_reference(self, ref):
         """Convert the doxygen XML of a reference into Sphinx nodes.
 
@@ -374,69 +1039,158 @@ class DoxyExtractor(Directive):
         special: a dictionary of special nodes (subclasses of DeferredPlaceholder)
         """
 
-        element_tree = self.db.get_tree(ref)
+        stylesheet, style_fn = self._shared.stylesheet, self._shared.style_fn
 
-        my_domain = self.env.domains['doxy']
+        if self.prerendered is not None:
+            self.element_tree, rst_etree = self.prerendered
+        else:
+            try:
+                self.element_tree = annotate(self._get_tree(ref), self.db)
+            except doxy.NoXMLError as e:
+                raise self.error(e.args[0])
+
+            rst_etree = stylesheet(self.element_tree,
+                                   **self._options_to_params())
 
-        rst_etree = my_domain.stylesheet(element_tree,
-                                         **self._options_to_params())
         nodes, special = self._etree_to_sphinx(rst_etree)
 
-        style_fn = my_domain.stylesheet_filename
         if style_fn:
             self.env.note_dependency(style_fn)
 
-        DoxyCollector.note_dependency(self.env)
+        DoxyCollector.note_dependency(self.env, self.project)
 
         return nodes, special
 
-    def run(self):
-        arg0 = self.arguments[0]
+    def _expand(self, ref):
+        """Render this entity and find the children to include. This is the
+        part of run() that comes before the children are rendered.
 
-        if isinstance(arg0, doxy.RefId):
-            ref = arg0
-        else:
-            ref = resolve_refstr(self.env, arg0)[0]
-
-        context_stack = self.env.ref_context['doxy:refid']
+        Returns
+        -------
+        nodes, special: see run_reference.
+        children: iterator over (refid, options, prerendered) tuples.
+        children_nodes: list of nodes to insert before those of the
+            children (the toctree of the shards, see the "shard" option.)
+        """
+        context_stack = self.env.ref_context.setdefault('doxy:refid', [])
         context_stack.append(ref)
+        project_stack = self.env.ref_context.setdefault('doxy:project', [])
+        project_stack.append(self.project)
 
         try:
             nodes, special = self.run_reference(ref)
 
             nodes = self._process_content(nodes, special)
 
-            ev_args = (ref, self.options)
-            ev_result = self.env.app.emit_firstresult(
-                                "antidox-include-default", *ev_args)
-            inclusion_list = (ev_result if ev_result is not None else
-                              (default_inclusion_policy(self.env.app, *ev_args)
-                               or [])
-                              )
-
-            self.env.app.emit_firstresult(
-                                "antidox-include-children",
-                                ref, self.options, inclusion_list)
-
-            this_directive = type(self)
-
-            nodes_to_insert = (internal_node
-                               for refid, options in inclusion_list
-                               for internal_node in this_directive(
-                                   'doxy:c', [refid], options, [], self.lineno,
-                                   0, "", self.state, self.state_machine).run())
+            inclusion_list = _get_inclusion_list(
+                                self.env.app, ref, self.options,
+                                self._shared.emit_include_default,
+                                self._shared.emit_include_children)
+
+            children_nodes = []
+            if "shard" in self.options:
+                toctree = self._shard_toctree(ref, inclusion_list)
+                if toctree is not None:
+                    children_nodes.append(toctree)
+                    inclusion_list = []
+
+            prerendered = self._prerender(ref, inclusion_list)
         finally:
             context_stack.pop()
+            project_stack.pop()
+
+        children = ((refid, options, rendered)
+                    for (refid, options), rendered
+                    in zip(inclusion_list, prerendered))
 
+        return nodes, special, children, children_nodes
+
+    def _shard_toctree(self, ref, inclusion_list):
+        """Create the toctree that replaces the children of this entity when
+        they are documented in shards (see generate_shards.)
+
+        Returns None (and warns) if the shards were not generated.
+        """
+        env = self.env
+        docnames = shard_docnames(env.docname, ref, len(inclusion_list),
+                                  self.options["shard"]
+                                  or env.config.antidox_shard_size)
+
+        missing = [d for d in docnames if d not in env.found_docs]
+        if missing:
+            logger.warning("Shards of %s not found (%s), documenting the "
+                           "children here", ref, ", ".join(missing),
+                           location=(env.docname, self.lineno))
+            return None
+
+        toctree = addnodes.toctree()
+        toctree['parent'] = env.docname
+        toctree['entries'] = [(None, d) for d in docnames]
+        toctree['includefiles'] = docnames
+        toctree['maxdepth'] = 1
+        toctree['caption'] = None
+        toctree['glob'] = False
+        toctree['hidden'] = False
+        toctree['includehidden'] = False
+        toctree['numbered'] = 0
+        toctree['titlesonly'] = False
+
+        wrapper = compound(classes=['toctree-wrapper'])
+        wrapper += toctree
+
+        return wrapper
+
+    @staticmethod
+    def _insert_children(nodes, special, children_nodes):
         # just in case the elements produced not output, it should not be an
         # error.
         if "antidox_children" in special:
-            # replace_self needs an indexable sequence
-            special["antidox_children"].replace_self(list(nodes_to_insert))
+            special["antidox_children"].replace_self(children_nodes)
         else:
-            (nodes[-1] if nodes else nodes).extend(nodes_to_insert)
+            (nodes[-1] if nodes else nodes).extend(children_nodes)
 
-        return nodes
+    def run(self):
+        arg0 = self.arguments[0]
+
+        if isinstance(arg0, doxy.RefId):
+            ref = arg0
+            if self.project is None:
+                self.project = _get_current_project(self.env)
+        else:
+            ref, ref_spec = resolve_refstr(self.env, arg0)
+            self.project = entity_project(self.env, ref_spec)
+
+        this_directive = type(self)
+
+        # Children (and their children, etc) are expanded depth first using
+        # an explicit stack of [nodes, special, children, children_nodes]
+        # instead of recursive calls to run(). All of them share the
+        # _Expansion object of this directive.
+        stack = [list(self._expand(ref))]
+
+        while True:
+            nodes, special, children, children_nodes = stack[-1]
+
+            try:
+                refid, options, prerendered = next(children)
+            except StopIteration:
+                stack.pop()
+                self._insert_children(nodes, special, children_nodes)
+
+                if not stack:
+                    return nodes
+
+                stack[-1][3].extend(nodes)
+                continue
+
+            child = this_directive('doxy:c', [refid], options, [],
+                                   self.lineno, 0, "", self.state,
+                                   self.state_machine)
+            child.project = self.project
+            child.prerendered = prerendered
+            child._expansion = self._shared
+
+            stack.append(list(child._expand(refid)))
 
 
 def target_role(typ, rawtext, text, lineno, inliner, options={}, content=[]):
@@ -448,7 +1202,6 @@ def target_role(typ, rawtext, text, lineno, inliner, options={}, content=[]):
     """
 
     env = inliner.document.settings.env
-    db = env.antidox_db
 
     is_explicit, title, _target = split_explicit_title(text.strip())
 
@@ -466,6 +1219,9 @@ def target_role(typ, rawtext, text, lineno, inliner, options={}, content=[]):
         prb = inliner.problematic(rawtext, rawtext, msg)
         return [prb], [msg]
 
+    project = entity_project(env, match)
+    db = env.get_domain('doxy').get_db(project)
+
     try:
         reftype = db.guess_desctype(ref)
     except ValueError:
@@ -502,7 +1258,7 @@ def target_role(typ, rawtext, text, lineno, inliner, options={}, content=[]):
     else:
         node += Text(title, title)
 
-    DoxyCollector.note_dependency(env)
+    DoxyCollector.note_dependency(env, project)
 
     return [node], []
 
@@ -514,6 +1270,15 @@ class DoxyDomain(Domain):
     domain exists is to serve as a container for template and other data that
     should be shared but not be saved with the environment.
 
+    DBs and stylesheets are only loaded the first time they are needed in a
+    build, see get_db() and get_stylesheet(). The DB of the default project
+    is kept in ``env.antidox_db`` and those of named projects in
+    ``env.antidox_projects`` (a dictionary mapping names to ``(db, date)``
+    tuples), to be reused in later builds.
+
+    XML files are loaded in the background by one Prefetcher per project
+    (see get_prefetcher() and prefetch().)
+
     Attributes
     ----------
 
@@ -521,7 +1286,10 @@ class DoxyDomain(Domain):
         or empty, it means the embedded stylesheet that comes with this
         extension is being used.
     DoxyDomain.stylesheet: An lxml.etree.XSLT object to be used as a stylesheet
-        for converting doxygen xml into reST nodes.
+        for converting doxygen xml into reST nodes. Both of these refer to the
+        default project, see get_stylesheet() for the other ones. Accessing
+        the stylesheet loads the DB.
+    DoxyDomain.resolution_caches: ResolutionCache objects by project name.
     """
     name = 'doxy'
     label = "Doxygen-documented entities"
@@ -533,13 +1301,156 @@ class DoxyDomain(Domain):
         super().__init__(env)
 
         self.stylesheet_filename = env.app.config.antidox_xml_stylesheet
+        self.resolution_caches = {}
+
+        # Projects whose DB was checked or loaded in this build, and their
+        # source dates.
+        self._project_dates = {}
+        self._opened = set()
+        self._stylesheets = {}
+        self._prefetchers = {}
+
+    @property
+    def stylesheet(self):
+        return self.get_stylesheet(projects.DEFAULT)[0]
+
+    def _source_date(self, project):
+        """Get the result of projects.source_date for a project. It is only
+        computed if projects.quick_signature changed since it was last
+        computed, in this or in a previous build."""
+        try:
+            return self._project_dates[project]
+        except KeyError:
+            pass
+
+        settings = projects.get_settings(self.env.config, project)
+        signature = projects.quick_signature(settings)
+
+        known = self.env.antidox_source_dates.get(project)
+        if known is not None and known[0] == signature:
+            state_date = known[1:]
+        else:
+            state_date = projects.source_date(settings)
+            self.env.antidox_source_dates[project] = (signature,) + state_date
 
-        env.app.connect("antidox-db-loaded", self._load_stylesheet)
+        self._project_dates[project] = state_date
 
-    def _load_stylesheet(self, app, db):
-        self.stylesheet = get_stylesheet(self.stylesheet_filename,
-                                         locale_fn=_locale,
-                                         doxy_db=db)
+        return state_date
+
+    def project_date(self, project):
+        """Get the modification date of a project's inputs (see
+        projects.source_date).
+
+        Raises UnknownProject if the project is not configured.
+        """
+        return self._source_date(project)[1]
+
+    def get_db(self, project):
+        """Get the DoxyDB of a project, loading it if it is the first time it
+        is used and it is not up to date.
+
+        For the default project, this emits ``antidox-db-loaded``.
+
+        Raises UnknownProject if the project is not configured.
+        """
+        env = self.env
+
+        if project in self._opened:
+            return (env.antidox_projects[project][0] if project
+                    else env.antidox_db)
+
+        if not project:
+            if not projects.is_configured(env.config, project):
+                raise projects.UnknownProject(
+                            "No default Doxygen project is configured (set "
+                            "antidox_doxy_xml_dir or antidox_default_project)")
+
+            projects.load_default_db(env, *self._source_date(project))
+            self._opened.add(project)
+            env.app.emit("antidox-db-loaded", env.antidox_db)
+
+            return env.antidox_db
+
+        settings = projects.get_settings(env.config, project)
+        state, date = self._source_date(project)
+
+        db, db_date = env.antidox_projects.get(project, (None, None))
+
+        if (db is None or date is None or db_date is None or db_date < date
+                or db.backend != settings["db_backend"]):
+            logger.info("Loading Doxygen project %s", project)
+            db = projects.open_db(settings, state)
+            env.antidox_projects[project] = (db, date)
+
+        self._opened.add(project)
+
+        return db
+
+    def get_stylesheet(self, project):
+        """Get the stylesheet for a project.
+
+        Returns
+        -------
+
+        stylesheet: lxml.etree.XSLT object.
+        filename: file the stylesheet was read from, or an empty string if it
+            is the embedded one.
+        """
+        try:
+            return self._stylesheets[project]
+        except KeyError:
+            pass
+
+        filename = (projects.get_settings(self.env.config,
+                                          project)["xml_stylesheet"]
+                    if project else self.stylesheet_filename)
+        stylesheet = get_stylesheet(filename, locale_fn=_locale,
+                                    doxy_db=self.get_db(project))
+
+        self._stylesheets[project] = stylesheet, filename
+
+        return stylesheet, filename
+
+    def get_prefetcher(self, project):
+        """Get the Prefetcher for the XML of a project, or None if
+        prefetching is disabled or the project has no XML.
+
+        Raises UnknownProject if the project is not configured.
+        """
+        try:
+            return self._prefetchers[project]
+        except KeyError:
+            pass
+
+        settings = projects.get_settings(self.env.config, project)
+        workers = self.env.config.antidox_prefetch_threads
+
+        prefetcher = self._prefetchers[project] = (
+            Prefetcher(settings["xml_dir"], workers)
+            if workers and settings["xml_dir"] and not settings["tagfile"]
+            else None)
+
+        return prefetcher
+
+    def prefetch(self, project, refids):
+        """Start loading the XML files of the given entities in the
+        background. Entities that cannot be found are skipped, since the
+        error will be reported when they are rendered."""
+        prefetcher = self.get_prefetcher(project)
+        db = self.get_db(project)
+
+        # A daemon client parses the XML in the daemon.
+        if prefetcher is None or not isinstance(db, doxy.DoxyDB):
+            return
+
+        for refid in refids:
+            try:
+                filename = db.xml_file(refid)
+            except (doxy.RefError, doxy.DoxyFormatError):
+                continue
+
+            if not prefetcher.prefetch(refid, filename):
+                break
 
     def merge_domaindata(self, docnames, otherdata):
         """Nothing to do here."""
@@ -19,9 +19,13 @@ from collections import namedtuple
 import itertools
 import pathlib
 import functools
+from array import array
 
 from lxml import etree as ET
 
+from .graph import HierarchyGraph
+from . import xmlsource
+
 __author__ = "Juan I Carrano"
 __copyright__ = "Copyright 2018, Freie Universität Berlin"
 
@@ -55,7 +59,7 @@ class Kind(enum.Enum):
     # TODO: factor this out into a superclass
     def __conform__(self, protocol):
         if protocol is sqlite3.PrepareProtocol:
-            return str(self.value)
+            return self.value
 
     @classmethod
     def compounds(cls):
@@ -99,7 +103,17 @@ class Kind(enum.Enum):
             raise NotImplementedError("kind=%s not supported" % attr) from e
 
 
-sqlite3.register_converter("Kind", lambda x: Kind(int(x)))
+# Kinds are stored in the DB as plain integers. Since the values are
+# consecutive, this tuple converts them back faster than Kind(x).
+_KINDS = tuple(Kind)
+assert all(i == k.value for i, k in enumerate(_KINDS))
+
+# Kind value of refids that are referenced but were never defined.
+_UNDEFINED = -1
+
+_COMPOUNDS = frozenset(k.value for k in Kind.compounds())
+_NOT_IN_TARGETS = frozenset(k.value for k in Kind.synthetic_compounds()
+                            ) | {_UNDEFINED}
 
 
 def _ez_iterparse(filename, events=()):
@@ -140,6 +154,13 @@ class ConsistencyError(DoxyFormatError):
     pass
 
 
+class NoXMLError(DoxyFormatError):
+    """Raised when the XML definition of an element is requested but the DB
+    was not built from Doxygen's XML output (e.g. it was built from a
+    tagfile.)"""
+    pass
+
+
 class RefError(Exception):
     """Base class for errors related to refids and targets"""
     pass
@@ -168,6 +189,12 @@ _refid_re = re.compile(r"(?:((?:\w|-)+)_1)?((?:(?:[A-Za-z0-9-]+)|(?:_[^1]))+)")
 
 _RefId = namedtuple("_RefId", "prefix id_")
 
+# Interned RefIds, indexed by their string representation. The same refids
+# are parsed over and over (every row returned by the DB, every reference in
+# the documents), so it pays to run the regex only once for each. RefIds
+# cannot be weakly referenced, so entries are only released by clear_caches().
+_refid_cache = {}
+
 
 class RefId(_RefId):
     """Reverse engineered Doxygen refid.
@@ -183,7 +210,11 @@ class RefId(_RefId):
 
     * From a string.
     * From separate ``prefix`` and ``id_`` components.
+
+    Objects constructed from strings are interned: building a RefId from the
+    same string twice yields the same object.
     """
+    __slots__ = ()
 
     def __new__(cls, *args, **kwargs):
         if len(args) == 1 and not kwargs:
@@ -192,13 +223,19 @@ class RefId(_RefId):
             if isinstance(s, cls):
                 return s
 
+            try:
+                return _refid_cache[s]
+            except KeyError:
+                pass
+
             match = _refid_re.fullmatch(s)
             if not match:
                 raise DoxyFormatError("Cannot parse refid: %s" % s)
 
             p, h = match.groups()
 
-            return super().__new__(cls, p or "", h)
+            return _refid_cache.setdefault(s,
+                                           super().__new__(cls, p or "", h))
         else:
             return super().__new__(cls, *args, **kwargs)
 
@@ -221,14 +258,24 @@ _Target = namedtuple("_Target", "path name")
 # sphinx-build from 3'30'' to 2'55'. This makes the total time be dominated
 # by the writing step, which does not depend on this extension.
 @functools.lru_cache(maxsize=32)
-def _parse_xml(filename):
-    """Parse a xml file into an ElementTree. This function is cached for
-    performance since during normal use the same file is frequently accessed
-    many times in a row."""
-    with open(filename) as f:
+def _parse_xml(source, name):
+    """Parse a xml file from an XML source (see antidox.xmlsource) into an
+    ElementTree. This function is cached for performance since during normal
+    use the same file is frequently accessed many times in a row."""
+    with xmlsource.open_xml(source, name) as f:
         return ET.parse(f)
 
 
+def clear_caches():
+    """Forget the interned RefIds and the parsed XML files.
+
+    Long running processes (antidox.daemon, antidox.watch) call this before
+    rebuilding a DB, so that the entries of the old XML are released instead
+    of piling up with each rebuild."""
+    _refid_cache.clear()
+    _parse_xml.cache_clear()
+
+
 class Target(_Target):
     """Tuple uniquely identifying an entity.
 
@@ -280,6 +327,18 @@ SearchResult = namedtuple("SearchResult", "refid name kind")
 """Container for the result of find_children and find_parents queries."""
 
 
+class ElementRow(namedtuple("_ElementRow", "name kind")):
+    """Result of DoxyDB.get(). Like a sqlite3.Row, fields can be accessed both
+    by position and by column name."""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+
+        return super().__getitem__(key)
+
+
 def _match_path(p1, p2):
     """Compare two paths from right to left and return True if they could refer
     to the same file.
@@ -310,6 +369,80 @@ def _barename(n):
     return n.split('::')[-1]
 
 
+_KIND_VALUES = {k.name.lower(): k.value for k in Kind}
+
+
+def _kind_value(attr):
+    """Convert a Doxygen kind string to the value of a Kind, or None if the
+    kind is not supported."""
+    return _KIND_VALUES.get(attr)
+
+
+# Queries used to load the output of Doxygen's GENERATE_SQLITE3 option.
+# Compounds and members are both identified by a row of the "refid" table.
+# Kinds we do not support are skipped.
+_DOXYGEN_TABLES = ("refid", "compounddef", "memberdef", "member", "contains")
+
+_DOXYGEN_DEFS = """
+WITH defs(rowid, refid, name, kind) AS (
+    SELECT r.rowid, r.refid, d.name, kind_value(d.kind)
+    FROM (SELECT rowid, name, kind FROM compounddef
+          UNION ALL
+          SELECT rowid, name, kind FROM memberdef) AS d
+        INNER JOIN refid AS r ON r.rowid = d.rowid
+    WHERE kind_value(d.kind) IS NOT NULL
+    )
+"""
+
+_DOXYGEN_ELEMENTS = _DOXYGEN_DEFS + """
+SELECT refid, name, kind FROM defs ORDER BY rowid
+"""
+
+# Members (the "member" table) are inserted before inner compounds (the
+# "contains" table), like it is done when reading the XML. As in the index,
+# Doxygen does not nest enumvalues under their enum, so those are skipped.
+# See Backend.copy_sqlite for the meaning of the columns.
+_DOXYGEN_HIERARCHY = _DOXYGEN_DEFS + """
+SELECT c.refid AS refid, p.refid AS p_refid, (h.src << 32) + h.n AS ord
+FROM (SELECT 0 AS src, rowid AS n, memberdef_rowid AS child,
+             scope_rowid AS parent
+      FROM member
+      UNION ALL
+      SELECT 1, rowid, inner_rowid, outer_rowid FROM contains) AS h
+    INNER JOIN defs AS c ON c.rowid = h.child
+    INNER JOIN defs AS p ON p.rowid = h.parent
+WHERE c.kind != %d
+""" % Kind.ENUMVALUE.value
+
+# Compounds whose XML file defines enums. All joins here are on primary keys.
+_DOXYGEN_ENUM_SCOPES = """
+SELECT r.refid
+FROM member AS m
+    INNER JOIN memberdef AS d ON d.rowid = m.memberdef_rowid
+    INNER JOIN refid AS r ON r.rowid = m.scope_rowid
+WHERE d.kind = 'enum'
+GROUP BY m.scope_rowid
+ORDER BY m.scope_rowid
+"""
+
+
+def _check_doxygen_schema(conn):
+    """Raise DoxyFormatError if a database does not look like it was created
+    by Doxygen."""
+    tables = {name for name, in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    missing = [t for t in _DOXYGEN_TABLES if t not in tables]
+    if missing:
+        raise DoxyFormatError("Not a Doxygen SQLite3 database (missing "
+                              "tables: %s)" % ", ".join(missing))
+
+
+def _sqlite_ro_uri(filename):
+    """Build an URI to open a SQLite database in read-only mode."""
+    return pathlib.Path(filename).resolve().as_uri() + "?mode=ro"
+
+
 def _refid_str(f):
     """Decorator to make a function that accepts a refid also accept the string"""
 
@@ -330,40 +463,199 @@ def _target_str(f):
     return _f
 
 
-class DoxyDB:
-    """Interface to the Doxygen DB
+class Backend:
+    """Storage for the elements and the hierarchy of a DoxyDB.
 
-    The Doxygen DB is just a directory filled with xml files. It should contain
-    an "index.xml".
+    DoxyDB parses the XML files and implements its public interface on top of
+    the primitives defined here. Refids are passed and returned as RefId
+    objects and kinds as Kind objects.
 
-    Doxygen contains compounds and members. We will refer to both as "elements".
-    The nesting of elements seems quite arbitrary, things like "function" can
-    appear nested under both a "file" and a "group". "struct" in the other hand,
-    appear as top-level in the index, though in reality they are contained in a
-    file and in maybe a group.
+    Rows returned by target_candidates and name_candidates are (closeness,
+    refid) tuples, sorted as required by DoxyDB._rows_to_refid (see
+    HierarchyGraph.rank.)
+
+    Query methods should treat refids that were referenced (e.g. as parents)
+    but never inserted as if they did not exist.
+    """
+    name = None
 
-    DoxyDB uses a SQLite database to sort this problem. Interestingly, doxygen
-    can create a sqlite3 db, but it's not very well documented (ironic, isn't
-    it?).
+    def insert_element(self, refid, name, kind, parent_refid=None):
+        """Add an element. Inserting an element twice is not an error, but
+        only the first definition is kept."""
+        raise NotImplementedError
 
-    Read-only index: After the initial database creation, no further modification are done by any
-    method. This ensures DoxyDB is safe to use for parallel builds (where there
-    will be multiple independent processes, each with a copy of the in-memory DB)
+    def insert_hierarchy(self, refid, parent_refid):
+        """Add a parent-child relationship. The child must already exist,
+        otherwise ConsistencyError is raised."""
+        raise NotImplementedError
 
-    refid: Each element in Doxygen is uniquely defined by a "refid", consisting of a
-    string of the form string_part_1id_part.
+    def compounds(self):
+        """Return a list of the refids of all compounds."""
+        raise NotImplementedError
+
+    def copy_sqlite(self, filename, elements_query, hierarchy_query):
+        """Insert elements and relationships selected from another SQLite
+        database.
+
+        The database is attached (read-only) as "src" to a connection where
+        the kind_value() SQL function is defined.
+
+        Parameters
+        ----------
+
+        filename: database file.
+        elements_query: query returning (refid, name, kind) rows, where kind
+            is the value of a Kind, in the order in which the elements should
+            be inserted.
+        hierarchy_query: query returning (refid, p_refid, ord) rows.
+            Relationships are inserted in increasing "ord" order.
+        """
+        conn = sqlite3.connect('file::memory:', uri=True)
+        try:
+            conn.create_function("kind_value", 1, _kind_value)
+            conn.execute("ATTACH DATABASE ? AS src",
+                         (_sqlite_ro_uri(filename),))
+
+            for refid, name, kind in conn.execute(elements_query):
+                self.insert_element(RefId(refid), name, _KINDS[kind])
+
+            for refid, p_refid in conn.execute(
+                    "SELECT refid, p_refid FROM (%s) ORDER BY ord"
+                    % hierarchy_query):
+                self.insert_hierarchy(RefId(refid), RefId(p_refid))
+        finally:
+            conn.close()
+
+    def load_doxygen_sqlite3(self, filename):
+        """Insert all the elements and relationships found in a database
+        created by Doxygen's GENERATE_SQLITE3 option.
+
+        Returns
+        -------
+
+        enum_scopes: list of the refids of the compounds that contain enums.
+            Doxygen does not record which enum an enumvalue belongs to, so
+            the XML files of these compounds must still be read.
+        """
+        conn = sqlite3.connect(_sqlite_ro_uri(filename), uri=True)
+        try:
+            _check_doxygen_schema(conn)
+            enum_scopes = [RefId(r) for r, in
+                           conn.execute(_DOXYGEN_ENUM_SCOPES)]
+        finally:
+            conn.close()
+
+        self.copy_sqlite(filename, _DOXYGEN_ELEMENTS, _DOXYGEN_HIERARCHY)
+
+        return enum_scopes
+
+    def dump(self):
+        """Return the contents of the DB as two lists: (refid, name, kind)
+        tuples for the elements and (refid, parent_refid) tuples for the
+        relationships between them.
+
+        Loading the lists back in order must produce an equivalent DB.
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """Called after all elements have been inserted."""
+        pass
+
+    def get(self, refid):
+        """Return a (name, kind) tuple, or None if the element does not
+        exist."""
+        raise NotImplementedError
+
+    def compound_parents(self, refid):
+        """Return a list of SearchResult for the compounds that directly
+        contain an element."""
+        raise NotImplementedError
+
+    def compound_grandparents(self, refid):
+        """Return a list of the refids of the compounds containing the
+        parents of an element."""
+        raise NotImplementedError
+
+    def children(self, refid):
+        """Return a pair of lists (members, compounds) of SearchResult for the
+        direct children of an element, in insertion order."""
+        raise NotImplementedError
+
+    def find(self, kinds, no_parent):
+        """Return an iterable of SearchResult for all elements having one of
+        the given kinds."""
+        raise NotImplementedError
+
+    def target_nodes(self, refid):
+        """Walk up the tree (ignoring synthetic compounds) and return the
+        (name, kind) of the element and of each of its ancestors. If an
+        element has more than one parent, the first one is followed."""
+        raise NotImplementedError
+
+    def count_files(self, path):
+        """Count the files matching the given path."""
+        raise NotImplementedError
+
+    def target_candidates(self, components, path, accept_level, scope):
+        """Find the elements under a file matching path whose names match the
+        components. Return a list of rows."""
+        raise NotImplementedError
+
+    def name_candidates(self, kind, name, scope):
+        """Find the elements with a given name and kind (None for any).
+        Return a list of rows."""
+        raise NotImplementedError
+
+    def targets_bulk(self, specs):
+        """Same as target_candidates, for a list of (path, components,
+        accept_level) tuples. Return a list of (spec_index, refid) pairs."""
+        raise NotImplementedError
+
+    def names_bulk(self, names):
+        """Return a list of (refid, name, kind) for elements having any of the
+        given names."""
+        raise NotImplementedError
+
+    def ancestors_of(self, refids):
+        """Return a dictionary mapping each refid to a dictionary of its
+        ancestors and their distance to it."""
+        raise NotImplementedError
+
+    def walk(self, root, kinds):
+        """Return an iterable of (compound, subcompounds, members) tuples,
+        where compound is a SearchResult and the others are lists of
+        SearchResult for its direct children, in insertion order. Only
+        elements of the given kinds are included.
+
+        Compounds are returned top-down (see HierarchyGraph.top_down), either
+        all of them or, if root is not None, the root and the compounds under
+        it.
+        """
+        raise NotImplementedError
+
+
+class SQLiteBackend(Backend):
+    """Store the elements in an in-memory SQLite database.
+
+    Each element is given a small integer id ("eid") and the refid string is
+    stored only once, in the elements table. All joins are done on eids.
+
+    Additionally, the hierarchy is loaded into a HierarchyGraph to answer
+    ancestor queries without recursive SQL.
     """
-    # TODO: check if a file can be used (and shared) instead if ":memory:"
+    name = "sqlite"
 
-    def __init__(self, xml_dir):
-        self._xml_dir = xml_dir
+    # Maximum number of parameters in an "IN (...)" list.
+    _IN_CHUNK = 500
+
+    def __init__(self):
         self._db_conn = None
 
         self._init_db()
 
-        self._read_index(os.path.join(self._xml_dir, "index.xml"))
-        self._load_all_inner()
-        self._vacuum()
+        # Map refids to eids. Only used while the DB is being built.
+        self._eids = {}
 
     # Pickle support
     def __getstate__(self):
@@ -374,14 +666,14 @@ class DoxyDB:
         # done in __init__
         db_dump.writelines(self._db_conn.iterdump())
 
-        return {'_xml_dir': self._xml_dir, '_db_dump': db_dump.getvalue()}
+        return {'_db_dump': db_dump.getvalue()}
 
     def __setstate__(self, state):
-        self._xml_dir = state['_xml_dir']
         self._db_conn = None
         self._create_db_conn()
         self._db_conn.executescript(state['_db_dump'])
         self._vacuum()
+        self._build_graph()
 
     def _vacuum(self):
         old_isolation = self._db_conn.isolation_level
@@ -399,12 +691,15 @@ class DoxyDB:
             self._db_conn = None
 
         # TODO: investigate the benefits of using an actual file for the DB
-        self._db_conn = sqlite3.connect(':memory:',
-                                        detect_types=sqlite3.PARSE_DECLTYPES)
+        # Use an URI so that databases can be attached read-only.
+        self._db_conn = sqlite3.connect('file::memory:', uri=True)
 
         self._db_conn.row_factory = sqlite3.Row
         self._db_conn.create_function("match_path", 2, _match_path)
         self._db_conn.create_function("barename", 1, _barename)
+        self._db_conn.create_function("kind_name", 1,
+                                      lambda k: _KINDS[k].name)
+        self._db_conn.create_function("kind_value", 1, _kind_value)
 
     def _init_db(self):
         """Create a DB in memory and create empty tables."""
@@ -416,60 +711,593 @@ class DoxyDB:
         #        <name>FXOS8700_REG_STATUS</name>
         #   </member>
         #  ....
-        # An entry is added to the elements table:
-        #   prefix=fxos8700__regs_8h, id=abd2eb1f9d6401758c261450bf6f78280,
-        #   kind="define", name="FXOS8700_REG_STATUS"
+        # Entries are added to the elements table (kind is stored as an int):
+        #   eid=1, refid="fxos8700__regs_8h", kind=FILE, name="fxos8700_regs.h"
+        #   eid=2, refid="fxos8700__regs_8h_1abd2eb1f9d6401758c261450bf6f78280",
+        #   kind=DEFINE, name="FXOS8700_REG_STATUS"
         # And an entry will be added to the hierarchy table
-        #   prefix=fxos8700__regs_8h, id=abd2eb1f9d6401758c261450bf6f78280,
-        #   p_prefix="", p_id="fxos8700__regs_8h"
+        #   eid=2, p_eid=1
         #
         self._db_conn.executescript("""
         PRAGMA foreign_keys = 1;
 
         CREATE TABLE elements (
-            prefix TEXT, id TEXT,
+            eid INTEGER PRIMARY KEY ON CONFLICT IGNORE,
+            refid TEXT NOT NULL UNIQUE ON CONFLICT IGNORE,
             name TEXT NOT NULL,
-            kind Kind NOT NULL,
-            PRIMARY KEY (prefix, id) ON CONFLICT IGNORE
+            kind INTEGER NOT NULL
             );
 
+        CREATE INDEX elements_name ON elements (name);
+
         CREATE TABLE hierarchy (
-            prefix TEXT NOT NULL, id TEXT NOT NULL,
-            p_prefix TEXT NOT NULL, p_id TEXT NOT NULL,
-            UNIQUE (prefix, id, p_prefix, p_id) ON CONFLICT REPLACE,
-            FOREIGN KEY(prefix, id) REFERENCES elements(prefix, id)
+            eid INTEGER NOT NULL,
+            p_eid INTEGER NOT NULL,
+            UNIQUE (eid, p_eid) ON CONFLICT REPLACE,
+            FOREIGN KEY(eid) REFERENCES elements(eid)
             );
 
-        CREATE TABLE compound_kinds (kind Kind NOT NULL,
+        CREATE INDEX hierarchy_parent ON hierarchy (p_eid);
+
+        CREATE TABLE compound_kinds (kind INTEGER NOT NULL,
                                      UNIQUE(kind)
                                      );
-        CREATE TABLE syn_compound_kinds (kind Kind NOT NULL,
+        CREATE TABLE syn_compound_kinds (kind INTEGER NOT NULL,
                                          UNIQUE(kind)
                                          );
         """)
 
         _compounds = Kind.compounds()
         self._db_conn.executemany("INSERT INTO compound_kinds VALUES (?)",
-                                  ((x,) for x in _compounds))
+                                  ((x.value,) for x in _compounds))
 
         _syn_compounds = Kind.synthetic_compounds()
         self._db_conn.executemany("INSERT INTO syn_compound_kinds VALUES (?)",
-                                  ((x,) for x in _syn_compounds))
+                                  ((x.value,) for x in _syn_compounds))
+
+    def copy_sqlite(self, filename, elements_query, hierarchy_query):
+        # Copy the data directly between the databases.
+        self._db_conn.execute("ATTACH DATABASE ? AS src",
+                              (_sqlite_ro_uri(filename),))
+        try:
+            # eids are allocated in the same order as in the base
+            # implementation.
+            self._db_conn.execute(
+                "INSERT INTO elements (refid, name, kind) " + elements_query)
+
+            self._db_conn.execute("""
+            INSERT INTO hierarchy (eid, p_eid)
+            SELECT c.eid, p.eid
+            FROM (%s) AS h
+                INNER JOIN elements AS c ON c.refid = h.refid
+                INNER JOIN elements AS p ON p.refid = h.p_refid
+            ORDER BY h.ord
+            """ % hierarchy_query)
+        finally:
+            self._db_conn.commit()
+            self._db_conn.execute("DETACH DATABASE src")
+
+        self._eids.update((RefId(r), eid) for eid, r in self._db_conn.execute(
+                                        "SELECT eid, refid FROM elements"))
+
+    def dump(self):
+        elements = [(RefId(r), name, _KINDS[kind]) for r, name, kind in
+                    self._db_conn.execute("SELECT refid, name, kind "
+                                          "FROM elements ORDER BY eid")]
+        hierarchy = [(RefId(r), RefId(p)) for r, p in self._db_conn.execute(
+            """SELECT c.refid, p.refid
+            FROM hierarchy AS h
+                INNER JOIN elements AS c ON c.eid = h.eid
+                INNER JOIN elements AS p ON p.eid = h.p_eid
+            ORDER BY h.rowid
+            """)]
+
+        return elements, hierarchy
+
+    def _eid(self, refid):
+        """Get the eid for a refid, allocating a new one if needed.
+
+        Members appear in the index before their compound is inserted, so
+        eids may be allocated before the element exists.
+        """
+        try:
+            return self._eids[refid]
+        except KeyError:
+            eid = self._eids[refid] = len(self._eids) + 1
+            return eid
 
-    def _insert_element(self, refid, name, kind, parent_refid=None):
-        """Insert an element into the database."""
+    def insert_hierarchy(self, refid, parent_refid):
+        try:
+            self._db_conn.execute("INSERT INTO hierarchy values (?, ?)",
+                                  (self._eid(refid), self._eid(parent_refid)))
+        except sqlite3.IntegrityError:
+            # The foreign key on the child failed.
+            raise ConsistencyError("Unknown element in hierarchy: %s"
+                                   % str(refid)) from None
 
+    def insert_element(self, refid, name, kind, parent_refid=None):
         try:
             self._db_conn.execute("INSERT INTO elements values "
                                   "(?, ?, ?, ?)",
-                                  refid + (name, kind))
+                                  (self._eid(refid), str(refid), name,
+                                   kind.value))
         except sqlite3.IntegrityError:
             print(refid, name, kind)  # FIXME: replace by proper logging
             raise
 
         if parent_refid is not None:
-            self._db_conn.execute("INSERT INTO hierarchy values (?, ?, ?, ?)",
-                                  refid + parent_refid)
+            self.insert_hierarchy(refid, parent_refid)
+
+    def compounds(self):
+        cur = self._db_conn.execute(
+                "SELECT refid FROM elements WHERE kind in compound_kinds")
+
+        return [RefId(refid) for refid, in cur]
+
+    def finish(self):
+        del self._eids
+        self._vacuum()
+        self._build_graph()
+
+    def _build_graph(self):
+        n_nodes = self._db_conn.execute(
+            """SELECT MAX(IFNULL((SELECT MAX(eid) FROM elements), 0),
+                          IFNULL((SELECT MAX(p_eid) FROM hierarchy), 0)) + 1
+            """).fetchone()[0]
+
+        self._kinds = array('b', [_UNDEFINED]) * n_nodes
+        for eid, kind in self._db_conn.execute("SELECT eid, kind FROM elements"):
+            self._kinds[eid] = kind
+
+        cur = self._db_conn.execute(
+                            "SELECT eid, p_eid FROM hierarchy ORDER BY rowid")
+        self._graph = HierarchyGraph(n_nodes, ((c, p) for c, p in cur))
+
+    def _eid_of(self, refid):
+        """Get the eid of an element, or None if it does not exist."""
+        row = self._db_conn.execute("SELECT eid FROM elements WHERE refid = ?",
+                                    (str(refid),)).fetchone()
+
+        return None if row is None else row[0]
+
+    def _select_in(self, query, values):
+        """Run a query with a "?s" placeholder that is replaced by a list of
+        parameters, in chunks so as not to hit the limit on SQL variables.
+
+        Temporary tables cannot be used here because these queries may run
+        while a cursor returned by find() is still open."""
+        values = list(values)
+
+        for i in range(0, len(values), self._IN_CHUNK):
+            chunk = values[i:i + self._IN_CHUNK]
+            yield from self._db_conn.execute(
+                        query.replace("?s", ",".join("?" * len(chunk))), chunk)
+
+    def _refids_of(self, eids):
+        """Get a dictionary mapping eids to RefIds."""
+        return {eid: RefId(ref) for eid, ref in self._select_in(
+                    "SELECT eid, refid FROM elements WHERE eid IN (?s)", eids)}
+
+    def get(self, refid):
+        cur = self._db_conn.execute(
+            """SELECT name, kind FROM elements WHERE refid = ?""",
+            (str(refid),))
+
+        # No need to check for more than one result, refid is unique
+        row = cur.fetchone()
+
+        return None if row is None else (row[0], _KINDS[row[1]])
+
+    def compound_parents(self, refid):
+        cur = self._db_conn.execute(
+        """SELECT p.refid, p.name, p.kind
+        FROM elements AS c
+            INNER JOIN hierarchy AS h ON h.eid = c.eid
+            INNER JOIN elements AS p ON p.eid = h.p_eid
+        WHERE c.refid = ?
+              AND p.kind in compound_kinds
+        ORDER BY p.eid""", (str(refid),))
+
+        return [SearchResult(RefId(ref), name, _KINDS[kind])
+                for ref, name, kind in cur]
+
+    def compound_grandparents(self, refid):
+        cur = self._db_conn.execute(
+        """SELECT p.refid
+        FROM elements AS c
+            INNER JOIN hierarchy AS h2 ON h2.eid = c.eid
+            INNER JOIN hierarchy AS h1 ON h1.eid = h2.p_eid
+            INNER JOIN elements AS p ON p.eid = h1.p_eid
+        WHERE c.refid = ?
+            AND p.kind in compound_kinds
+        ORDER BY h2.p_eid, h1.p_eid
+        """, (str(refid),))
+
+        return [RefId(ref) for ref, in cur]
+
+    def children(self, refid):
+        cur = self._db_conn.execute(
+        """SELECT c.refid, c.name, c.kind,
+                  c.kind IN compound_kinds as is_compound
+        FROM elements AS p
+            INNER JOIN hierarchy AS h ON h.p_eid = p.eid
+            INNER JOIN elements AS c ON c.eid = h.eid
+        WHERE p.refid = ?
+        ORDER BY
+              is_compound, h.rowid""",
+            (str(refid),))
+
+        r = [(), ()]
+        for iscompound, g in itertools.groupby(cur, lambda x: x["is_compound"]):
+            r[iscompound] = [SearchResult(RefId(ref), name, _KINDS[kind])
+                             for ref, name, kind, _ in g]
+
+        return r
+
+    def find(self, kinds, no_parent):
+        query = (
+        """WITH
+            allowed_kinds (kind) AS (
+                VALUES {}
+            )
+            SELECT elements.refid, elements.name, elements.kind FROM elements
+            INNER JOIN allowed_kinds as ak
+                ON ak.kind == elements.kind
+        """).format(",".join(itertools.repeat("(?)", len(kinds))))
+
+        if no_parent:
+            query += """
+            LEFT JOIN hierarchy as h
+                ON h.eid == elements.eid
+            WHERE h.p_eid IS NULL
+            """
+
+        query += "ORDER BY elements.eid"
+
+        cur = self._db_conn.execute(query, [k.value for k in kinds])
+
+        return (SearchResult(RefId(ref), name, _KINDS[kind])
+                for ref, name, kind in cur)
+
+    def target_nodes(self, refid):
+        eid = self._eid_of(refid)
+
+        if eid is None:
+            return []
+
+        # If we omit user-defined constructs like groups, the elements form
+        # a tree, where the files are roots.
+        nodes = self._graph.walk_up(
+                    eid, lambda p: self._kinds[p] not in _NOT_IN_TARGETS)
+
+        cur = self._db_conn.execute(
+            "SELECT eid, name, kind FROM elements WHERE eid IN (%s)"
+            % ",".join("?" * len(nodes)), nodes)
+        rows = {eid: (name, _KINDS[kind]) for eid, name, kind in cur}
+
+        return [rows[n] for n in nodes]
+
+    def count_files(self, path):
+        return self._db_conn.execute(
+            """SELECT COUNT(*) FROM elements
+                WHERE kind = ? AND  match_path(name, ?)
+            """, (Kind.FILE.value, path)).fetchone()[0]
+
+    def _rows(self, cur, scope):
+        """Rank (eid, refid) rows by closeness to the scope."""
+        refids = {eid: ref for eid, ref in cur}
+        scope_eid = None if scope is None else self._eid_of(scope)
+
+        return [(closeness, RefId(refids[eid]))
+                for closeness, eid in self._graph.rank(refids, scope_eid)]
+
+    def target_candidates(self, components, path, accept_level, scope):
+        ncompo = len(components)
+
+        # The call to barename is a kind of hack. It is necessary because
+        #      doxygen stores some names with namespaces and some without.
+        # The DISTINCT keyword is there because sometimes the search returns
+        #      the same entity multiple times. I think it may only be because of
+        #      some bug in doxygen (further investigation is needed.)
+        cur = self._db_conn.execute(
+        """WITH RECURSIVE
+            components (level, compo) AS (
+                VALUES %s
+            ),
+            follow (level, eid) AS (
+                SELECT 0, eid FROM elements
+                    WHERE kind = ? AND match_path(name, ?)
+                UNION ALL
+                SELECT f.level + 1, h.eid
+                FROM follow AS f
+                    INNER JOIN hierarchy AS h
+                        ON h.p_eid = f.eid
+                    INNER JOIN elements AS e
+                        ON h.eid = e.eid
+                    INNER JOIN components AS c
+                        ON f.level = c.level
+                WHERE barename(e.name) = c.compo
+            )
+        SELECT DISTINCT f.eid, e.refid FROM follow AS f
+            INNER JOIN elements AS e
+                ON e.eid = f.eid
+        WHERE f.level = ?
+        """ % ",".join("(%s, ?)" % i for i in range(ncompo)),
+            tuple(components) + (Kind.FILE.value, path, accept_level))
+
+        return self._rows(cur, scope)
+
+    def name_candidates(self, kind, name, scope):
+        cur = self._db_conn.execute(
+        """SELECT eid, refid FROM elements
+        WHERE (:ignore_kind OR kind = :kind) AND name = :name
+        """,
+        {"ignore_kind": not bool(kind), "kind": kind and kind.value,
+         "name": name})
+
+        return self._rows(cur, scope)
+
+    @staticmethod
+    def _values(rows, n_columns):
+        """SQL for a table made of rows of n_columns "?" parameters."""
+        if not rows:
+            return "SELECT %s WHERE 0" % ",".join(["NULL"] * n_columns)
+
+        row = "(%s)" % ",".join("?" * n_columns)
+        return "VALUES " + ",".join([row] * len(rows))
+
+    def _target_chunks(self, specs):
+        """Split (path, components, accept_level) specs into chunks of
+        (targets, components) rows, each with at most about _IN_CHUNK
+        parameters."""
+        targets, components = [], []
+
+        for i, (path, compos, accept_level) in enumerate(specs):
+            if (targets and 3 * (len(targets) + len(components)
+                                 + len(compos) + 1) > self._IN_CHUNK):
+                yield targets, components
+                targets, components = [], []
+
+            targets.append((i, path or "", accept_level))
+            components.extend((i, level, c) for level, c in enumerate(compos))
+
+        if targets:
+            yield targets, components
+
+    def targets_bulk(self, specs):
+        # Same query as in target_candidates, but carrying the target number
+        # along. The targets are given as VALUES and not in temporary tables
+        # (see _select_in). Chunks are in target order, so the result is
+        # sorted.
+        query = """WITH RECURSIVE
+            _targets (t, path, accept_level) AS ({}),
+            _components (t, level, compo) AS ({}),
+            follow (t, level, eid) AS (
+                SELECT t.t, 0, e.eid
+                    FROM _targets AS t INNER JOIN elements AS e
+                    WHERE e.kind = ?
+                        AND (t.path = '' OR match_path(e.name, t.path))
+                UNION ALL
+                SELECT f.t, f.level + 1, h.eid
+                FROM follow AS f
+                    INNER JOIN hierarchy AS h
+                        ON h.p_eid = f.eid
+                    INNER JOIN elements AS e
+                        ON h.eid = e.eid
+                    INNER JOIN _components AS c
+                        ON f.t = c.t AND f.level = c.level
+                WHERE barename(e.name) = c.compo
+            )
+        SELECT DISTINCT f.t, e.eid, e.refid
+        FROM follow AS f
+            INNER JOIN _targets AS t
+                ON f.t = t.t AND f.level = t.accept_level
+            INNER JOIN elements AS e
+                ON e.eid = f.eid
+        ORDER BY f.t, e.eid
+        """
+
+        found = []
+        for targets, components in self._target_chunks(specs):
+            cur = self._db_conn.execute(
+                query.format(self._values(targets, 3),
+                             self._values(components, 3)),
+                [x for row in targets + components for x in row]
+                + [Kind.FILE.value])
+            found.extend((t, RefId(ref)) for t, _, ref in cur)
+
+        return found
+
+    def names_bulk(self, names):
+        rows = sorted(self._select_in(
+            "SELECT eid, refid, name, kind FROM elements WHERE name IN (?s)",
+            set(names)), key=lambda row: row[0])
+
+        return [(RefId(ref), name, _KINDS[kind])
+                for _, ref, name, kind in rows]
+
+    def ancestors_of(self, refids):
+        refids = set(refids)
+
+        ancestors = {RefId(ref): self._graph.ancestors(eid)
+                     for ref, eid in self._select_in(
+                        "SELECT refid, eid FROM elements WHERE refid IN (?s)",
+                        map(str, refids))}
+
+        a_refids = self._refids_of({a for l in ancestors.values()
+                                    for a, _ in l})
+
+        return {r: {a_refids[a]: d for a, d in ancestors.get(r, ())
+                    if a in a_refids}
+                for r in refids}
+
+    def walk(self, root, kinds):
+        accepted = {k.value for k in kinds}
+        kinds_sql = ",".join(str(k) for k in accepted)
+
+        def _accept(eid):
+            kind = self._kinds[eid]
+            return kind in _COMPOUNDS and kind in accepted
+
+        if root is None:
+            eids = (eid for eid in range(len(self._kinds)) if _accept(eid))
+        else:
+            eid = self._eid_of(root)
+            if eid is None or self._kinds[eid] not in _COMPOUNDS:
+                return
+
+            eids = self._graph.subtree(eid, _accept)
+
+        order = self._graph.top_down(eids)
+
+        # The hierarchy_parent index keeps the children of each element in
+        # rowid order, so this needs no sorting.
+        query = """SELECT p.eid, p.refid, p.name, p.kind,
+                          c.refid, c.name, c.kind, c.kind IN compound_kinds
+        FROM elements AS p
+            LEFT JOIN hierarchy AS h ON h.p_eid = p.eid
+            LEFT JOIN elements AS c ON c.eid = h.eid AND c.kind IN ({})
+        WHERE p.eid IN (?s)
+        ORDER BY p.eid, h.rowid""".format(kinds_sql)
+
+        # The rows come sorted by eid, so they are fetched one chunk at a time
+        # and then put back in top-down order.
+        for i in range(0, len(order), self._IN_CHUNK):
+            chunk = order[i:i + self._IN_CHUNK]
+            walked = {}
+
+            for eid, group in itertools.groupby(self._select_in(query, chunk),
+                                                lambda row: row[0]):
+                row = next(group)
+                compound = SearchResult(RefId(row[1]), row[2], _KINDS[row[3]])
+                r = [[], []]
+
+                for row in itertools.chain([row], group):
+                    if row[4] is not None:
+                        r[row[7]].append(SearchResult(RefId(row[4]), row[5],
+                                                      _KINDS[row[6]]))
+
+                walked[eid] = compound, r[1], r[0]
+
+            for eid in chunk:
+                yield walked[eid]
+
+
+BACKENDS = ("sqlite", "memory")
+"""Names of the available DoxyDB backends."""
+
+
+def get_backend(name):
+    """Get a Backend subclass given its name (one of BACKENDS)."""
+    if name == "sqlite":
+        return SQLiteBackend
+    elif name == "memory":
+        # Imported here because memdb depends on this module.
+        from .memdb import MemoryBackend
+        return MemoryBackend
+    else:
+        raise ValueError("Unknown DB backend: %s" % name)
+
+
+class DoxyDB:
+    """Interface to the Doxygen DB
+
+    The Doxygen DB is just a directory filled with xml files. It should contain
+    an "index.xml". The files may also be compressed or stored in a zip
+    archive, see antidox.xmlsource.
+
+    Doxygen contains compounds and members. We will refer to both as "elements".
+    The nesting of elements seems quite arbitrary, things like "function" can
+    appear nested under both a "file" and a "group". "struct" in the other hand,
+    appear as top-level in the index, though in reality they are contained in a
+    file and in maybe a group.
+
+    DoxyDB stores the elements and their relationships in a Backend to sort
+    this problem. The default one uses a SQLite database. The "memory"
+    backend uses plain Python data structures, avoiding the per-query
+    overhead of SQLite.
+
+    Interestingly, doxygen can create a sqlite3 db (GENERATE_SQLITE3), but
+    it's not very well documented (ironic, isn't it?). If doxy_sqlite3 is
+    given, the elements and most of the hierarchy are copied from that
+    database instead of parsing index.xml and every compound file. The XML
+    is still needed for rendering and for nesting enumvalues.
+
+    Read-only index: After the initial database creation, no further modification are done by any
+    method. This ensures DoxyDB is safe to use for parallel builds (where there
+    will be multiple independent processes, each with a copy of the in-memory DB)
+
+    refid: Each element in Doxygen is uniquely defined by a "refid", consisting of a
+    string of the form string_part_1id_part.
+    """
+    # TODO: check if a file can be used (and shared) instead if ":memory:"
+
+    # Increment this when the schema changes, so that pickles created by
+    # older versions are rejected.
+    SCHEMA_VERSION = 3
+
+    def __init__(self, xml_dir, backend="sqlite", doxy_sqlite3=None):
+        self._xml_dir = xml_dir
+        self._backend = get_backend(backend)()
+        self._doxy_sqlite3 = doxy_sqlite3
+        self._file_sizes = {name: size for name, (_, size)
+                            in xmlsource.scan(xml_dir).items()}
+
+        if doxy_sqlite3:
+            enum_scopes = self._backend.load_doxygen_sqlite3(doxy_sqlite3)
+            self._load_all_inner(enum_scopes, enumvalues_only=True)
+        else:
+            with xmlsource.open_xml(self._xml_dir, "index.xml") as f:
+                self._read_index(f)
+            self._load_all_inner()
+
+        self._backend.finish()
+
+    @classmethod
+    def from_backend(cls, xml_dir, backend, file_sizes=None):
+        """Create a DoxyDB around an already filled (and finished) Backend
+        object, without reading any XML.
+
+        file_sizes maps XML file names to their sizes, see _first_parent."""
+        db = cls.__new__(cls)
+        db._xml_dir = xml_dir
+        db._backend = backend
+        db._doxy_sqlite3 = None
+        db._file_sizes = file_sizes or {}
+
+        return db
+
+    # Pickle support
+    def __getstate__(self):
+        return {'_xml_dir': self._xml_dir, '_backend': self._backend,
+                '_doxy_sqlite3': self._doxy_sqlite3,
+                '_file_sizes': self._file_sizes,
+                '_schema_version': self.SCHEMA_VERSION}
+
+    def __setstate__(self, state):
+        if state.get('_schema_version') != self.SCHEMA_VERSION:
+            raise DoxyFormatError("Pickled DB has an incompatible schema")
+
+        self._xml_dir = state['_xml_dir']
+        self._backend = state['_backend']
+        self._doxy_sqlite3 = state.get('_doxy_sqlite3')
+        self._file_sizes = state.get('_file_sizes', {})
+
+    @property
+    def backend(self):
+        """Name of the storage backend."""
+        return self._backend.name
+
+    @property
+    def doxy_sqlite3(self):
+        """Doxygen SQLite3 database the index was built from, or None if it
+        was built by reading index.xml."""
+        return self._doxy_sqlite3
+
+    @property
+    def _db_conn(self):
+        """SQLite connection (only available with the "sqlite" backend)."""
+        return self._backend._db_conn
 
     def _read_index(self, indexfile):
         """Parse index.xml and insert the elements in the database."""
@@ -508,20 +1336,25 @@ class DoxyDB:
                 raise DoxyFormatError("Element definition without a name: %s"
                                       % elem.attrib["refid"]) from e
 
-            self._insert_element(this_refid, name, kind, p_refid)
+            self._backend.insert_element(this_refid, name, kind, p_refid)
 
 
-    def _load_all_inner(self):
-        """Load the XML file for each compound and assemble the hierarchy."""
-        cur = self._db_conn.execute(
-                "SELECT prefix, id FROM elements WHERE kind in compound_kinds")
+    def _load_all_inner(self, compounds=None, enumvalues_only=False):
+        """Load the XML file for each compound (by default, all of them) and
+        assemble the hierarchy."""
+        if compounds is None:
+            compounds = self._backend.compounds()
 
-        for refid in cur:
-            fn = os.path.join(self._xml_dir, "{}.xml".format(RefId(*refid)))
-            self._read_inner(fn)
+        for refid in compounds:
+            with xmlsource.open_xml(self._xml_dir,
+                                    "{}.xml".format(refid)) as f:
+                self._read_inner(f, enumvalues_only)
 
-    def _read_inner(self, compoundfile):
-        """Gather all the inner elements for compounds in a file."""
+    def _read_inner(self, compoundfile, enumvalues_only=False):
+        """Gather all the inner elements for compounds in a file.
+
+        If enumvalues_only is True, only the enumvalue-enum relationships
+        are inserted."""
 
         for event, elem in _ez_iterparse(compoundfile, ("start",)):
             if elem.tag == "doxygen":
@@ -538,6 +1371,8 @@ class DoxyDB:
                             "expected parent of enumvalue to be a memberdef")
                     this_parent = RefId(parent_elem.attrib["id"])
                     id_attr = elem.attrib["id"]
+                elif enumvalues_only:
+                    continue
                 else:
                     s, inner, innerkind = elem.tag.partition("inner")
                     if s:  # the tag does not start with "inner"
@@ -549,10 +1384,7 @@ class DoxyDB:
                     this_parent = p_refid
                     id_attr = elem.attrib["refid"]
 
-                this_refid = RefId(id_attr)
-
-                self._db_conn.execute("INSERT INTO hierarchy values (?, ?, ?, ?)",
-                                      this_refid + this_parent)
+                self._backend.insert_hierarchy(RefId(id_attr), this_parent)
 
     # TODO: this may need caching???
     @_refid_str
@@ -571,15 +1403,20 @@ class DoxyDB:
         results: iterable yielding SearchResult
             All direct ancestors of this element.
         """
-        cur = self._db_conn.execute(
-        """SELECT p_prefix, p_id, name, kind
-        FROM hierarchy INNER JOIN elements
-            ON hierarchy.p_prefix = elements.prefix AND hierarchy.p_id = elements.id
-        WHERE hierarchy.prefix = ?
-              AND hierarchy.id = ?
-              AND kind in compound_kinds""", refid)
+        return iter(self._backend.compound_parents(refid))
 
-        return (SearchResult(RefId(*ref), name, kind) for *ref, name, kind in cur)
+    @_refid_str
+    def find_ancestors(self, refid):
+        """Get all the elements that contain the given one, directly or
+        indirectly.
+
+        Returns
+        -------
+
+        ancestors: dictionary mapping refids to the distance (1 for direct
+            parents) from the given element.
+        """
+        return self._backend.ancestors_of([refid])[refid]
 
     @_refid_str
     def find_children(self, refid):
@@ -595,23 +1432,7 @@ class DoxyDB:
             Descendents that are compounds, and as such may contain children.
         """
         # TODO: add parameter to filter by kind
-        cur = self._db_conn.execute(
-        """SELECT hierarchy.prefix, hierarchy.id, name, kind,
-                  kind IN compound_kinds as is_compound
-        FROM hierarchy INNER JOIN elements
-            ON hierarchy.prefix = elements.prefix AND hierarchy.id = elements.id
-        WHERE hierarchy.p_prefix = ?
-              AND hierarchy.p_id = ?
-        ORDER BY
-              is_compound""",
-            refid)
-
-        r = [(), ()]
-        for iscompound, g in itertools.groupby(cur, lambda x: x["is_compound"]):
-            r[iscompound] = [SearchResult(RefId(prefix, _id), name, kind)
-                             for prefix, _id, name, kind, _ in g]
-
-        return r
+        return self._backend.children(refid)
 
     def find(self, kinds = None, no_parent = False):
         """Find all elements of the specified kinds.
@@ -635,27 +1456,39 @@ class DoxyDB:
             _kinds = list(set(Kind.__members__.values())
                           - set(Kind.subordinate()))
 
-        query = (
-        """WITH
-            allowed_kinds (kind) AS (
-                VALUES {}
-            )
-            SELECT elements.* FROM elements
-            INNER JOIN allowed_kinds as ak
-                ON ak.kind == elements.kind
-        """).format(",".join(itertools.repeat("(?)", len(_kinds))))
+        return self._backend.find(_kinds, no_parent)
 
-        if no_parent:
-            query += """
-            LEFT JOIN hierarchy as h
-                ON h.prefix == elements.prefix AND h.id == elements.id
-            WHERE h.p_prefix IS NULL AND h.p_id IS NULL
-            """
+    def walk(self, root=None, kinds=None):
+        """Walk the hierarchy, in the spirit of os.walk(), with compounds as
+        directories and members as files.
+
+        The hierarchy is read in a few large queries, so this is much faster
+        than calling find_children() for each compound. Compounds are returned
+        top-down: a compound always comes after its ancestors.
+
+        Parameters
+        ----------
+
+        root: refid of a compound. If given, only this compound and the ones
+            under it are returned. Otherwise, all compounds are.
+        kinds: list of Kind to filter by, as in find(). Compounds of other
+            kinds are not walked into.
+
+        Returns
+        -------
 
-        cur = self._db_conn.execute(query, _kinds)
+        walker: iterable yielding (compound, subcompounds, members) tuples,
+            where compound is a SearchResult and subcompounds and members are
+            lists of SearchResult for its direct children.
+        """
+        if kinds is not None:
+            _kinds = kinds
+        else:
+            _kinds = list(set(Kind.__members__.values())
+                          - set(Kind.subordinate()))
 
-        return (SearchResult(RefId(*ref), name, kind)
-                for *ref, name, kind in cur)
+        return self._backend.walk(None if root is None else RefId(root),
+                                  _kinds)
 
     @_refid_str
     def refid_to_target(self, refid):
@@ -664,54 +1497,24 @@ class DoxyDB:
         Since targets must be descendents if a file element, this method will
         fail for user-defined constructs like groups.
         """
-        # If we omit user-defined constructs like groups, the elements form
-        # a tree, where the files are roots.
-        # The query below traverses the tree until it reaches a file and returns
-        # the nodes.
-        cur = self._db_conn.execute(
-        """WITH RECURSIVE
-            parent (level, prefix, id) AS (
-                SELECT 0, prefix, id FROM elements
-                    WHERE prefix = ? AND id = ?
-                UNION
-                SELECT parent.level + 1, elements.prefix, elements.id
-                FROM parent
-                    INNER JOIN hierarchy
-                        ON hierarchy.prefix = parent.prefix AND
-                           hierarchy.id = parent.id
-                    INNER JOIN elements
-                        ON hierarchy.p_prefix = elements.prefix AND
-                           hierarchy.p_id = elements.id
-                WHERE NOT elements.kind IN syn_compound_kinds
-                LIMIT 20
-            )
-        SELECT name, kind FROM elements INNER JOIN parent
-            ON elements.prefix = parent.prefix AND elements.id = parent.id
-        GROUP BY level
-
-        """, refid)
-
-        nodes = list(cur)
+        nodes = self._backend.target_nodes(refid)
 
         if not len(nodes) > 0:
             raise InvalidTarget("No such refid: %s" % str(refid))
 
-        if not nodes[-1]['kind'] == Kind.FILE:
+        if not nodes[-1][1] == Kind.FILE:
             raise ConsistencyError("Root node is not a file")
 
         if len(nodes) == 1:
             # Fix for #15. Check if the resulting name is ambiguous.
-            path = nodes[0]['name']
-            n_matching = self._db_conn.execute(
-                """SELECT COUNT(*) FROM elements
-                    WHERE kind = ? AND  match_path(name, ?)
-                """, (Kind.FILE, path)).fetchone()[0]
+            path = nodes[0][0]
+            n_matching = self._backend.count_files(path)
 
             return Target(path if n_matching == 1
                           else ".{}{}".format(os.path.sep, path), '*')
         else:
-            return Target(nodes[-1]['name'],
-                          (n['name'] for n in reversed(nodes[:-1])))
+            return Target(nodes[-1][0],
+                          (n[0] for n in reversed(nodes[:-1])))
 
     @_refid_str
     def get(self, refid):
@@ -723,51 +1526,73 @@ class DoxyDB:
         row object (similar to a named tuple)
             with fields "name", "kind".
         """
-        cur = self._db_conn.execute(
-            """SELECT name, kind FROM elements WHERE prefix = ? AND id = ?""",
-            refid)
+        result = self._backend.get(refid)
 
-        # No need to check for more than one result, prefix and id are primary keys
-        try:
-            result = list(cur)[0]
-        except IndexError as e:
-            raise RefError("No such refid: %s" % str(refid)) from e
+        if result is None:
+            raise RefError("No such refid: %s" % str(refid))
 
-        return result
+        return ElementRow(*result)
 
     @staticmethod
-    def _cur_to_refid(cur, target, scoped = False):
-        """Turn a cursor into a Refid. Raise errors if it is empty or has more
-        than one element (except if scoped is True, see below.)
+    def _rows_to_refid(rows, target, scoped = False):
+        """Pick a Refid from a list of candidates. Raise errors if it is empty
+        or has more than one element (except if scoped is True, see below.)
 
-        The cursor should contain 3 columns, and be ordered in descending order
-        according to the first one:
+        rows should be a list of (closeness, refid) tuples, ordered in
+        descending order according to the first element:
 
-        in_scope
-            true if the target is a direct descendant of a "scope"
-            parameter. This is only relevant if scoped = True.
-        prefix
-            prefix of refid
-        id
-            id of refid
+        closeness
+            1/distance if the target is a descendant of a "scope" parameter,
+            0 otherwise. This is only relevant if scoped = True.
+        refid
+            a RefId
 
         Multiple results are tolerated if scoped is True, and there is exactly
-        one result with in_scope = True.
+        one result with the highest (non-zero) closeness.
         """
+        if not rows:
+            raise InvalidTarget("Cannot resolve target: %s" % str(target))
 
-        r = list(cur)
-
-        scoped_results = (x for x in r if x["in_scope"])
+        best = rows[0][0]
+        closest_results = (x for x in rows if x[0] == best)
 
-        if not r:
-            raise InvalidTarget("Cannot resolve target: %s" % str(target))
         # FIXME: this is failing for paths that are a prefix of another one.
-        if len(r) > 1 and (not scoped or not r[0]["in_scope"]
-                           or len(list(scoped_results)) > 1):
+        if len(rows) > 1 and (not scoped or not best
+                              or len(list(closest_results)) > 1):
             raise AmbiguousTarget("Target (%s) resolves to more than one element"
-                                      % str(target), [RefId(*row[1:]) for row in r])
+                                      % str(target), [row[1] for row in rows])
+
+        return rows[0][1]
 
-        return RefId(*r[0][1:])
+    @classmethod
+    def pick_candidate(cls, candidates, target, scope = None):
+        """Choose among the candidates returned by resolve_targets_bulk or
+        resolve_names_bulk.
+
+        This applies the same rules (and raises the same errors) as
+        resolve_target and resolve_name would for the given scope.
+        """
+        scope_ref = RefId(scope) if scope else None
+
+        rows = [(1 / ancestors[scope_ref] if scope_ref in ancestors else 0,
+                 refid) for refid, ancestors in candidates]
+        rows.sort(key=lambda r: r[0], reverse=True)
+
+        return cls._rows_to_refid(rows, target, scope is not None)
+
+    @staticmethod
+    def _target_spec(target):
+        """Return the (path, components, accept_level) for a target."""
+        components = tuple(target.name_components)
+        ncompo = len(components)
+
+        # Accept matches at level zero if the target refers to a file.
+        if ncompo == 1 and target.name == '*':
+            accept_level = 0
+        else:
+            accept_level = ncompo
+
+        return target.path, components, accept_level
 
     @_target_str
     def resolve_target(self, target, scope = None):
@@ -783,62 +1608,20 @@ class DoxyDB:
         If the string is ambiguous (i.e., more than one entity matches, an error
         is raised).
         The scope parameter allows for disambiguation by preferring results that
-        are children of a given refid. Even then, if there is more than one
-        result that matches both conditions, it is still an error.
+        are descendants of a given refid, the closest ones first. Even then, if
+        there is more than one result that matches both conditions at the same
+        distance, it is still an error.
         Because of the way Doxygen works with C, if there is a namespace it
         must be specified. This only happens with structs/unions defined inside
         other struct/unions.
         """
-        components = tuple(target.name_components)
-        ncompo = len(components)
-
-        # Accept matches at level zero if the target refers to a file.
-        if ncompo == 1 and target.name == '*':
-            accept_level = 0
-        else:
-            accept_level = ncompo
+        path_filter, components, accept_level = self._target_spec(target)
 
-        path_filter = target.path
-
-        scope_prefix, scope_id = RefId(scope) if scope else ("", "")
-
-        # The call to barename is a kind of hack. It is necessary because
-        #      doxygen stores some names with namespaces and some without.
-        # The DISTINCT keyword is there because sometimes the search returns
-        #      the same entity multiple times. I think it may only be because of
-        #      some bug in doxygen (further investigation is needed.)
-        cur = self._db_conn.execute(
-        """WITH RECURSIVE
-            components (level, compo) AS (
-                VALUES %s
-            ),
-            follow (level, prefix, id) AS (
-                SELECT 0, prefix, id FROM elements
-                    WHERE kind = ? AND match_path(name, ?)
-                UNION ALL
-                SELECT f.level + 1, h.prefix, h.id
-                FROM follow AS f
-                    INNER JOIN hierarchy AS h
-                        ON h.p_prefix = f.prefix AND h.p_id = f.id
-                    INNER JOIN elements AS e
-                        ON h.prefix = e.prefix AND h.id = e.id
-                    INNER JOIN components AS c
-                        ON f.level = c.level
-                WHERE barename(e.name) = c.compo
-            )
-        SELECT MAX(h.p_prefix = ? AND h.p_id = ?) AS in_scope, f.prefix, f.id FROM
-            (SELECT DISTINCT prefix, id FROM follow
-                 WHERE level = ?
-            ) AS f
-            LEFT JOIN hierarchy AS h
-                ON h.prefix = f.prefix AND h.id = f.id
-        GROUP BY f.prefix, f.id
-        ORDER BY in_scope DESC
-        """ % ",".join("(%s, ?)" % i for i in range(ncompo)),
-            components + (Kind.FILE, path_filter, scope_prefix, scope_id,
-                          accept_level))
+        rows = self._backend.target_candidates(
+                    components, path_filter, accept_level,
+                    RefId(scope) if scope else None)
 
-        return self._cur_to_refid(cur, target, scope is not None)
+        return self._rows_to_refid(rows, target, scope is not None)
 
     def resolve_name(self, kind, name, scope = None):
         """Find an element with the specified kind and name. If kind is not given,
@@ -849,52 +1632,104 @@ class DoxyDB:
 
         Ambiguity can be saved by providing a scope similar to `resolve_target`.
         """
+        rows = self._backend.name_candidates(kind, name,
+                                             RefId(scope) if scope else None)
 
-        scope_prefix, scope_id = RefId(scope) if scope else ("", "")
+        return self._rows_to_refid(rows, (kind, name), scope is not None)
 
-        cur = self._db_conn.execute(
-        """SELECT MAX(h.p_prefix = :scope_prefix AND h.p_id = :scope_id)
-                AS in_scope, e.prefix AS prefix, e.id AS id
-        FROM elements as e LEFT JOIN hierarchy as h
-          ON h.prefix = e.prefix AND h.id = e.id
-        WHERE (:ignore_kind OR e.kind = :kind) AND e.name = :name
-        GROUP BY e.prefix, e.id
-        ORDER BY in_scope DESC
-        """,
-        {"scope_prefix": scope_prefix, "scope_id": scope_id,
-        "ignore_kind": not bool(kind), "kind": kind, "name": name})
+    def resolve_targets_bulk(self, targets):
+        """Find the candidate entities for many targets with a single query.
+
+        This is the set-based counterpart of resolve_target. Instead of
+        choosing a refid, it returns all the candidates along with their
+        parents, so that the choice can be made later for any scope with
+        pick_candidate.
+
+        Parameters
+        ----------
+
+        targets: iterable of Target or target strings.
+
+        Returns
+        -------
+
+        candidates: dictionary mapping each Target to a list of
+            (refid, ancestors) tuples, where ancestors is a dictionary mapping
+            the refids of all ancestors to their distance (see
+            find_ancestors.)
+        """
+        targets = list({Target(t) for t in targets})
+
+        found = self._backend.targets_bulk(
+                            [self._target_spec(t) for t in targets])
+
+        ancestors = self._backend.ancestors_of(r for _, r in found)
+
+        result = {target: [] for target in targets}
+        for t, refid in found:
+            result[targets[t]].append((refid, ancestors[refid]))
+
+        return result
+
+    def resolve_names_bulk(self, kind_names):
+        """Find the candidate entities for many (kind, name) pairs.
 
-        return self._cur_to_refid(cur, (kind, name), scope is not None)
+        This is the set-based counterpart of resolve_name. As in that method,
+        the kind may be None to accept all kinds.
+
+        Returns
+        -------
+
+        candidates: dictionary mapping each (kind, name) tuple to a list of
+            (refid, ancestors) tuples (see resolve_targets_bulk.)
+        """
+        kind_names = set(kind_names)
+        by_name = {}
+        for kind, name in kind_names:
+            by_name.setdefault(name, []).append(kind)
+
+        found = self._backend.names_bulk(by_name)
+
+        ancestors = self._backend.ancestors_of(r for r, _, _ in found)
+
+        result = {kn: [] for kn in kind_names}
+        for refid, name, kind in found:
+            for wanted_kind in by_name[name]:
+                if not wanted_kind or wanted_kind == kind:
+                    result[(wanted_kind, name)].append(
+                        (refid, ancestors[refid]))
+
+        return result
 
     def _first_parent(self, refid, kind):
-        """Return the first compound containing an entity."""
+        """Return the compound whose file is cheapest to get an entity from.
+
+        Doxygen defines the same member in more than one place (e.g. in a
+        file and in a group). It is wasteful, though it makes our life easier:
+        we can choose. The one with the smallest file is taken, with ties
+        broken by the order of the hierarchy. The choice must not depend on
+        the state of the parse cache, so that an entity is always rendered
+        from the same file.
+        """
         if kind in Kind.subordinate():
-            cur = self._db_conn.execute(
-            """SELECT h1.p_prefix, h1.p_id
-            FROM hierarchy as h1 INNER JOIN elements
-                ON h1.p_prefix = elements.prefix AND h1.p_id = elements.id
-            INNER JOIN hierarchy as h2
-                ON h1.prefix = h2.p_prefix AND h1.id = h2.p_id
-            WHERE h2.prefix = ?
-                AND h2.id = ?
-                AND kind in compound_kinds
-            """, refid)
-            solutions = (RefId(*ref) for ref in cur)
+            solutions = self._backend.compound_grandparents(refid)
         else:
-            solutions = (res.refid for res in self.find_parents(refid))
+            solutions = [res.refid for res in self.find_parents(refid)]
 
-        # Doxygen defines the same member in more than one place.
-        # It is wasteful, though it makes our life easier.
-        try:
-            return next(solutions)
-        except StopIteration as e:
+        if not solutions:
             raise ConsistencyError(
-                    "Cannot find compound containing {}".format(refid)) from e
+                    "Cannot find compound containing {}".format(refid))
 
-    @_refid_str
-    def get_tree(self, refid):
-        """Get the xml element tree for an element"""
+        if len(solutions) == 1:
+            return solutions[0]
+
+        unknown = float("inf")
+        return min(solutions, key=lambda compound: self._file_sizes.get(
+                                    "{}.xml".format(compound), unknown))
 
+    def _tree_location(self, refid):
+        """Return the name of the file where an element is defined and an
+        XPath query to find it there."""
         refkind = self.get(refid)['kind']
         if refkind in Kind.compounds():
             # compounds are defined in their own file.
@@ -908,9 +1743,21 @@ class DoxyDB:
                       if not refkind in Kind.subordinate()
                       else '//{}[@id=$id]'.format(refkind.name.lower()))
 
-        # TODO: should we cache this?
-        fn = os.path.join(self._xml_dir, "{}.xml".format(definition_file_base))
-        compound_doc = _parse_xml(fn)
+        return "{}.xml".format(definition_file_base), xpathq
+
+    @_refid_str
+    def xml_file(self, refid):
+        """Get the name of the XML file (in the XML directory) where an
+        element is defined."""
+        return self._tree_location(refid)[0]
+
+    @_refid_str
+    def get_tree(self, refid):
+        """Get the xml element tree for an element"""
+        filename, xpathq = self._tree_location(refid)
+
+        # Parsed files are cached, see _parse_xml.
+        compound_doc = _parse_xml(self._xml_dir, filename)
 
         return compound_doc.xpath(xpathq, id=str(refid))[0]
 
@@ -962,5 +1809,3 @@ class DoxyDB:
         # FIXME: is this correct?
         raise ValueError("No c desctype for %s" % kind)
 
-    # TODO: hierarchy walker (sort of os.walkdir with compounds as dirs and members
-    #       as files???????)
@@ -0,0 +1,186 @@
+"""
+    antidox.graph
+    ~~~~~~~~~~~~~
+
+    Compact representation of the element hierarchy.
+
+    The parent-child relationships are stored in compressed sparse row (CSR)
+    form: for each direction there is an array of offsets, indexed by node,
+    pointing into a flat array of node numbers. The ancestors of every node
+    (together with their distance) are computed once, when the graph is
+    built, so that checking whether an element is under a given scope is a
+    binary search instead of a recursive query.
+"""
+
+import bisect
+from array import array
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+def _csr(n_nodes, pairs):
+    """Build (offsets, index) arrays from a list of (node, other) pairs that
+    is sorted by node."""
+    offsets = array('I', bytes(array('I').itemsize * (n_nodes + 1)))
+
+    for node, _ in pairs:
+        offsets[node + 1] += 1
+
+    for i in range(n_nodes):
+        offsets[i + 1] += offsets[i]
+
+    return offsets, array('I', (other for _, other in pairs))
+
+
+class HierarchyGraph:
+    """Immutable graph of parent-child relationships between nodes numbered
+    from 0 to n_nodes - 1.
+
+    Parameters
+    ----------
+
+    n_nodes: number of nodes.
+    edges: iterable of (child, parent) pairs. The children of each node are
+        kept in the order in which they are given here, while parents are
+        sorted.
+
+    The hierarchy should not have cycles. If it does, the back edges are
+    ignored when computing the ancestors.
+    """
+    def __init__(self, n_nodes, edges):
+        edges = list(edges)
+
+        self.n_nodes = n_nodes
+        self._p_offsets, self._p_index = _csr(n_nodes, sorted(edges))
+        # sorted() is stable: children keep their original order.
+        self._c_offsets, self._c_index = _csr(
+                n_nodes, sorted(((p, c) for c, p in edges),
+                                key=lambda e: e[0]))
+
+        self._build_closure()
+
+    def _build_closure(self):
+        closure = [None] * self.n_nodes
+
+        for start in range(self.n_nodes):
+            if closure[start] is not None:
+                continue
+
+            # Depth-first traversal so that the ancestors of the parents are
+            # always known before the node itself is processed.
+            stack = [start]
+            on_stack = {start}
+            while stack:
+                node = stack[-1]
+                pending = [p for p in self.parents(node)
+                           if closure[p] is None and p not in on_stack]
+                if pending:
+                    stack.extend(pending)
+                    on_stack.update(pending)
+                    continue
+
+                stack.pop()
+                on_stack.discard(node)
+
+                if closure[node] is not None:
+                    continue
+
+                ancestors = {}
+                for p in self.parents(node):
+                    ancestors[p] = 1
+                    for a, d in (closure[p] or {}).items():
+                        if a != node and ancestors.get(a, d + 2) > d + 1:
+                            ancestors[a] = d + 1
+
+                closure[node] = ancestors
+
+        pairs = sorted((node, a) for node, ancestors in enumerate(closure)
+                       for a in ancestors)
+        self._a_offsets, self._a_index = _csr(self.n_nodes, pairs)
+        self._a_distance = array('H', (closure[node][a] for node, a in pairs))
+
+    def parents(self, node):
+        """Direct parents of a node, in ascending order."""
+        return self._p_index[self._p_offsets[node]:self._p_offsets[node + 1]]
+
+    def children(self, node):
+        """Direct children of a node, in insertion order."""
+        return self._c_index[self._c_offsets[node]:self._c_offsets[node + 1]]
+
+    def ancestors(self, node):
+        """Return a list of (ancestor, distance) for all ancestors of a node,
+        sorted by ancestor. Distance is 1 for direct parents."""
+        start, end = self._a_offsets[node], self._a_offsets[node + 1]
+        return list(zip(self._a_index[start:end], self._a_distance[start:end]))
+
+    def distance(self, node, ancestor):
+        """Return the length of the shortest path from node up to ancestor,
+        or None if it is not an ancestor."""
+        start, end = self._a_offsets[node], self._a_offsets[node + 1]
+        i = bisect.bisect_left(self._a_index, ancestor, start, end)
+
+        if i < end and self._a_index[i] == ancestor:
+            return self._a_distance[i]
+
+        return None
+
+    def walk_up(self, node, accept):
+        """Follow the first parent for which accept(parent) is true until the
+        top is reached. Return the list of nodes visited, starting with node.
+        """
+        path = [node]
+        seen = {node}
+
+        while True:
+            for p in self.parents(node):
+                if p not in seen and accept(p):
+                    break
+            else:
+                return path
+
+            path.append(p)
+            seen.add(p)
+            node = p
+
+    def subtree(self, node, accept):
+        """Return the sorted list of nodes that can be reached from node by
+        going down through nodes for which accept(child) is true, including
+        node itself."""
+        seen = {node}
+        pending = [node]
+
+        while pending:
+            for c in self.children(pending.pop()):
+                if c not in seen and accept(c):
+                    seen.add(c)
+                    pending.append(c)
+
+        return sorted(seen)
+
+    def top_down(self, nodes):
+        """Sort nodes so that each one comes after all its ancestors that are
+        also in nodes. Nodes with the same number of such ancestors are kept
+        in ascending order.
+
+        An ancestor of a node has strictly fewer ancestors than the node
+        itself, so the count is a valid sort key."""
+        nodes = set(nodes)
+        offsets, index = self._a_offsets, self._a_index
+
+        return sorted(nodes, key=lambda n: (
+            sum(a in nodes for a in index[offsets[n]:offsets[n + 1]]), n))
+
+    def closeness(self, node, scope):
+        """Return 1/distance if scope is an ancestor of node, else 0."""
+        if scope is None:
+            return 0
+
+        d = self.distance(node, scope)
+        return 1 / d if d else 0
+
+    def rank(self, nodes, scope):
+        """Sort nodes by decreasing closeness to a scope node (which may be
+        None) and then by node number. Return a list of (closeness, node)."""
+        rows = sorted((-self.closeness(n, scope), n) for n in nodes)
+        return [(-c, n) for c, n in rows]
@@ -0,0 +1,266 @@
+"""
+    antidox.index
+    ~~~~~~~~~~~~~
+
+    Prebuilt index files.
+
+    An index file is a SQLite database holding the elements of a DoxyDB and
+    the relationships between them, together with a header that describes
+    the file and the XML it was built from. Unlike pickles (see the shell's
+    ``dump`` command and :py:mod:`antidox.watch`), index files do not depend
+    on the Python or antidox version, only on the format version, so they
+    can be produced once (e.g. in the CI job that runs Doxygen) and used by
+    every documentation build::
+
+      antidox-index build path/to/xml index.db
+      antidox-index info index.db
+
+    Sphinx reads it through the ``antidox_prebuilt_index`` config value.
+
+    Kinds are stored as integers, but the file also contains a table with
+    their names, which are used to convert them when loading.
+"""
+
+import argparse
+import datetime
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from . import doxy
+from . import xmlsource
+from .doxy import Kind
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+FORMAT_VERSION = 1
+
+# Stored in the SQLite header, so that index files can be identified
+# without reading them (the bytes spell "adox".)
+APPLICATION_ID = 0x61646f78
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+
+CREATE TABLE kinds (value INTEGER PRIMARY KEY, name TEXT NOT NULL);
+
+CREATE TABLE sources (name TEXT PRIMARY KEY, size INTEGER NOT NULL);
+
+CREATE TABLE elements (
+    eid INTEGER PRIMARY KEY,
+    refid TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    kind INTEGER NOT NULL REFERENCES kinds(value)
+    );
+
+CREATE TABLE hierarchy (
+    eid INTEGER NOT NULL REFERENCES elements(eid),
+    p_eid INTEGER NOT NULL REFERENCES elements(eid)
+    );
+"""
+
+# Queries for Backend.copy_sqlite.
+_ELEMENTS = """
+SELECT e.refid, e.name, kind_value(k.name)
+FROM src.elements AS e INNER JOIN src.kinds AS k ON k.value = e.kind
+WHERE kind_value(k.name) IS NOT NULL
+ORDER BY e.eid
+"""
+
+_HIERARCHY = """
+SELECT c.refid AS refid, p.refid AS p_refid, h.rowid AS ord
+FROM src.hierarchy AS h
+    INNER JOIN src.elements AS c ON c.eid = h.eid
+    INNER JOIN src.elements AS p ON p.eid = h.p_eid
+"""
+
+
+def fingerprint(xml_source):
+    """Compute a fingerprint of an XML source.
+
+    This is the SHA-256 hash of index.xml. The rest of the files are not
+    read, since the index only depends on them through the relationships
+    between compounds. Modification times are not used either, because they
+    are not preserved when the XML is moved between machines.
+    """
+    h = hashlib.sha256()
+
+    with xmlsource.open_xml(xml_source, "index.xml") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def write_index(db, filename, xml_source=None):
+    """Write the contents of a DoxyDB to an index file.
+
+    The file is written atomically, like antidox.watch.save_snapshot does.
+
+    Parameters
+    ----------
+
+    db: DoxyDB, with any backend.
+    filename: output file.
+    xml_source: XML the DB was built from. By default, the DB's own.
+    """
+    if xml_source is None:
+        xml_source = db._xml_dir
+
+    elements, hierarchy = db._backend.dump()
+    sources = xmlsource.scan(xml_source)
+
+    meta = {
+        "format": "antidox-index",
+        "format_version": FORMAT_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "xml_source": os.path.abspath(xml_source),
+        "fingerprint": fingerprint(xml_source),
+    }
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    os.close(fd)
+
+    # mkstemp creates files that only the owner can read, but index files
+    # are meant to be shared.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_name, 0o666 & ~umask)
+
+    try:
+        conn = sqlite3.connect(tmp_name)
+        try:
+            conn.execute("PRAGMA application_id = %d" % APPLICATION_ID)
+            conn.execute("PRAGMA user_version = %d" % FORMAT_VERSION)
+            conn.executescript(_SCHEMA)
+
+            conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                             ((k, str(v)) for k, v in meta.items()))
+            conn.executemany("INSERT INTO kinds VALUES (?, ?)",
+                             ((k.value, k.name.lower()) for k in Kind))
+            conn.executemany("INSERT INTO sources VALUES (?, ?)",
+                             ((name, size) for name, (_, size)
+                              in sorted(sources.items())))
+
+            eids = {refid: eid for eid, (refid, _, _)
+                    in enumerate(elements, 1)}
+            conn.executemany("INSERT INTO elements VALUES (?, ?, ?, ?)",
+                             ((eids[refid], str(refid), name, kind.value)
+                              for refid, name, kind in elements))
+            conn.executemany("INSERT INTO hierarchy VALUES (?, ?)",
+                             ((eids[r], eids[p]) for r, p in hierarchy))
+            conn.commit()
+        finally:
+            conn.close()
+
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def read_header(filename):
+    """Read and validate the header of an index file.
+
+    Returns
+    -------
+
+    meta: dictionary with the (string) values in the meta table, see
+        write_index.
+
+    Raises DoxyFormatError if the file is not an index file or has an
+    unsupported format version.
+    """
+    if not os.path.isfile(filename):
+        raise FileNotFoundError("Index file not found: %s" % filename)
+
+    conn = sqlite3.connect(doxy._sqlite_ro_uri(filename), uri=True)
+    try:
+        app_id, = conn.execute("PRAGMA application_id").fetchone()
+        if app_id != APPLICATION_ID:
+            raise doxy.DoxyFormatError("Not an antidox index: %s" % filename)
+
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError as e:
+        raise doxy.DoxyFormatError("Not an antidox index: %s (%s)"
+                                   % (filename, e)) from e
+    finally:
+        conn.close()
+
+    if meta.get("format_version") != str(FORMAT_VERSION):
+        raise doxy.DoxyFormatError(
+            "Index %s has format version %s, but version %d is required"
+            % (filename, meta.get("format_version"), FORMAT_VERSION))
+
+    return meta
+
+
+def load_index(filename, xml_dir=None, backend="sqlite"):
+    """Create a DoxyDB from an index file.
+
+    Parameters
+    ----------
+
+    filename: index file.
+    xml_dir: XML source to use for rendering. By default, the one the index
+        was built from.
+    backend: storage backend name (see DoxyDB).
+    """
+    meta = read_header(filename)
+
+    storage = doxy.get_backend(backend)()
+    storage.copy_sqlite(filename, _ELEMENTS, _HIERARCHY)
+    storage.finish()
+
+    conn = sqlite3.connect(doxy._sqlite_ro_uri(filename), uri=True)
+    try:
+        file_sizes = dict(conn.execute("SELECT name, size FROM sources"))
+    finally:
+        conn.close()
+
+    return doxy.DoxyDB.from_backend(
+                xml_dir if xml_dir is not None else meta["xml_source"],
+                storage, file_sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                description="Build and inspect antidox index files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build an index file")
+    build.add_argument('--doxy-sqlite3',
+                       help="Read the index from the database created by "
+                            "Doxygen's GENERATE_SQLITE3 option.")
+    build.add_argument('xml_dir', help="Doxygen XML directory")
+    build.add_argument('output', help="Output file")
+
+    info = subparsers.add_parser("info", help="Show the header of an index")
+    info.add_argument('index_file')
+
+    ns = parser.parse_args()
+
+    if ns.command == "build":
+        t0 = time.monotonic()
+        # The index does not depend on the backend, use the fastest one.
+        db = doxy.DoxyDB(ns.xml_dir, "memory", ns.doxy_sqlite3)
+        write_index(db, ns.output)
+        print("Index written to %s in %.2f seconds"
+              % (ns.output, time.monotonic() - t0))
+    else:
+        try:
+            meta = read_header(ns.index_file)
+        except (OSError, doxy.DoxyFormatError) as e:
+            parser.exit(1, "%s\n" % e)
+
+        for k, v in meta.items():
+            print("%s: %s" % (k, v))
+
+
+if __name__ == "__main__":
+    main()
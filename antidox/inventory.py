@@ -0,0 +1,238 @@
+"""
+    antidox.inventory
+    ~~~~~~~~~~~~~~~~~
+
+    Write a Sphinx inventory (``objects.inv``) straight from a DoxyDB.
+
+    Other projects can link to the API documented with antidox through
+    intersphinx, but for that they need the inventory, which Sphinx only
+    writes at the end of a full build. This module produces the same entries
+    from the DB alone, in seconds::
+
+      antidox-inventory --project RIOT --docname "api/{refid}" \\
+          path/to/xml objects.inv
+
+    The DB does not know which page documents each entity, so this is given
+    as a rule: the compounds of some kinds (by default files and groups) have
+    a page each, whose name is given by a format string. Any other entity is
+    documented in the page of each of the compounds that contain it, directly
+    or through compounds that do not have a page, like antidox-stubs (see
+    :py:mod:`antidox.stubs`) does. The default rule matches the stubs
+    written by that command in the root of the documentation.
+
+    Entities are named by refid, in the C domain if they have a C description
+    type (see DoxyDB.guess_desctype) or as labels otherwise, which is what
+    the ``doxy:r`` role refers to.
+"""
+
+import argparse
+import os
+import tempfile
+import zlib
+
+from . import doxy
+from .doxy import Kind
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+PAGE_KINDS = (Kind.FILE, Kind.GROUP)
+
+_HEADER = ("# Sphinx inventory version 2\n"
+           "# Project: {}\n"
+           "# Version: {}\n"
+           "# The remainder of this file is compressed using zlib.\n")
+
+
+def _entry(name, role, priority, uri, dispname):
+    """Format an inventory line, abbreviated in the same way as Sphinx
+    does."""
+    if uri.endswith(name):
+        uri = uri[:-len(name)] + "$"
+
+    return "{} {} {} {} {}\n".format(name, role, priority, uri,
+                                     "-" if dispname == name else dispname)
+
+
+def _label(name):
+    # Same as docutils.nodes.fully_normalize_name.
+    return " ".join(name.lower().split())
+
+
+def _entity_entries(db, entity, uri_base):
+    """Generate the inventory lines for an entity (a SearchResult)
+    documented in a page."""
+    refid = str(entity.refid)
+    uri = "{}#c.{}".format(uri_base, refid)
+
+    if entity.kind == Kind.ENUMVALUE:
+        desctype = "value"
+    else:
+        try:
+            desctype = db.guess_desctype(entity.refid)
+        except ValueError:
+            desctype = None
+
+    if desctype is not None:
+        yield _entry(refid, "c:" + desctype, 1, uri, refid)
+    else:
+        # The "names" of compounds (see compound.xsl), which become labels.
+        for label in (refid, "{}[{}]".format(entity.name,
+                                             entity.kind.name.lower())):
+            yield _entry(_label(label), "std:label", -1, uri, entity.name)
+
+
+def _page_docnames(db, page_kinds, docname):
+    """Map each compound to the list of pages where it is documented."""
+    pages = {}
+    subcompounds_of = {}
+
+    for compound, subcompounds, _ in db.walk():
+        if compound.kind in page_kinds:
+            pages[compound.refid] = docname.format(
+                refid=compound.refid, name=compound.name,
+                kind=compound.kind.name.lower())
+        if subcompounds:
+            subcompounds_of[compound.refid] = subcompounds
+
+    docnames = {refid: [page] for refid, page in pages.items()}
+
+    for refid, page in pages.items():
+        pending = list(subcompounds_of.get(refid, ()))
+        while pending:
+            sub = pending.pop()
+            if sub.kind in page_kinds:
+                continue
+
+            sub_docnames = docnames.setdefault(sub.refid, [])
+            if page not in sub_docnames:
+                sub_docnames.append(page)
+                pending.extend(subcompounds_of.get(sub.refid, ()))
+
+    return pages, docnames
+
+
+def inventory_lines(db, page_kinds=PAGE_KINDS, docname="{refid}",
+                    suffix=".html"):
+    """Generate the (uncompressed) lines of the inventory of a DB.
+
+    Parameters
+    ----------
+
+    db: DoxyDB object.
+    page_kinds: kinds of the compounds that have a page.
+    docname: format string for the name of the page of a compound. It may
+        use the "refid", "name" and "kind" (in lowercase) fields.
+    suffix: suffix of the output files (".html" for the HTML builder).
+    """
+    pages, docnames = _page_docnames(db, page_kinds, docname)
+
+    for refid, page in pages.items():
+        name, _ = db.get(refid)
+        yield _entry(page, "std:doc", -1, page + suffix, name)
+
+    # Each compound is walked once, and its members are written for each of
+    # the pages it appears in.
+    for compound, _, members in db.walk():
+        compound_docnames = docnames.get(compound.refid)
+        if not compound_docnames:
+            continue
+
+        entities = [compound]
+        for member in members:
+            entities.append(member)
+            if member.kind == Kind.ENUM:
+                enumvalues, _ = db.find_children(member.refid)
+                entities.extend(enumvalues)
+
+        for page in compound_docnames:
+            for entity in entities:
+                yield from _entity_entries(db, entity, page + suffix)
+
+
+def write_inventory(db, filename, project="", version="", **kwargs):
+    """Write an objects.inv file for a DB.
+
+    The entries are compressed as they are generated. The file is replaced
+    atomically, like antidox.index.write_index does. The remaining arguments
+    are those of inventory_lines().
+
+    Returns
+    -------
+
+    count: number of entries written.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+
+    # mkstemp creates files that only the owner can read.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_name, 0o666 & ~umask)
+
+    count = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.format(project, version).encode("utf-8"))
+
+            compressor = zlib.compressobj(9)
+            for line in inventory_lines(db, **kwargs):
+                f.write(compressor.compress(line.encode("utf-8")))
+                count += 1
+            f.write(compressor.flush())
+
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                description="Write a Sphinx inventory (objects.inv) for a "
+                            "Doxygen project")
+
+    parser.add_argument('-p', '--project', default="",
+                        help="Project name, written in the header.")
+    parser.add_argument('-v', '--version', default="",
+                        help="Project version, written in the header.")
+    parser.add_argument('-k', '--kind', action="append",
+                        choices=[k.name.lower() for k in Kind.compounds()],
+                        help="Kinds of compounds that have their own page "
+                             "(default: file and group). May be given more "
+                             "than once.")
+    parser.add_argument('-d', '--docname', default="{refid}",
+                        help="Name of the page of a compound. It is a format "
+                             "string with the fields {refid}, {name} and "
+                             "{kind} (default: %(default)s).")
+    parser.add_argument('-s', '--suffix', default=".html",
+                        help="Suffix of the output files (default: "
+                             "%(default)s).")
+    parser.add_argument('-b', '--backend', choices=doxy.BACKENDS,
+                        default="memory", help="DB storage backend.")
+    parser.add_argument('--doxy-sqlite3',
+                        help="Build the index from the database created by "
+                             "Doxygen's GENERATE_SQLITE3 option.")
+    parser.add_argument('xml_dir', help="Doxygen XML directory")
+    parser.add_argument('output', help="Output file")
+
+    ns = parser.parse_args()
+
+    page_kinds = (tuple(k for k in Kind.compounds()
+                        if k.name.lower() in ns.kind)
+                  if ns.kind else PAGE_KINDS)
+
+    db = doxy.DoxyDB(ns.xml_dir, ns.backend, ns.doxy_sqlite3)
+
+    count = write_inventory(db, ns.output, ns.project, ns.version,
+                            page_kinds=page_kinds, docname=ns.docname,
+                            suffix=ns.suffix)
+
+    print("%d entries written to %s" % (count, ns.output))
+
+
+if __name__ == "__main__":
+    main()
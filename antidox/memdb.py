@@ -0,0 +1,306 @@
+"""
+    antidox.memdb
+    ~~~~~~~~~~~~~
+
+    Pure Python storage backend for DoxyDB.
+
+    Elements are numbered in insertion order and their attributes kept in
+    parallel lists indexed by that number, while the hierarchy is stored in a
+    :py:class:`antidox.graph.HierarchyGraph`. Most queries are then plain
+    list and dictionary lookups, which for small and medium sized projects is
+    much faster than going through SQLite.
+
+    Select it with ``DoxyDB(xml_dir, backend="memory")`` or with the
+    ``antidox_db_backend`` config value.
+"""
+
+import bisect
+import pathlib
+from array import array
+
+from .doxy import (Backend, ConsistencyError, Kind, SearchResult, _KINDS,
+                   _UNDEFINED, _COMPOUNDS, _NOT_IN_TARGETS, _barename,
+                   _match_path)
+from .graph import HierarchyGraph
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+
+class MemoryBackend(Backend):
+    """Store the elements in Python lists and dictionaries.
+
+    Each element is identified by an integer (eid) that indexes the lists
+    below. Refids that are referenced before (or without) being inserted get
+    an eid, but their kind is _UNDEFINED.
+
+    While the DB is being built, the hierarchy is kept in adjacency lists,
+    which are turned into a HierarchyGraph by finish().
+
+    This backend must produce the same results as SQLiteBackend, including
+    the ordering of the results.
+    """
+    name = "memory"
+
+    def __init__(self):
+        self._eids = {}
+        self._refids = []
+        self._names = []
+        self._kinds = array('b')
+
+        self._parents = []
+        self._children = []
+        self._graph = None
+
+        self._build_indexes()
+
+    def __getstate__(self):
+        # The indexes are cheap to rebuild, so do not waste space in pickles.
+        return {k: getattr(self, k) for k in ('_refids', '_names', '_kinds',
+                                              '_graph')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._eids = {r: eid for eid, r in enumerate(self._refids)}
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self._by_name = {}
+        self._by_kind = {}
+        self._files_by_base = {}
+
+        for eid, kind in enumerate(self._kinds):
+            if kind == _UNDEFINED:
+                continue
+
+            name = self._names[eid]
+            self._by_name.setdefault(name, []).append(eid)
+            self._by_kind.setdefault(kind, []).append(eid)
+
+            if kind == Kind.FILE.value:
+                base = pathlib.PurePath(name).name
+                self._files_by_base.setdefault(base, []).append(eid)
+
+    def _eid(self, refid):
+        """Get the eid for a refid, allocating a new one if needed."""
+        try:
+            return self._eids[refid]
+        except KeyError:
+            eid = self._eids[refid] = len(self._refids)
+            self._refids.append(refid)
+            self._names.append(None)
+            self._kinds.append(_UNDEFINED)
+            self._parents.append([])
+            self._children.append([])
+            return eid
+
+    def _lookup(self, refid):
+        """Get the eid of an existing element, or None."""
+        eid = self._eids.get(refid)
+
+        if eid is None or self._kinds[eid] == _UNDEFINED:
+            return None
+
+        return eid
+
+    def _result(self, eid):
+        return SearchResult(self._refids[eid], self._names[eid],
+                            _KINDS[self._kinds[eid]])
+
+    def insert_element(self, refid, name, kind, parent_refid=None):
+        eid = self._eid(refid)
+
+        if self._kinds[eid] == _UNDEFINED:
+            self._names[eid] = name
+            self._kinds[eid] = kind.value
+
+        if parent_refid is not None:
+            self.insert_hierarchy(refid, parent_refid)
+
+    def insert_hierarchy(self, refid, parent_refid):
+        eid = self._lookup(refid)
+        if eid is None:
+            raise ConsistencyError("Unknown element in hierarchy: %s"
+                                   % str(refid))
+
+        p_eid = self._eid(parent_refid)
+
+        parents = self._parents[eid]
+        i = bisect.bisect_left(parents, p_eid)
+
+        # Like the SQLite backend, a duplicate relationship is moved to the
+        # end of the children list.
+        if i < len(parents) and parents[i] == p_eid:
+            self._children[p_eid].remove(eid)
+        else:
+            parents.insert(i, p_eid)
+
+        self._children[p_eid].append(eid)
+
+    def compounds(self):
+        return [self._refids[eid] for eid, kind in enumerate(self._kinds)
+                if kind in _COMPOUNDS]
+
+    def finish(self):
+        self._graph = HierarchyGraph(
+                len(self._refids),
+                ((c, p) for p, children in enumerate(self._children)
+                 for c in children))
+        del self._parents
+        del self._children
+
+        self._build_indexes()
+
+    def dump(self):
+        kinds = self._kinds
+        elements = [(self._refids[eid], self._names[eid], _KINDS[kind])
+                    for eid, kind in enumerate(kinds) if kind != _UNDEFINED]
+
+        # Only the order of the children of each element matters.
+        hierarchy = [(self._refids[c], self._refids[p])
+                     for p in range(len(kinds)) if kinds[p] != _UNDEFINED
+                     for c in self._graph.children(p)
+                     if kinds[c] != _UNDEFINED]
+
+        return elements, hierarchy
+
+    def get(self, refid):
+        eid = self._lookup(refid)
+
+        if eid is None:
+            return None
+
+        return self._names[eid], _KINDS[self._kinds[eid]]
+
+    def compound_parents(self, refid):
+        eid = self._lookup(refid)
+
+        if eid is None:
+            return []
+
+        return [self._result(p) for p in self._graph.parents(eid)
+                if self._kinds[p] in _COMPOUNDS]
+
+    def compound_grandparents(self, refid):
+        eid = self._lookup(refid)
+
+        if eid is None:
+            return []
+
+        parents = self._graph.parents
+        return [self._refids[g] for p in parents(eid) for g in parents(p)
+                if self._kinds[g] in _COMPOUNDS]
+
+    def children(self, refid):
+        eid = self._lookup(refid)
+
+        r = [[], []]
+        if eid is not None:
+            for c in self._graph.children(eid):
+                kind = self._kinds[c]
+                if kind != _UNDEFINED:
+                    r[kind in _COMPOUNDS].append(self._result(c))
+
+        return [l or () for l in r]
+
+    def walk(self, root, kinds):
+        accepted = {k.value for k in kinds}
+        kinds = self._kinds
+
+        if root is None:
+            eids = (eid for eid, kind in enumerate(kinds)
+                    if kind in _COMPOUNDS and kind in accepted)
+        else:
+            eid = self._lookup(root)
+            if eid is None or kinds[eid] not in _COMPOUNDS:
+                return
+
+            eids = self._graph.subtree(
+                eid, lambda c: kinds[c] in _COMPOUNDS and kinds[c] in accepted)
+
+        for eid in self._graph.top_down(eids):
+            r = [[], []]
+            for c in self._graph.children(eid):
+                if kinds[c] in accepted:
+                    r[kinds[c] in _COMPOUNDS].append(self._result(c))
+
+            yield self._result(eid), r[1], r[0]
+
+    def find(self, kinds, no_parent):
+        eids = sorted(eid for k in set(kinds)
+                      for eid in self._by_kind.get(k.value, ()))
+
+        return (self._result(eid) for eid in eids
+                if not (no_parent and self._graph.parents(eid)))
+
+    def target_nodes(self, refid):
+        eid = self._lookup(refid)
+
+        if eid is None:
+            return []
+
+        nodes = self._graph.walk_up(
+                    eid, lambda p: self._kinds[p] not in _NOT_IN_TARGETS)
+
+        return [(self._names[e], _KINDS[self._kinds[e]]) for e in nodes]
+
+    def _files(self, path):
+        if not path:
+            return self._by_kind.get(Kind.FILE.value, [])
+
+        # The last component of the path must always match.
+        return [eid for eid in
+                self._files_by_base.get(pathlib.PurePath(path).name, ())
+                if _match_path(self._names[eid], path)]
+
+    def count_files(self, path):
+        return len(self._files(path))
+
+    def _follow(self, components, path, accept_level):
+        """Return the set of eids matching a target."""
+        frontier = self._files(path)
+
+        children = self._graph.children
+        for compo in components[:accept_level]:
+            frontier = [c for f in frontier for c in children(f)
+                        if self._kinds[c] != _UNDEFINED
+                        and _barename(self._names[c]) == compo]
+
+        return set(frontier)
+
+    def _rows(self, eids, scope):
+        scope_eid = None if scope is None else self._lookup(scope)
+
+        return [(closeness, self._refids[eid])
+                for closeness, eid in self._graph.rank(eids, scope_eid)]
+
+    def target_candidates(self, components, path, accept_level, scope):
+        return self._rows(self._follow(components, path, accept_level), scope)
+
+    def name_candidates(self, kind, name, scope):
+        eids = [eid for eid in self._by_name.get(name, ())
+                if not kind or self._kinds[eid] == kind.value]
+
+        return self._rows(eids, scope)
+
+    def targets_bulk(self, specs):
+        return [(t, self._refids[eid]) for t, spec in enumerate(specs)
+                for eid in sorted(self._follow(spec[1], spec[0], spec[2]))]
+
+    def names_bulk(self, names):
+        eids = sorted(eid for name in set(names)
+                      for eid in self._by_name.get(name, ()))
+
+        return [(self._refids[eid], self._names[eid],
+                 _KINDS[self._kinds[eid]]) for eid in eids]
+
+    def ancestors_of(self, refids):
+        result = {}
+        for r in refids:
+            eid = self._lookup(r)
+            result[r] = {} if eid is None else {
+                self._refids[a]: d for a, d in self._graph.ancestors(eid)
+                if self._kinds[a] != _UNDEFINED}
+
+        return result
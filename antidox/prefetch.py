@@ -0,0 +1,165 @@
+"""
+    antidox.prefetch
+    ~~~~~~~~~~~~~~~~
+
+    Background loading of Doxygen XML files.
+
+    DoxyDB.get_tree() parses the file that contains an element the first time
+    it is needed, and keeps it in a small cache. A Prefetcher loads files into
+    that same cache on background threads (lxml does not hold the GIL while
+    parsing), so that when the tree is requested it is already there.
+
+    The directives queue the files of the children they are going to include
+    as soon as the inclusion list is known, and a set of "hot" compounds can
+    be queued when the build starts (see ``antidox_prefetch``).
+
+    The prefetcher only touches the parse cache: mapping entities to files
+    requires the DB, which is done by the caller, on its own thread.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import doxy
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+class Prefetcher:
+    """Load XML files from a source into the parse cache of antidox.doxy.
+
+    Each queued file is associated with one or more refids. Before the tree
+    of one of these refids is requested, wait() must be called, so that the
+    file is not parsed twice.
+
+    At most half as many files as the parse cache holds are queued and not
+    yet requested at any time, so that prefetched files are not evicted by
+    the following ones before they are used.
+
+    Parameters
+    ----------
+    source: XML directory or archive (see antidox.xmlsource). This must be
+        the same as that of the DB, since it is part of the cache key.
+    workers: number of threads.
+
+    Attributes
+    ----------
+    queued: number of files that were loaded in the background.
+    hits: number of requests for which the file was already loaded.
+    waits: number of requests that had to wait for the file to be loaded.
+    max_depth: maximum number of files waiting to be loaded.
+    """
+    def __init__(self, source, workers=2):
+        self.source = source
+        self.workers = workers
+
+        self.queued = 0
+        self.hits = 0
+        self.waits = 0
+        self.max_depth = 0
+
+        self._reset()
+
+    def _reset(self):
+        # Threads do not survive a fork: in a child process, the jobs of the
+        # parent never finish.
+        self._pid = os.getpid()
+        self._executor = None
+        self._jobs = {}
+        self._refids = {}
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    @property
+    def depth(self):
+        """Number of files waiting to be loaded (the queue depth)."""
+        return sum(not job[0].done() for job in self._jobs.values())
+
+    def _load(self, name):
+        try:
+            doxy._parse_xml(self.source, name)
+        except Exception:
+            # The error is raised again when the tree is requested.
+            pass
+
+    def prefetch(self, refid, name):
+        """Queue the file an entity is defined in.
+
+        Parameters
+        ----------
+        refid: Refid (or string) that will be passed to wait().
+        name: file name, as returned by DoxyDB.xml_file().
+
+        Returns
+        -------
+        queued: False if the file could not be queued because too many files
+            are pending, True otherwise.
+        """
+        self._check_pid()
+        refid = str(refid)
+
+        if refid in self._refids:
+            return True
+
+        job = self._jobs.get(name)
+        if job is None:
+            capacity = doxy._parse_xml.cache_info().maxsize // 2
+            if len(self._jobs) >= capacity:
+                self._forget_loaded()
+            if len(self._jobs) >= capacity:
+                return False
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers)
+
+            job = self._jobs[name] = [self._executor.submit(self._load, name),
+                                      0]
+            self.queued += 1
+            self.max_depth = max(self.max_depth, self.depth)
+
+        job[1] += 1
+        self._refids[refid] = name
+
+        return True
+
+    def _forget_loaded(self):
+        """Drop the files that are loaded but were not requested yet (hot
+        compounds that were not used, or children of a directive that failed
+        before rendering them.)"""
+        loaded = {name for name, job in self._jobs.items() if job[0].done()}
+
+        for name in loaded:
+            del self._jobs[name]
+
+        self._refids = {refid: name for refid, name in self._refids.items()
+                        if name not in loaded}
+
+    def wait(self, refid):
+        """Wait until the file of an entity is loaded, if it was queued."""
+        self._check_pid()
+
+        name = self._refids.pop(str(refid), None)
+        if name is None:
+            return
+
+        job = self._jobs[name]
+        if job[0].done():
+            self.hits += 1
+        else:
+            self.waits += 1
+            job[0].result()
+
+        job[1] -= 1
+        if not job[1]:
+            del self._jobs[name]
+
+    def report(self):
+        """Summary of the statistics, as a string."""
+        requests = self.hits + self.waits
+        return ("{} files prefetched, {} of {} requests found the file loaded "
+                "({:.0%}), maximum queue depth {}").format(
+                    self.queued, self.hits, requests,
+                    self.hits / requests if requests else 0, self.max_depth)
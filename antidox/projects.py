@@ -0,0 +1,296 @@
+"""
+    antidox.projects
+    ~~~~~~~~~~~~~~~~
+
+    Configuration and loading of Doxygen projects.
+
+    The project configured with the top level config values
+    (``antidox_doxy_xml_dir``, etc.) is the default project. Its DB is stored
+    in ``env.antidox_db``.
+
+    More projects can be given names in ``antidox_projects``, each with its
+    own XML, DoxyDB and stylesheet::
+
+        antidox_projects = {
+            "net": {"xml_dir": "../net/doxygen/xml"},
+            "drivers": {"prebuilt_index": "../drivers/index.db",
+                        "xml_stylesheet": "drivers.xsl"},
+            "kernel": "../kernel/doxygen/xml",   # Same as {"xml_dir": ...}
+        }
+
+    All projects are loaded lazily, the first time a document refers to
+    them (see :py:meth:`antidox.directives.DoxyDomain.get_db`), so a build
+    only pays for the projects it uses.
+"""
+
+import os
+import pickle
+
+from sphinx.util import logging
+
+from . import daemon
+from . import doxy
+from . import index
+from . import watch
+from . import xmlsource
+from .tagfile import TagDoxyDB
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT = ""
+"""Name of the default project."""
+
+# Project settings and the config values used for the default project.
+_SETTINGS = {
+    "xml_dir": "antidox_doxy_xml_dir",
+    "doxy_sqlite3": "antidox_doxy_sqlite3",
+    "tagfile": "antidox_doxy_tagfile",
+    "prebuilt_index": "antidox_prebuilt_index",
+    "index_file": "antidox_index_file",
+    "xml_stylesheet": "antidox_xml_stylesheet",
+    "db_backend": "antidox_db_backend",
+}
+
+# Settings that named projects take from the top level config if they do not
+# give them.
+_INHERITED = ("xml_stylesheet", "db_backend")
+
+
+class UnknownProject(doxy.RefError):
+    pass
+
+
+def is_configured(config, name):
+    """Check if there is a project with the given name."""
+    if not name:
+        return bool(config.antidox_doxy_xml_dir or config.antidox_doxy_tagfile
+                    or config.antidox_prebuilt_index)
+
+    return name in config.antidox_projects
+
+
+def get_settings(config, name):
+    """Get the settings of a project as a dictionary with the keys in
+    _SETTINGS.
+
+    Raises UnknownProject if there is no such project.
+    """
+    if not name:
+        return {k: getattr(config, v) for k, v in _SETTINGS.items()}
+
+    try:
+        project_cfg = config.antidox_projects[name]
+    except KeyError:
+        raise UnknownProject("Unknown Doxygen project: %s" % name) from None
+
+    if isinstance(project_cfg, str):
+        project_cfg = {"xml_dir": project_cfg}
+
+    unknown = project_cfg.keys() - _SETTINGS.keys()
+    if unknown:
+        raise ValueError("Unknown settings for project %s: %s"
+                         % (name, ", ".join(sorted(unknown))))
+
+    settings = {k: "" for k in _SETTINGS}
+    settings.update({k: getattr(config, _SETTINGS[k]) for k in _INHERITED})
+    settings.update(project_cfg)
+
+    return settings
+
+
+def source_date(settings):
+    """Find out when the inputs of a project were last modified.
+
+    Returns
+    -------
+
+    state: result of watch.scan_xml_dir for the XML source, or None if the
+        project uses a tagfile or only a prebuilt index, or the source does
+        not exist.
+    date: modification time of the newest input, or None if it does not
+        exist.
+    """
+    xml_dir = settings["xml_dir"]
+    tagfile = settings["tagfile"]
+    prebuilt_index = settings["prebuilt_index"]
+
+    if tagfile:
+        # Reference-only project: there is no XML.
+        state = None
+        date = os.path.getmtime(tagfile)
+    elif not xml_dir and prebuilt_index:
+        # Only the index is given. The XML it points to is not checked.
+        state = None
+        date = (os.path.getmtime(prebuilt_index)
+                if os.path.exists(prebuilt_index) else None)
+    else:
+        # Look at the files and not only at the directory: the directory
+        # mtime does not change when a file is rewritten in place.
+        state = (watch.scan_xml_dir(xml_dir) if os.path.exists(xml_dir)
+                 else None)
+        date = watch.newest_mtime(state) if state else None
+
+    doxy_sqlite3 = settings["doxy_sqlite3"]
+    if doxy_sqlite3 and date is not None:
+        date = max(date, os.path.getmtime(doxy_sqlite3))
+
+    return state, date
+
+
+def _stat(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return (st.st_mtime_ns, st.st_size)
+
+
+def quick_signature(settings):
+    """Get a cheap summary of the inputs of a project, from the stat of
+    only a few files (see xmlsource.signature). If it did not change, the
+    result of source_date did not change either, so incremental builds can
+    skip scanning the whole XML."""
+    return (xmlsource.signature(settings["xml_dir"])
+            if settings["xml_dir"] else None,
+            _stat(settings["tagfile"]),
+            _stat(settings["prebuilt_index"]),
+            _stat(settings["index_file"]),
+            _stat(settings["doxy_sqlite3"]))
+
+
+def _load_snapshot(index_file, state):
+    """Load the index published by antidox-watch, if it exists and it was
+    built from exactly the same XML files as the ones in the given state."""
+    if not index_file or not os.path.exists(index_file):
+        return None
+
+    try:
+        snapshot = watch.load_snapshot(index_file)
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        # It may have been truncated or overwritten by something else.
+        logger.warning("Cannot read index file %s (%s), ignoring it",
+                       index_file, e)
+        return None
+
+    if snapshot is None or snapshot.state != state:
+        logger.info("Index file %s is outdated, ignoring it", index_file)
+        return None
+
+    return snapshot
+
+
+def _load_prebuilt(index_file, xml_dir, backend):
+    """Load an index file made by antidox-index, unless it was built from a
+    different XML than the one currently in xml_dir. If xml_dir is None, the
+    XML the index was built from is used for rendering."""
+    if not index_file:
+        return None
+
+    try:
+        meta = index.read_header(index_file)
+    except (OSError, doxy.DoxyFormatError) as e:
+        logger.warning("Cannot use prebuilt index: %s", e)
+        return None
+
+    if (xml_dir is not None and os.path.exists(xml_dir)
+            and index.fingerprint(xml_dir) != meta["fingerprint"]):
+        logger.info("Prebuilt index %s does not match the XML in %s, "
+                    "ignoring it", index_file, xml_dir)
+        return None
+
+    logger.info("Using prebuilt Doxygen index from %s", index_file)
+    return index.load_index(index_file, xml_dir, backend)
+
+
+def open_db(settings, state):
+    """Create the DoxyDB of a project, from the fastest source available:
+    a prebuilt index, an antidox-watch snapshot, or else the tagfile or the
+    XML.
+
+    Parameters
+    ----------
+
+    settings: project settings (see get_settings).
+    state: the XML state, as returned by source_date.
+    """
+    xml_dir = settings["xml_dir"]
+    tagfile = settings["tagfile"]
+    backend = settings["db_backend"]
+
+    if tagfile:
+        logger.info("(Re-)Reading Doxygen tagfile")
+        return TagDoxyDB(tagfile, backend)
+
+    prebuilt = _load_prebuilt(settings["prebuilt_index"], xml_dir or None,
+                              backend)
+    if prebuilt is not None:
+        return prebuilt
+
+    index_file = settings["index_file"]
+    snapshot = _load_snapshot(index_file, state)
+
+    if snapshot is not None and snapshot.db.backend != backend:
+        logger.info("Index file %s uses the %s backend, ignoring it",
+                    index_file, snapshot.db.backend)
+        snapshot = None
+
+    if snapshot is not None:
+        logger.info("Using Doxygen index from %s", index_file)
+        snapshot.db._xml_dir = xml_dir
+        return snapshot.db
+
+    logger.info("(Re-)Reading Doxygen DB")
+    return doxy.DoxyDB(xml_dir, backend, settings["doxy_sqlite3"] or None)
+
+
+def _connect_daemon(socket_path):
+    """Try to connect to an antidox daemon. Return None on failure."""
+    client = daemon.DoxyClient(socket_path)
+
+    try:
+        client.ping()
+    except (OSError, daemon.DaemonError) as e:
+        logger.warning("Cannot connect to antidox daemon at %s (%s), "
+                       "reading the Doxygen DB locally.", socket_path, e)
+        return None
+
+    return client
+
+
+def load_default_db(env, state, date):
+    """Set ``env.antidox_db`` to the DB of the default project.
+
+    The daemon is used if it is configured and running. Otherwise the DB
+    kept in the environment since the last build is reused if it is up to
+    date, else it is opened again.
+
+    Parameters
+    ----------
+
+    env: Sphinx build environment.
+    state, date: result of source_date for the default project.
+    """
+    settings = get_settings(env.config, DEFAULT)
+    logger.debug("Doxy XML last modified: %s", date)
+
+    socket_path = env.config.antidox_daemon_socket
+    client = _connect_daemon(socket_path) if socket_path else None
+
+    if client is not None:
+        logger.info("Using antidox daemon at %s", socket_path)
+        env.antidox_db = client
+        env.antidox_db_date = date
+    elif (env.antidox_db is None
+        or isinstance(env.antidox_db, daemon.DoxyClient)
+        or date is None
+        or env.antidox_db_date is None
+        or env.antidox_db_date < date
+        or env.antidox_db.backend != settings["db_backend"]):
+
+        env.antidox_db = open_db(settings, state)
+        env.antidox_db_date = date
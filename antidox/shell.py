@@ -19,13 +19,15 @@ import functools
 import pickle
 import sqlite3
 import timeit
+import time
 import re
 import pathlib
 
 from lxml import etree as ET
 
 from . import doxy
-from .xtransform import get_stylesheet
+from . import daemon
+from .xtransform import get_stylesheet, annotate
 
 __author__ = "Juan I Carrano"
 __copyright__ = "Copyright 2018, Freie Universität Berlin"
@@ -76,6 +78,65 @@ def _any_to_refid(f):
 KIND_RE = re.compile(r'(?<=\s)Kind\.([A-Z]+)')
 
 
+_BENCH_PERCENTILES = (50, 90, 99)
+
+
+def _percentile(sorted_samples, p):
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = max(0, -(-len(sorted_samples) * p // 100) - 1)
+    return sorted_samples[rank]
+
+
+def _bench(f, inputs, errors=Exception):
+    """Call f once for each element of inputs and time each call.
+
+    Calls raising any of `errors` are counted but their latency is not
+    recorded.
+
+    Returns
+    -------
+
+    latencies: sorted list of call durations, in seconds.
+    total: wall time for the whole run, in seconds.
+    n_errors: number of calls that raised.
+    """
+    latencies = []
+    n_errors = 0
+    clock = time.perf_counter
+
+    t_start = clock()
+    for x in inputs:
+        t0 = clock()
+        try:
+            f(x)
+        except errors:
+            n_errors += 1
+            continue
+        latencies.append(clock() - t0)
+    total = clock() - t_start
+
+    latencies.sort()
+
+    return latencies, total, n_errors
+
+
+def _print_bench(name, latencies, total, n_errors):
+    """Report the results of _bench."""
+    n_ops = len(latencies)
+    rate = n_ops / total if total else float("inf")
+
+    print("{}: {} ops in {:.3f} s ({:.1f} ops/s), {} errors".format(
+        name, n_ops, total, rate, n_errors))
+
+    if n_ops:
+        us = [1e6 * _percentile(latencies, p) for p in _BENCH_PERCENTILES]
+        print("\tlatency (us): min {:.1f} {} max {:.1f}".format(
+            1e6 * latencies[0],
+            " ".join("p{} {:.1f}".format(p, x)
+                     for p, x in zip(_BENCH_PERCENTILES, us)),
+            1e6 * latencies[-1]))
+
+
 class Shell(cmd.Cmd):
     """Interact with the database created by that antidox.doxy module."""
 
@@ -83,11 +144,12 @@ class Shell(cmd.Cmd):
     intro = 'This is the antidox debug shell. Type "?" or "help" for help'
 
     """Command that can be run withour a database loaded"""
-    NOINIT_CMDS = ("", "info", "new", "restore", "load_sphinx", "?", "!", "EOF",
-                   "help", "sty")
+    NOINIT_CMDS = ("", "info", "new", "restore", "load_sphinx", "connect", "?",
+                   "!", "EOF", "help", "sty", "compare")
 
     def __init__(self, doxydb=None, **kwargs):
         self._stylesheet_fn = None
+        self._stylesheet = None
         self.db = doxydb
 
         super().__init__(**kwargs)
@@ -99,7 +161,15 @@ class Shell(cmd.Cmd):
     @db.setter
     def db(self, value):
         self._db = value
-        self._reload_sty()
+        # The stylesheet is bound to the DB. Compile it again when needed.
+        self._stylesheet = None
+
+    @property
+    def stylesheet(self):
+        if self._stylesheet is None:
+            self._stylesheet = get_stylesheet(self._stylesheet_fn,
+                                              doxy_db=self.db)
+        return self._stylesheet
 
     def precmd(self, line):
         if line and self.db is None and line.strip().split()[0] not in self.NOINIT_CMDS:
@@ -122,14 +192,26 @@ class Shell(cmd.Cmd):
             print("No DB loaded")
             return
 
+        if isinstance(self.db, daemon.DoxyClient):
+            print("connected to daemon:", self.db.socket_path)
+            return
+
         print("xml dir:", self.db._xml_dir)
+        print("backend:", self.db.backend)
+
+        if self.db.backend != "sqlite":
+            elements = list(self.db.find(list(doxy.Kind)))
+            print("total elements:", len(elements))
+            return
+
         print("DB tables:")
         tables = self.db._db_conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table'")
         for t in tables:
             print("\t", t[0])
 
         self._print_cursor(self.db._db_conn.execute("""
-        SELECT kind AS element_kind, COUNT(*) FROM elements GROUP BY kind
+        SELECT kind_name(kind) AS element_kind, COUNT(*) FROM elements
+        GROUP BY kind
         """))
 
         self._print_cursor(self.db._db_conn.execute("""
@@ -138,15 +220,18 @@ class Shell(cmd.Cmd):
 
         self._print_cursor(self.db._db_conn.execute("""
         SELECT COUNT(*) AS number_of_parent_elements FROM
-            (SELECT DISTINCT p_prefix, p_id FROM hierarchy)
+            (SELECT DISTINCT p_eid FROM hierarchy)
         """))
 
     @_catch()
-    def do_new(self, xml_dir):
+    def do_new(self, line):
         """\
-        new <doxy xmCmd.emptyline()l dir>
-        Read an XML directory and create a database. Old DB is discarded."""
-        _f = lambda: doxy.DoxyDB(xml_dir)
+        new <doxy xml dir> [sqlite|memory] [doxygen sqlite3 file]
+        Read an XML directory and create a database using the given backend
+        (sqlite by default). If Doxygen's sqlite3 output is given, the
+        index is copied from it instead. Old DB is discarded."""
+        xml_dir, *backend = line.split()
+        _f = lambda: doxy.DoxyDB(xml_dir, *backend)
         print("DB loaded in %f seconds" % timeit.timeit("self.db=_f()", number=1, globals=locals()))
 
     @_catch()
@@ -166,6 +251,16 @@ class Shell(cmd.Cmd):
         with open(filename, "rb") as f:
             self.db = pickle.load(f)
 
+    @_catch()
+    def do_connect(self, socket_path):
+        """\
+        connect <socket>
+        Use the DB served by an antidox daemon. SQL queries ("!") are not
+        available in this mode."""
+        client = daemon.DoxyClient(socket_path)
+        client.ping()
+        self.db = client
+
     @_catch()
     def do_load_sphinx(self, sphinx_builddir):
         """\
@@ -182,6 +277,10 @@ class Shell(cmd.Cmd):
                   sphinx_builddir, "doctrees", "environment.pickle"), 'rb') as f:
             env = sphinx.environment.BuildEnvironment.load(f)
 
+        if getattr(env, "antidox_db", None) is None:
+            # The DB is loaded the first time a document uses it.
+            raise ValueError("The environment contains no Doxygen DB")
+
         self.db = env.antidox_db
 
         base_dir = maybe_prjdir[0] if maybe_prjdir else env.srcdir
@@ -330,22 +429,19 @@ class Shell(cmd.Cmd):
 
         print(ET.tostring(root, pretty_print=True, encoding='unicode'))
 
-    @_catch(doxy.RefError, doxy.DoxyFormatError, ET.XMLSyntaxError)
+    @_catch(doxy.RefError, doxy.DoxyFormatError, ET.XMLSyntaxError,
+            OSError)
     def do_sty(self, filename):
         """\
         sty [template.xsl]
 
         Load a XML template file. Call with no argument to restore the default.
-        The database will be reloaded each time the database is loaded.
+        The stylesheet will be reloaded each time the database is loaded.
         """
 
-        self.stylesheet = get_stylesheet(filename, doxy_db=self.db)
+        self._stylesheet = get_stylesheet(filename, doxy_db=self.db)
         self._stylesheet_fn = filename
 
-    def _reload_sty(self):
-        """Reload the stylesheet (after a database load)"""
-        self.do_sty(self._stylesheet_fn)
-
     @_catch_doxy
     @_any_to_refid
     def do_xform(self, refid, *flags):
@@ -360,7 +456,7 @@ class Shell(cmd.Cmd):
 
         Flags can be any of noindex, hideloc, hidedef, hidedoc.
         """
-        root = self.db.get_tree(refid)
+        root = annotate(self.db.get_tree(refid), self.db)
 
         flags = {k: "true()" for k in flags}
 
@@ -371,6 +467,93 @@ class Shell(cmd.Cmd):
 
         print(ET.tostring(transformed, pretty_print=True, encoding='unicode'))
 
+    def _bench_targets(self, elements):
+        targets = []
+        for r in elements:
+            try:
+                targets.append(self.db.refid_to_target(r.refid))
+            except (doxy.RefError, doxy.ConsistencyError):
+                # groups and other user-defined constructs have no target.
+                pass
+
+        return _bench(self.db.resolve_target, targets, doxy.RefError)
+
+    def _bench_names(self, elements):
+        return _bench(lambda r: self.db.resolve_name(r.kind, r.name),
+                      elements, doxy.RefError)
+
+    def _bench_trees(self, elements):
+        return _bench(lambda r: self.db.get_tree(r.refid), elements,
+                      (doxy.RefError, doxy.DoxyFormatError, OSError))
+
+    def _xform(self, refid):
+        root = annotate(self.db.get_tree(refid), self.db)
+        return self.stylesheet(root)
+
+    def _bench_xform(self, elements):
+        return _bench(lambda r: self._xform(r.refid),
+                      elements,
+                      (doxy.RefError, doxy.DoxyFormatError, OSError,
+                       ET.XSLTApplyError))
+
+    _BENCHMARKS = {
+        "targets": _bench_targets,
+        "names": _bench_names,
+        "trees": _bench_trees,
+        "xform": _bench_xform,
+    }
+
+    @_catch_doxy
+    def do_bench(self, line):
+        """\
+        bench [targets|names|trees|xform]*
+
+        Measure the throughput of DB operations over every element in the
+        database:
+
+        targets: resolve_target() on the result of refid_to_target().
+        names:   resolve_name() on every (kind, name) pair.
+        trees:   get_tree() for every refid.
+        xform:   get_tree(), annotate() and the loaded stylesheet for every refid.
+
+        With no arguments all benchmarks are run. Failed operations (e.g.
+        ambiguous names) are counted as errors and excluded from the latency
+        statistics.
+        """
+        names = line.split() or list(self._BENCHMARKS)
+
+        for name in names:
+            if name not in self._BENCHMARKS:
+                print("Unknown benchmark: %s" % name)
+                return
+
+        elements = list(self.db.find())
+
+        for name in names:
+            _print_bench(name, *self._BENCHMARKS[name](self, elements))
+
+    @_catch(doxy.RefError, doxy.DoxyFormatError, OSError)
+    def do_compare(self, line):
+        """\
+        compare <doxy xml dir> [targets|names|trees|xform]*
+
+        Load the XML directory with each of the available backends and run
+        the given benchmarks (all of them by default) on each one. The
+        currently loaded DB is kept.
+        """
+        xml_dir, *names = line.split()
+        prev_db = self.db
+
+        try:
+            for backend in doxy.BACKENDS:
+                t0 = time.perf_counter()
+                self.db = doxy.DoxyDB(xml_dir, backend)
+                print("## %s (loaded in %.3f s)"
+                      % (backend, time.perf_counter() - t0))
+                self.do_bench(" ".join(names))
+        finally:
+            self.db = prev_db
+
     def do_shell(self, line):
         """\
         Run an arbitrary SQL query on the database.
@@ -378,8 +561,18 @@ class Shell(cmd.Cmd):
         As a convenience, any string of the form "Kind.XXXXX" will be replaced
         with the numeric value for that Kind (e.g Kind.GROUP, Kind.UNION).
 
-        e.g.: `! SELECT name, id FROM elements WHERE kind in compound_kinds`
+        The function kind_name() converts a kind back to its name.
+
+        e.g.: `! SELECT name, refid FROM elements WHERE kind in compound_kinds`
         """
+        if isinstance(self.db, daemon.DoxyClient):
+            print("SQL queries are not available through the daemon")
+            return
+
+        if self.db.backend != "sqlite":
+            print("SQL queries are only available with the sqlite backend")
+            return
+
         _line = KIND_RE.sub(lambda m: str(doxy.Kind[m[1]].value), line)
 
         try:
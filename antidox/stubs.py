@@ -0,0 +1,200 @@
+"""
+    antidox.stubs
+    ~~~~~~~~~~~~~
+
+    Generate stub documents for the files and groups of a Doxygen project.
+
+    Each stub is a page with a single ``doxy:c`` directive that includes all
+    the children of the compound, plus an index page with a toctree listing
+    all the stubs::
+
+      antidox-stubs path/to/xml doc/source/api
+
+    Stubs are only written when their content changes, and stubs of
+    compounds that no longer exist are deleted, so that a following
+    ``sphinx-build`` only reads the pages that actually changed. Files that
+    were not generated by this tool (i.e. that do not start with
+    :py:data:`STUB_MARKER`) are never overwritten or deleted.
+"""
+
+import argparse
+import os
+from collections import namedtuple
+
+from . import doxy
+from .doxy import Kind
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+STUB_MARKER = ".. Generated by antidox-stubs. Do not edit.\n"
+"""First line of every generated file."""
+
+STUB_SUFFIX = ".rst"
+
+INDEX_NAME = "index"
+"""Name (without suffix) of the page that lists all stubs."""
+
+STUB_KINDS = (Kind.FILE, Kind.GROUP)
+
+StubResult = namedtuple("StubResult", "written unchanged removed")
+StubResult.__doc__ = """Names of the stubs that were written, left unchanged
+and removed by generate()."""
+
+
+def _title(text):
+    return "{}\n{}\n".format(text, "=" * len(text))
+
+
+def _entity(db, compound):
+    """Reference string (see antidox.directives.ENTITY_RE) for a compound."""
+    if compound.kind == Kind.FILE:
+        try:
+            return str(db.refid_to_target(compound.refid))
+        except (doxy.RefError, doxy.ConsistencyError):
+            pass
+    elif compound.kind == Kind.GROUP:
+        return "group[{}]".format(compound.name)
+
+    return "!{}".format(compound.refid)
+
+
+def render_stub(db, compound):
+    """Return the contents of the stub for a compound (a SearchResult)."""
+    return "".join((STUB_MARKER, "\n", _title(compound.name), "\n",
+                    ".. doxy:c:: {}\n".format(_entity(db, compound)),
+                    "   :children:\n"))
+
+
+def render_index(title, names):
+    """Return the contents of the page with the toctree of all the stubs."""
+    return "".join([STUB_MARKER, "\n", _title(title), "\n",
+                    ".. toctree::\n", "   :maxdepth: 1\n", "\n"]
+                   + ["   {}\n".format(name) for name in names])
+
+
+def _is_stub(filename):
+    try:
+        with open(filename, encoding="utf-8") as f:
+            return f.readline() == STUB_MARKER
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def update_file(filename, content):
+    """Write a file, unless it already has the given content, so that its
+    modification time only changes when it is really modified.
+
+    Returns
+    -------
+
+    written: True if the file was written.
+    """
+    try:
+        with open(filename, encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    return True
+
+
+def generate(db, output_dir, kinds=STUB_KINDS, title="API reference"):
+    """Write the stubs for all the compounds of the given kinds.
+
+    The hierarchy is read in a single pass (see DoxyDB.walk). Compounds
+    without any children are skipped. Stubs are named after the refid of
+    their compound.
+
+    Parameters
+    ----------
+
+    db: DoxyDB object.
+    output_dir: directory where the stubs are written. It is created if it
+        does not exist.
+    kinds: kinds of the compounds that get a stub.
+    title: title of the index page.
+
+    Returns
+    -------
+
+    result: StubResult.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    written = []
+    unchanged = []
+    entries = []
+
+    def _put(name, content):
+        filename = os.path.join(output_dir, name + STUB_SUFFIX)
+        if os.path.exists(filename) and not _is_stub(filename):
+            raise FileExistsError("Refusing to overwrite %s: it was not "
+                                  "generated by antidox-stubs" % filename)
+
+        (written if update_file(filename, content) else unchanged).append(name)
+
+    for compound, subcompounds, members in db.walk():
+        if compound.kind not in kinds or not (subcompounds or members):
+            continue
+
+        name = str(compound.refid)
+        _put(name, render_stub(db, compound))
+        entries.append((kinds.index(compound.kind), compound.name, name))
+
+    _put(INDEX_NAME, render_index(title, [n for _, _, n in sorted(entries)]))
+
+    keep = set(written) | set(unchanged)
+    removed = []
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            name = entry.name[:-len(STUB_SUFFIX)]
+            if (entry.name.endswith(STUB_SUFFIX) and name not in keep
+                    and entry.is_file() and _is_stub(entry.path)):
+                os.remove(entry.path)
+                removed.append(name)
+
+    return StubResult(written, unchanged, sorted(removed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                description="Generate stub pages for a Doxygen project")
+
+    parser.add_argument('-k', '--kind', action="append",
+                        choices=[k.name.lower() for k in STUB_KINDS],
+                        help="Kinds of compounds that get a stub (default: "
+                             "all of them). May be given more than once.")
+    parser.add_argument('-t', '--title', default="API reference",
+                        help="Title of the index page.")
+    parser.add_argument('-b', '--backend', choices=doxy.BACKENDS,
+                        default="memory", help="DB storage backend.")
+    parser.add_argument('--doxy-sqlite3',
+                        help="Build the index from the database created by "
+                             "Doxygen's GENERATE_SQLITE3 option.")
+    parser.add_argument('xml_dir', help="Doxygen XML directory")
+    parser.add_argument('output_dir', help="Output directory")
+
+    ns = parser.parse_args()
+
+    kinds = (tuple(k for k in STUB_KINDS if k.name.lower() in ns.kind)
+             if ns.kind else STUB_KINDS)
+
+    db = doxy.DoxyDB(ns.xml_dir, ns.backend, ns.doxy_sqlite3)
+
+    try:
+        result = generate(db, ns.output_dir, kinds, ns.title)
+    except FileExistsError as e:
+        parser.exit(1, "%s\n" % e)
+
+    print("%d stubs written, %d unchanged, %d removed"
+          % (len(result.written), len(result.unchanged), len(result.removed)))
+
+
+if __name__ == "__main__":
+    main()
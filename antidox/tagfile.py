@@ -0,0 +1,172 @@
+"""
+    antidox.tagfile
+    ~~~~~~~~~~~~~~~
+
+    Build a DoxyDB index from a Doxygen tagfile (``GENERATE_TAGFILE``).
+
+    A tagfile is a single, small XML file listing the compounds and members
+    of a project. It has enough information to resolve targets and names,
+    so projects that only cross-reference another project's entities (with
+    the ``doxy:r`` role) do not need to ingest that project's full XML
+    output. Elements indexed this way cannot be rendered.
+"""
+
+import os
+import pathlib
+import xml.etree.ElementTree as ET
+
+from . import doxy
+from .doxy import Kind, RefId
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+# Tagfile kinds that are spelled differently than in the XML.
+_TAG_KINDS = {"enumeration": Kind.ENUM}
+
+# Tags used inside a compound to refer to other compounds by name.
+_INNER_TAGS = {"class": None, "namespace": Kind.NAMESPACE, "file": Kind.FILE,
+               "dir": Kind.DIR, "subgroup": Kind.GROUP, "subpage": Kind.PAGE}
+
+
+def _kind(attr):
+    """Convert a tagfile "kind" attribute to a Kind, or None if it is not
+    supported."""
+    try:
+        return _TAG_KINDS[attr]
+    except KeyError:
+        return Kind.from_attr(attr) if Kind.tag_supported(attr) else None
+
+
+def _file_refid(filename):
+    """Get the refid of a compound from the name of its HTML file.
+
+    Doxygen escapes dots in refids, so everything after the first dot is the
+    extension (if there is one.)"""
+    return RefId(filename.partition(".")[0])
+
+
+def _member_refid(anchorfile, anchor):
+    return RefId("{}_1{}".format(_file_refid(anchorfile), anchor))
+
+
+class TagDoxyDB(doxy.DoxyDB):
+    """DoxyDB built from a tagfile instead of Doxygen's XML output.
+
+    It supports all the lookup and resolution methods of DoxyDB, but
+    get_tree() and xml_file() raise NoXMLError.
+
+    Compounds refer to their inner compounds by name. Files are the only
+    compounds whose names are not unique, so when a name matches several
+    files they are told apart by their path, if possible, or else the
+    relationship is dropped.
+
+    Parameters
+    ----------
+
+    tagfile: path to the tagfile.
+    backend: storage backend name (see DoxyDB).
+    """
+    def __init__(self, tagfile, backend="sqlite"):
+        self._xml_dir = None
+        self._doxy_sqlite3 = None
+        self._file_sizes = {}
+        self._tagfile = tagfile
+        self._backend = doxy.get_backend(backend)()
+
+        self._read_tagfile(tagfile)
+
+        self._backend.finish()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_tagfile'] = self._tagfile
+
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._tagfile = state['_tagfile']
+
+    @property
+    def tagfile(self):
+        """Path of the tagfile the index was built from."""
+        return self._tagfile
+
+    def _read_tagfile(self, tagfile):
+        compounds = []
+        by_name = {}
+
+        for elem in ET.parse(tagfile).getroot().iterfind("compound"):
+            kind = _kind(elem.get("kind"))
+            if kind is None:
+                continue
+
+            refid = _file_refid(elem.findtext("filename"))
+            self._backend.insert_element(refid, elem.findtext("name"), kind)
+
+            compounds.append((refid, kind, elem))
+            by_name.setdefault((kind, elem.findtext("name")), []).append(
+                (refid, elem.findtext("path")))
+
+            for member in elem.iterfind("member"):
+                self._insert_member(refid, member)
+
+        for refid, kind, elem in compounds:
+            for inner in elem:
+                try:
+                    inner_kind = (_INNER_TAGS[inner.tag]
+                                  or _kind(inner.get("kind")))
+                except KeyError:
+                    continue
+
+                inner_refid = self._find_compound(
+                                    by_name.get((inner_kind, inner.text), ()),
+                                    elem.findtext("path"), kind)
+                if inner_refid is not None:
+                    self._backend.insert_hierarchy(inner_refid, refid)
+
+    def _insert_member(self, parent_refid, member):
+        kind = _kind(member.get("kind"))
+        if kind is None:
+            return
+
+        refid = _member_refid(member.findtext("anchorfile"),
+                              member.findtext("anchor"))
+
+        # Like in index.xml, enumvalues are listed under the compound. The
+        # real parent is given by the <enumvalue> elements of the enum.
+        self._backend.insert_element(
+                    refid, member.findtext("name"), kind,
+                    None if kind == Kind.ENUMVALUE else parent_refid)
+
+        for value in member.iterfind("enumvalue"):
+            value_refid = _member_refid(value.get("file"), value.get("anchor"))
+            self._backend.insert_element(value_refid, value.text,
+                                         Kind.ENUMVALUE, refid)
+
+    @staticmethod
+    def _find_compound(candidates, parent_path, parent_kind):
+        """Pick the compound that an inner compound tag refers to."""
+        if len(candidates) == 1:
+            return candidates[0][0]
+
+        # Files in a directory have the same path as the directory.
+        if parent_kind == Kind.DIR and parent_path:
+            in_dir = [refid for refid, path in candidates
+                      if path and pathlib.PurePath(path)
+                      == pathlib.PurePath(parent_path)]
+            if len(in_dir) == 1:
+                return in_dir[0]
+
+        return None
+
+    def xml_file(self, refid):
+        return self.get_tree(refid)
+
+    def get_tree(self, refid):
+        raise doxy.NoXMLError(
+            "Cannot render %s: the Doxygen index was built from the tagfile "
+            "%s, which does not contain the documentation itself"
+            % (refid, os.path.basename(self._tagfile)))
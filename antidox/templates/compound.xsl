@@ -11,15 +11,23 @@
     <xsl:param name="hidedef" select="false()"/>
     <xsl:param name="hidedoc" select="false()"/>
 
+    <!-- Printable ASCII characters (used by keyed-index) -->
+    <xsl:variable name="antidox:ascii"> !"#$%&amp;'()*+,-./0123456789:;&lt;=&gt;?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abcdefghijklmnopqrstuvwxyz{|}~</xsl:variable>
+
     <xsl:template match="/memberdef">
-        <xsl:param name="role" select="antidox:guess_desctype(@id)"/>
+        <xsl:param name="role">
+            <xsl:choose>
+                <xsl:when test="@antidox:desctype"><xsl:value-of select="@antidox:desctype"/></xsl:when>
+                <xsl:otherwise><xsl:value-of select="antidox:guess_desctype(@id)"/></xsl:otherwise>
+            </xsl:choose>
+        </xsl:param>
         <desc domain="c">
             <xsl:attribute name="noindex"><xsl:value-of select="$noindex"/></xsl:attribute>
             <xsl:attribute name="desctype"><xsl:value-of select="$role"/></xsl:attribute>
             <xsl:attribute name="objtype"><xsl:value-of select="$role"/></xsl:attribute>
             <desc_signature first="false">
                 <xsl:attribute name="ids">c.<xsl:value-of select="@id"/></xsl:attribute>
-                <xsl:attribute name="names"><xsl:value-of select="antidox:refid_to_target(@id)"/></xsl:attribute>
+                <xsl:attribute name="names"><xsl:call-template name="target"/></xsl:attribute>
                 <xsl:apply-templates select="type|name"/>
                 <xsl:choose>
                     <xsl:when test="param">
@@ -31,6 +39,9 @@
                       </xsl:for-each>
                      </desc_parameterlist>
                     </xsl:when>
+                    <xsl:when test="@antidox:args">
+                        <xsl:value-of select="@antidox:args"/>
+                    </xsl:when>
                     <xsl:when test="argsstring/text()">
                         <xsl:value-of select="antidox:parse_argstr(argsstring/text())"/>
                     </xsl:when>
@@ -55,7 +66,7 @@
             <xsl:attribute name="objtype">type</xsl:attribute>
             <desc_signature first="False">
                 <xsl:attribute name="ids">c.<xsl:value-of select="@id"/></xsl:attribute>
-                <xsl:attribute name="names"><xsl:value-of select="antidox:refid_to_target(@id)"/></xsl:attribute>
+                <xsl:attribute name="names"><xsl:call-template name="target"/></xsl:attribute>
                 <desc_type><xsl:text>enum</xsl:text></desc_type>
                 <xsl:apply-templates select="name"/>
                 <xsl:call-template name="keyed-index"/>
@@ -87,13 +98,31 @@
         </definition_list_item>
     </xsl:template>
 
+    <!-- Target of the element (its "names" attribute.) The value is normally
+         precomputed by antidox.xtransform.annotate() -->
+    <xsl:template name="target">
+        <xsl:choose>
+            <xsl:when test="@antidox:target"><xsl:value-of select="@antidox:target"/></xsl:when>
+            <xsl:otherwise><xsl:value-of select="antidox:refid_to_target(@id)"/></xsl:otherwise>
+        </xsl:choose>
+    </xsl:template>
+
     <!-- Create an index entry using the first letter of "key-word" (by default
-         the key-word is taken from the <name> element) -->
+         the key-word is taken from the <name> element). ASCII letters are
+         converted without calling antidox:upper-case. -->
     <xsl:template name="keyed-index">
         <xsl:param name="key-word" select="name"/>
+        <xsl:variable name="initial" select="substring($key-word, 1, 1)"/>
         <xsl:if test="not($noindex)">
             <antidox:index>
-                <xsl:attribute name="key"><xsl:value-of select="antidox:upper-case(substring($key-word, 1, 1))"/></xsl:attribute>
+                <xsl:attribute name="key">
+                    <xsl:choose>
+                        <xsl:when test="$initial = '' or contains($antidox:ascii, $initial)">
+                            <xsl:value-of select="translate($initial, 'abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')"/>
+                        </xsl:when>
+                        <xsl:otherwise><xsl:value-of select="antidox:upper-case($initial)"/></xsl:otherwise>
+                    </xsl:choose>
+                </xsl:attribute>
             </antidox:index>
         </xsl:if>
     </xsl:template>
@@ -200,7 +229,12 @@
         <!-- TODO: add section ID (how do we handle duplicates?) -->
         <xsl:if test="not($hidedoc)">
         <section>
-            <xsl:attribute name="ids"><xsl:value-of select="concat('c.',ancestor::*/@id,'-',antidox:string-to-ids(.))"/></xsl:attribute>
+            <xsl:attribute name="ids">
+                <xsl:choose>
+                    <xsl:when test="@antidox:slug"><xsl:value-of select="concat('c.',ancestor::*/@id,'-',@antidox:slug)"/></xsl:when>
+                    <xsl:otherwise><xsl:value-of select="concat('c.',ancestor::*/@id,'-',antidox:string-to-ids(.))"/></xsl:otherwise>
+                </xsl:choose>
+            </xsl:attribute>
             <!-- Small workaround for trailing whitespace in titles -->
             <title><xsl:value-of select="normalize-space(.)"/></title>
             <xsl:apply-templates
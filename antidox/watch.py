@@ -0,0 +1,260 @@
+"""
+    antidox.watch
+    ~~~~~~~~~~~~~
+
+    Keep a persisted index up to date while Doxygen regenerates its XML.
+
+    The watcher polls the XML directory with :py:func:`os.scandir` and waits
+    for the directory to settle (i.e. no file changed during a configurable
+    interval) before rebuilding the index and publishing it atomically to an
+    index file. Sphinx picks up the index file through the
+    ``antidox_index_file`` config value, so a build that starts after the
+    snapshot was published does not need to ingest the XML at all.
+
+    Run it alongside ``sphinx-autobuild`` (or any other tool that re-runs
+    Doxygen)::
+
+      antidox-watch path/to/xml path/to/index.pickle
+
+    The XML can also be a zip archive (see :py:mod:`antidox.xmlsource`.)
+"""
+
+import os
+import argparse
+import logging
+import pickle
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+
+from lxml import etree as ET
+
+from . import doxy
+from . import xmlsource
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+logger = logging.getLogger(__name__)
+
+BUILD_ERRORS = (ET.XMLSyntaxError, OSError, zipfile.BadZipFile,
+                doxy.DoxyFormatError)
+"""Errors raised by DoxyDB when the XML is read while Doxygen is still
+writing it. Callers should keep their old DB and try again later."""
+
+
+SNAPSHOT_VERSION = 1
+
+
+Snapshot = namedtuple("Snapshot", "state db")
+"""A persisted index: ``state`` is the result of :py:func:`scan_xml_dir` at
+the time the ``db`` was built."""
+
+Published = namedtuple("Published", "files seconds")
+"""Returned by :py:meth:`Watcher.poll` when it publishes a snapshot: the
+number of XML files and the time it took to build the index."""
+
+
+def scan_xml_dir(xml_dir):
+    """Get the modification time and size of every XML file in a directory
+    (or any other XML source, see :py:func:`antidox.xmlsource.scan`).
+
+    Unlike the directory's own mtime, this notices files that were rewritten
+    in place.
+
+    Returns
+    -------
+
+    state: dictionary mapping file names to ``(mtime_ns, size)`` tuples.
+    """
+    return xmlsource.scan(xml_dir)
+
+
+def newest_mtime(state):
+    """Return the newest modification time (in seconds, as in
+    os.path.getmtime) in a state returned by scan_xml_dir, or None if the
+    state is empty."""
+    if not state:
+        return None
+
+    return max(m for m, _ in state.values()) / 1e9
+
+
+def save_snapshot(filename, state, db):
+    """Atomically write an index snapshot.
+
+    The data is first written to a temporary file in the same directory and
+    then moved over the destination, so that readers never see a partially
+    written file.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((SNAPSHOT_VERSION, state, db), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def load_snapshot(filename):
+    """Read a snapshot written by save_snapshot.
+
+    Returns None if the file was written by an incompatible version.
+    """
+    with open(filename, "rb") as f:
+        try:
+            version, state, db = pickle.load(f)
+        except doxy.DoxyFormatError:
+            # The DB itself was pickled with an incompatible schema.
+            return None
+
+    if version != SNAPSHOT_VERSION:
+        return None
+
+    return Snapshot(state, db)
+
+
+class Watcher:
+    """Poll a Doxygen XML directory and rebuild the index when it changes.
+
+    Parameters
+    ----------
+
+    xml_dir: Doxygen XML directory.
+    index_file: where to publish snapshots.
+    interval: polling period, in seconds.
+    settle: time (in seconds) the directory must remain unchanged before a
+        new index is built. This avoids indexing a half-written output.
+    backend: DoxyDB storage backend.
+    """
+    def __init__(self, xml_dir, index_file, interval=0.5, settle=2.0,
+                 backend="sqlite"):
+        self.xml_dir = xml_dir
+        self.index_file = index_file
+        self.interval = interval
+        self.settle = settle
+        self.backend = backend
+
+        self._published = None
+        self._failed = None
+
+        if os.path.exists(index_file):
+            try:
+                snapshot = load_snapshot(index_file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                snapshot = None
+
+            if snapshot is not None and snapshot.db.backend == backend:
+                self._published = snapshot.state
+
+    def _scan(self):
+        try:
+            return scan_xml_dir(self.xml_dir)
+        except (FileNotFoundError, zipfile.BadZipFile):
+            # The archive may be in the middle of being written.
+            return {}
+
+    def _wait_settled(self, state):
+        """Keep scanning until the state stops changing for self.settle
+        seconds. Return the final state."""
+        stable_since = time.monotonic()
+
+        while time.monotonic() - stable_since < self.settle:
+            time.sleep(self.interval)
+            new_state = self._scan()
+            if new_state != state:
+                state = new_state
+                stable_since = time.monotonic()
+
+        return state
+
+    def poll(self):
+        """Check the directory once and publish a new snapshot if needed.
+
+        Returns a Published tuple if a snapshot was published, None
+        otherwise.
+        """
+        state = self._scan()
+
+        if state == self._published or "index.xml" not in state:
+            return None
+
+        state = self._wait_settled(state)
+
+        t0 = time.monotonic()
+        doxy.clear_caches()
+        try:
+            db = doxy.DoxyDB(self.xml_dir, self.backend)
+        except BUILD_ERRORS as e:
+            # Settling is only a heuristic. Try again on the next poll, but
+            # do not complain again about the same files.
+            if state != self._failed:
+                logger.warning("Cannot index %s: %s", self.xml_dir, e)
+                self._failed = state
+            return None
+
+        # Doxygen may have started again while we were reading.
+        if self._scan() != state:
+            return None
+
+        save_snapshot(self.index_file, state, db)
+        self._published = state
+
+        return Published(len(state), time.monotonic() - t0)
+
+    def run(self, on_publish=None):
+        """Poll forever. on_publish, if given, is called with the Published
+        tuple of every snapshot."""
+        while True:
+            published = self.poll()
+            if published is not None and on_publish is not None:
+                on_publish(published)
+            time.sleep(self.interval)
+
+
+def _report(published):
+    print("Published index (%d files) in %.2f seconds" % published)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                description="Keep an antidox index up to date")
+
+    parser.add_argument('-i', '--interval', type=float, default=0.5,
+                        help="Polling interval in seconds")
+    parser.add_argument('-s', '--settle', type=float, default=2.0,
+                        help="Time in seconds that the XML directory must be "
+                             "left unmodified before it is indexed.")
+    parser.add_argument('--once', action="store_true",
+                        help="Index once (if needed) and exit.")
+    parser.add_argument('-b', '--backend', choices=doxy.BACKENDS,
+                        default="sqlite", help="DB storage backend.")
+    parser.add_argument('xml_dir', help="Doxygen XML directory")
+    parser.add_argument('index_file', help="Output file")
+
+    ns = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s")
+
+    watcher = Watcher(ns.xml_dir, ns.index_file, ns.interval, ns.settle,
+                      ns.backend)
+
+    try:
+        if ns.once:
+            published = watcher.poll()
+            if published is not None:
+                _report(published)
+        else:
+            watcher.run(_report)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
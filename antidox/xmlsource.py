@@ -0,0 +1,172 @@
+"""
+    antidox.xmlsource
+    ~~~~~~~~~~~~~~~~~
+
+    Access the files of a Doxygen XML output, wherever they are stored.
+
+    An XML source can be:
+
+    - A directory, as written by Doxygen. Each file may also be compressed
+      individually with gzip (``index.xml.gz``) or zstd (``index.xml.zst``).
+      Reading zstd files requires the ``zstandard`` package.
+    - A zip archive containing the XML files, either at the top level or in
+      a single subdirectory (e.g. ``xml/index.xml``).
+
+    Files are decompressed on demand, as they are read, and never extracted
+    to disk.
+"""
+
+import functools
+import gzip
+import os
+import posixpath
+import zipfile
+
+__author__ = "Juan I Carrano"
+__copyright__ = "Copyright 2018, Freie Universität Berlin"
+
+
+def _open_zstd(path):
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("The 'zstandard' package is needed to read %s"
+                          % path) from e
+
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"),
+                                                      closefd=True)
+
+
+# Suffixes of individually compressed files, in order of preference.
+_COMPRESSED = ((".gz", gzip.open), (".zst", _open_zstd))
+
+
+def is_archive(source):
+    """Check if an XML source is a zip archive (as opposed to a
+    directory)."""
+    return os.path.isfile(source)
+
+
+class _Archive:
+    """Index of the XML files in a zip archive."""
+    def __init__(self, filename):
+        self.zip = zipfile.ZipFile(filename)
+
+        names = self.zip.namelist()
+        index = min((n for n in names
+                     if posixpath.basename(n) == "index.xml"),
+                    key=len, default=None)
+        if index is None:
+            raise FileNotFoundError("No index.xml in archive %s" % filename)
+
+        prefix = index[:-len("index.xml")]
+        self.members = {n[len(prefix):]: n for n in names
+                        if n.startswith(prefix) and n.endswith(".xml")
+                        and "/" not in n[len(prefix):]}
+
+
+@functools.lru_cache(maxsize=8)
+def _get_archive(filename, mtime_ns, size):
+    # The stat fields are part of the key so that a modified archive is
+    # opened again.
+    return _Archive(filename)
+
+
+def _archive(filename):
+    st = os.stat(filename)
+    return _get_archive(os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+
+def open_xml(source, name):
+    """Open one of the files (e.g. "index.xml") of an XML source.
+
+    Returns
+    -------
+
+    file: binary file object. The caller must close it.
+    """
+    if is_archive(source):
+        archive = _archive(source)
+        try:
+            member = archive.members[name]
+        except KeyError:
+            raise FileNotFoundError("%s not found in archive %s"
+                                    % (name, source)) from None
+
+        return archive.zip.open(member)
+
+    path = os.path.join(source, name)
+
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        for suffix, opener in _COMPRESSED:
+            if os.path.exists(path + suffix):
+                return opener(path + suffix)
+        raise
+
+
+def scan(source):
+    """Get the modification time and size of every XML file in a source.
+
+    Compressed files are listed under their uncompressed name. For an
+    archive, all files have the modification time of the archive and the
+    size is the uncompressed one.
+
+    Returns
+    -------
+
+    state: dictionary mapping file names to ``(mtime_ns, size)`` tuples.
+    """
+    if is_archive(source):
+        mtime = os.stat(source).st_mtime_ns
+        archive = _archive(source)
+
+        return {name: (mtime, archive.zip.getinfo(member).file_size)
+                for name, member in archive.members.items()}
+
+    suffixes = tuple(".xml" + s for s, _ in _COMPRESSED)
+    state = {}
+
+    with os.scandir(source) as it:
+        for entry in it:
+            if entry.name.endswith(".xml"):
+                name = entry.name
+            elif entry.name.endswith(suffixes):
+                name = entry.name[:entry.name.rindex(".xml") + 4]
+            else:
+                continue
+
+            # Uncompressed files take precedence, like in open_xml.
+            if entry.is_file() and (name == entry.name or name not in state):
+                st = entry.stat()
+                state[name] = (st.st_mtime_ns, st.st_size)
+
+    return state
+
+
+def signature(source):
+    """Get a cheap summary of the state of a source: the modification time
+    and size of the archive, or of the directory and its index.xml.
+
+    Doxygen rewrites index.xml every time it runs, so this changes whenever
+    the output is regenerated, without having to stat every file like
+    scan() does. Files edited by hand are not noticed.
+
+    Returns None if the source or its index.xml do not exist.
+    """
+    try:
+        if is_archive(source):
+            st = os.stat(source)
+            return (st.st_mtime_ns, st.st_size)
+
+        dir_st = os.stat(source)
+        path = os.path.join(source, "index.xml")
+        for candidate in [path] + [path + s for s, _ in _COMPRESSED]:
+            if os.path.exists(candidate):
+                st = os.stat(candidate)
+                return (dir_st.st_mtime_ns, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        pass
+
+    return None
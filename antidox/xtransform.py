@@ -8,12 +8,17 @@
 
 import os
 import collections
+import copy
 import re
 import functools
+import hashlib
+import weakref
 from pkgutil import get_data
 
 from lxml import etree as ET
 
+from .doxy import RefError, DoxyFormatError
+
 __author__ = "Juan I Carrano"
 __copyright__ = "Copyright 2018, Freie Universität Berlin"
 
@@ -145,6 +150,133 @@ class _XPathExtensions:
         return nodes
 
 
+def _first_argument(argstr):
+    """String value of the first node returned by parse_argstr."""
+    atype, _s, aname = _SPLIT_COMMA.split(argstr, 1)[0].rpartition(' ')
+    return atype + " " + aname if aname else atype
+
+
+_ANNOTATION = "{antidox}"
+
+
+# Annotated copies made by annotate(), one cache per DB.
+_annotated_cache = weakref.WeakKeyDictionary()
+
+ANNOTATED_CACHE_SIZE = 128
+"""Number of annotated copies kept by annotate() for each DB."""
+
+
+def annotate(element, doxy_db):
+    """Store the values computed by the XPath extension functions as
+    attributes in the "antidox" namespace, so that the default stylesheet can
+    read them instead of calling back into Python for each one.
+
+    The following attributes are set:
+
+    - antidox:target, antidox:desctype and antidox:args on a root memberdef
+      (refid_to_target, guess_desctype and the first argument output by
+      parse_argstr).
+    - antidox:slug on the headings of the detailed description
+      (string-to-ids.)
+
+    Values that cannot be computed (because the DB raises an error) are left
+    out; the stylesheet then falls back to the extension function, which
+    raises the error when the element is transformed.
+
+    The attributes are set on a copy, so the trees cached by get_tree() (and
+    shown by antidox-shell or sent by antidox-daemon) stay as Doxygen wrote
+    them. Stylesheets that import the default one receive the annotated copy.
+
+    Copies are cached (per DB, for as long as get_tree() keeps returning the
+    same element), so rendering an element again does not copy the whole
+    tree again. The copy is shared: it must not be modified.
+
+    Parameters
+    ----------
+    element: lxml element, as returned by DoxyDB.get_tree().
+    doxy_db: DoxyDB that the element comes from.
+
+    Returns
+    -------
+    annotated: annotated copy of the element.
+    """
+    cache = _annotated_cache.setdefault(doxy_db, collections.OrderedDict())
+
+    # The cache holds a reference to the element, so lxml keeps handing out
+    # the same proxy object for it and the lookup by identity works.
+    try:
+        cache.move_to_end(element)
+        return cache[element]
+    except KeyError:
+        pass
+
+    annotated = cache[element] = _annotate(copy.deepcopy(element), doxy_db)
+    if len(cache) > ANNOTATED_CACHE_SIZE:
+        cache.popitem(last=False)
+
+    return annotated
+
+
+def _annotate(element, doxy_db):
+    """Set the attributes described in annotate() on an element, in place."""
+    if element.tag == "memberdef":
+        refid = element.get("id", "")
+        for attr, fn in (("target", doxy_db.refid_to_target),
+                         ("desctype", doxy_db.guess_desctype)):
+            try:
+                element.set(_ANNOTATION + attr, str(fn(refid)))
+            except (RefError, DoxyFormatError, ValueError):
+                pass
+
+        for argsstring in element.iterchildren("argsstring"):
+            if argsstring.text:
+                element.set(_ANNOTATION + "args",
+                            _first_argument(argsstring.text))
+            break
+
+    for description in element.iterchildren("detaileddescription"):
+        for heading in description.iter("heading"):
+            heading.set(_ANNOTATION + "slug",
+                        _string_to_ids(None, heading.xpath("string(.)")))
+
+    return element
+
+
+def needs_db(element):
+    """Check whether the default stylesheet needs to call back into the DB
+    (through the XPath extension functions) to render an element returned by
+    annotate(). This is the case when some value could not be computed."""
+    return (element.tag == "memberdef"
+            and (element.get(_ANNOTATION + "target") is None
+                 or element.get(_ANNOTATION + "desctype") is None))
+
+
+# Compiled stylesheets. The extension functions are bound to a DB, so there
+# is one cache per DB, which goes away with it.
+_stylesheet_cache = weakref.WeakKeyDictionary()
+_no_db_stylesheet_cache = {}
+
+
+def _compile_stylesheet(xsl_text, stylesheet_filename, locale_fn, doxy_db):
+    # A strong reference would keep the DB (the cache key) alive forever.
+    custom_extension = _XPathExtensions(
+                            locale_fn,
+                            weakref.proxy(doxy_db) if doxy_db is not None
+                            else None)
+
+    ext = ET.Extension(custom_extension, ns="antidox")
+
+    if stylesheet_filename:
+        parser = ET.XMLParser()
+        parser.resolvers.add(Resolver())
+        xml_doc = ET.fromstring(xsl_text, parser,
+                                base_url=os.path.abspath(stylesheet_filename))
+    else:
+        xml_doc = ET.XML(xsl_text)
+
+    return ET.XSLT(xml_doc, extensions=ext)
+
+
 def get_stylesheet(stylesheet_filename=None, locale_fn=None, doxy_db=None):
     """Get a XSLT stylesheet.
 
@@ -153,23 +285,36 @@ def get_stylesheet(stylesheet_filename=None, locale_fn=None, doxy_db=None):
     If a file is given, it will be loaded with a special loader that exposes
     the default one under the "antidox:compound".
 
+    Compiled stylesheets are cached by file, content and DB, so calling this
+    again is cheap unless the file changed. Only the file itself is checked:
+    changes to the stylesheets it imports are not noticed.
+
     Parameters
     ----------
     stylesheet_filename: XSL style sheet, or None to load the default value.
     locale_fn: A translation function mapping strings to strings. This will be
                to implement the "antidox:l" XPath function. If not given,
                the identity function will be used.
+    doxy_db: DoxyDB used by the XPath extension functions.
     """
+    if stylesheet_filename:
+        with open(stylesheet_filename, "rb") as f:
+            xsl_text = f.read()
+        filename = os.path.abspath(stylesheet_filename)
+    else:
+        xsl_text = _get_compound_xsl_text()
+        filename = None
 
-    custom_extension = _XPathExtensions(locale_fn, doxy_db)
+    key = (filename, hashlib.sha256(xsl_text).digest(), locale_fn)
 
-    ext = ET.Extension(custom_extension, ns="antidox")
+    cache = (_stylesheet_cache.setdefault(doxy_db, {}) if doxy_db is not None
+             else _no_db_stylesheet_cache)
 
-    if stylesheet_filename:
-        parser = ET.XMLParser()
-        parser.resolvers.add(Resolver())
-        xml_doc = ET.parse(stylesheet_filename, parser)
-    else:
-        xml_doc = ET.XML(_get_compound_xsl_text())
+    try:
+        return cache[key]
+    except KeyError:
+        pass
 
-    return ET.XSLT(xml_doc, extensions=ext)
+    stylesheet = cache[key] = _compile_stylesheet(xsl_text, stylesheet_filename,
+                                                  locale_fn, doxy_db)
+    return stylesheet
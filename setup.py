@@ -33,9 +33,17 @@ setup(name='antidox',
         'sphinx>=3.3.1,<3.5',
         'lxml'
       ],
+      extras_require={
+        'zstd': ['zstandard'],
+      },
       entry_points={
         'console_scripts': [
             'antidox-shell = antidox.shell:main',
+            'antidox-daemon = antidox.daemon:main',
+            'antidox-watch = antidox.watch:main',
+            'antidox-index = antidox.index:main',
+            'antidox-stubs = antidox.stubs:main',
+            'antidox-inventory = antidox.inventory:main',
         ],
       },
       include_package_data=True,
@@ -0,0 +1,26 @@
+"""Fixtures shared by the tests."""
+
+import os
+import subprocess
+
+import pytest
+
+EXAMPLES_BASE = os.path.join(os.path.dirname(__file__), "../examples")
+
+
+@pytest.fixture(scope="module",
+                params=["tinycbor", "riot"])
+def xml_dir(request):
+    example_dir = os.path.join(EXAMPLES_BASE, request.param)
+
+    def _clean_xml():
+        subprocess.run(["make", "-C", example_dir, "clean"])
+
+    request.addfinalizer(_clean_xml)
+
+    subprocess.run(["make", "-C", example_dir, "doxy-xml"])
+
+    with open(os.path.join(example_dir, "doxy-xml")) as f:
+        relative_xml_dir = f.read().strip()
+
+    return os.path.relpath(os.path.join(example_dir, relative_xml_dir))
@@ -0,0 +1,391 @@
+"""Test building documentation with Sphinx."""
+
+import copy
+import io
+import os
+import shutil
+
+import pytest
+
+from sphinx import addnodes
+from sphinx.application import Sphinx
+
+from antidox import directives
+from antidox import doxy
+from antidox import index
+from antidox import projects
+
+_CONF = """extensions = ["antidox"]
+master_doc = "index"
+exclude_patterns = ["_build"]
+antidox_doxy_xml_dir = {!r}
+"""
+
+
+def _write(filename, text):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _directive(arg, **options):
+    return "".join([".. doxy:c:: {}\n".format(arg)]
+                   + ["   :{}:{}\n".format(name, " " + value if value else "")
+                      for name, value in sorted(options.items())]
+                   + ["\n"])
+
+
+def _make_project(srcdir, xml_dir, docs, conf=""):
+    """Write a Sphinx project. docs maps docnames to their body."""
+    _write(os.path.join(srcdir, "conf.py"),
+           _CONF.format(os.path.abspath(xml_dir)) + conf)
+
+    toctree = ".. toctree::\n\n" + "".join("   {}\n".format(d) for d in docs
+                                           if d != "index")
+
+    for docname, body in docs.items():
+        extra = toctree if docname == "index" else ""
+        _write(os.path.join(srcdir, docname + ".rst"),
+               "{0}\n{1}\n\n{2}\n{3}".format(docname, "=" * len(docname),
+                                             extra, body))
+
+
+def _build(srcdir, outdir, freshenv=True, **config):
+    """Build a project. Return the application and the warnings."""
+    warnings = io.StringIO()
+    app = Sphinx(srcdir, srcdir, os.path.join(outdir, "out"),
+                 os.path.join(outdir, "doctrees"), "dummy",
+                 confoverrides=config, status=None, warning=warnings,
+                 freshenv=freshenv)
+    app.build()
+
+    return app, warnings.getvalue()
+
+
+def _doctree(app, docname):
+    return app.env.get_doctree(docname).pformat()
+
+
+def _compounds(xml_dir):
+    """Files and groups with children, with the largest ones first."""
+    db = doxy.DoxyDB(xml_dir)
+
+    compounds = [(len(subcompounds) + len(members), c)
+                 for c, subcompounds, members in db.walk()
+                 if c.kind in (doxy.Kind.FILE, doxy.Kind.GROUP)
+                 and (subcompounds or members)]
+
+    return [c for _, c in sorted(compounds, key=lambda x: -x[0])]
+
+
+def _all_children_doc(xml_dir):
+    return "".join(_directive("!{}".format(c.refid), children="")
+                   for c in _compounds(xml_dir))
+
+
+def test_render_threads(xml_dir, tmpdir):
+    """Children rendered by the XSLT stylesheet in a thread pool must be the
+    same as when they are rendered one by one."""
+    srcdir = str(tmpdir.join("src"))
+    _make_project(srcdir, xml_dir, {"index": _all_children_doc(xml_dir)})
+
+    serial_app, _ = _build(srcdir, str(tmpdir.join("serial")),
+                           antidox_render_threads=1)
+
+    directives._executor_key = None
+    pooled_app, _ = _build(srcdir, str(tmpdir.join("pooled")),
+                           antidox_render_threads=4)
+
+    assert directives._executor_key == (os.getpid(), 4)
+    assert _doctree(pooled_app, "index") == _doctree(serial_app, "index")
+
+
+def _desc_list(app, docname):
+    """Format each desc node of a document, without the nested ones."""
+    formatted = []
+
+    for desc in app.env.get_doctree(docname).traverse(addnodes.desc):
+        desc = copy.deepcopy(desc)
+        for nested in list(desc.traverse(addnodes.desc, include_self=False)):
+            nested.parent.remove(nested)
+        formatted.append(desc.pformat())
+
+    return formatted
+
+
+@pytest.mark.parametrize("which", [0, -1])
+def test_children(xml_dir, tmpdir, which):
+    """Including the children of an entity gives the same result as writing
+    a directive for each child."""
+    compound = _compounds(xml_dir)[which]
+    arg = "!{}".format(compound.refid)
+
+    tree_dir = str(tmpdir.join("tree"))
+    _make_project(tree_dir, xml_dir, {"index": _directive(arg, children="")})
+    tree_app, _ = _build(tree_dir, str(tmpdir.join("tree_out")))
+
+    inclusion_list = directives._get_inclusion_list(
+                        tree_app, doxy.RefId(compound.refid), {"children": []})
+    assert inclusion_list
+
+    flat_dir = str(tmpdir.join("flat"))
+    flat_doc = _directive(arg) + "".join(
+        ".. doxy:c:: !{}\n".format(refid)
+        + "".join(directives._format_option(name, value)
+                  for name, value in sorted(options.items())) + "\n"
+        for refid, options in inclusion_list)
+    _make_project(flat_dir, xml_dir, {"index": flat_doc})
+    flat_app, _ = _build(flat_dir, str(tmpdir.join("flat_out")))
+
+    tree_descs = _desc_list(tree_app, "index")
+    assert len(tree_descs) >= len(inclusion_list)
+    assert tree_descs == _desc_list(flat_app, "index")
+
+
+def _shard_files(srcdir):
+    shard_dir = os.path.join(srcdir, directives.SHARD_DIR)
+    if not os.path.isdir(shard_dir):
+        return {}
+
+    return {"{}/{}".format(directives.SHARD_DIR, f[:-len(".rst")]):
+            os.stat(os.path.join(shard_dir, f)).st_mtime_ns
+            for f in os.listdir(shard_dir)}
+
+
+def _desc_ids(app):
+    return {i for docname in app.env.all_docs
+            for desc in app.env.get_doctree(docname).traverse(addnodes.desc)
+            for i in desc[0]["ids"]}
+
+
+def test_shards(xml_dir, tmpdir):
+    """Shard pages are generated, updated when the directive changes, and
+    removed when they are no longer needed."""
+    compound = _compounds(xml_dir)[0]
+    srcdir = str(tmpdir.join("src"))
+    outdir = str(tmpdir.join("out"))
+    arg = "!{}".format(compound.refid)
+
+    _make_project(srcdir, xml_dir, {"index": "", "api": _directive(
+                                                    arg, children="")})
+    plain_app, _ = _build(srcdir, str(tmpdir.join("plain")))
+    assert not _shard_files(srcdir)
+
+    # Not a shard: it must never be deleted.
+    user_file = os.path.join(srcdir, directives.SHARD_DIR, "api-notes.rst")
+    _write(user_file, "Notes\n=====\n")
+
+    _make_project(srcdir, xml_dir, {"index": "", "api": _directive(
+                                        arg, children="", shard="1")})
+    app, _ = _build(srcdir, outdir)
+    shards = _shard_files(srcdir)
+    del shards[directives.SHARD_DIR + "/api-notes"]
+
+    n_children = len(shards)
+    assert n_children >= 2
+    assert sorted(shards) == sorted(directives.shard_docnames(
+                            "api", compound.refid, n_children, 1))
+    assert set(shards) <= set(app.env.all_docs)
+    assert _desc_ids(app) == _desc_ids(plain_app)
+
+    toctree, = app.env.get_doctree("api").traverse(addnodes.toctree)
+    assert [d for _, d in toctree["entries"]] == sorted(
+        shards, key=lambda d: int(d.rpartition("-")[2]))
+
+    # Nothing changes if the document does not change.
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    assert {d: m for d, m in _shard_files(srcdir).items()
+            if d in shards} == shards
+
+    # Fewer shards: the first one is rewritten, the rest are removed.
+    _make_project(srcdir, xml_dir, {"index": "", "api": _directive(
+                                arg, children="", shard=str(n_children))})
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    first, = directives.shard_docnames("api", compound.refid, n_children,
+                                       n_children)
+    assert set(_shard_files(srcdir)) == {
+                                first, directives.SHARD_DIR + "/api-notes"}
+    assert _shard_files(srcdir)[first] != shards[first]
+    assert not (set(shards) - {first}) & set(app.env.all_docs)
+    assert _desc_ids(app) == _desc_ids(plain_app)
+
+    # Without the document, its shards are removed.
+    _make_project(srcdir, xml_dir, {"index": ""})
+    os.remove(os.path.join(srcdir, "api.rst"))
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    assert set(_shard_files(srcdir)) == {directives.SHARD_DIR + "/api-notes"}
+    assert not set(shards) & set(app.env.all_docs)
+
+
+def _count_calls(monkeypatch, module, name):
+    """Replace a function of a module by a wrapper that records the arguments
+    of each call in the returned list."""
+    calls = []
+    f = getattr(module, name)
+
+    def _wrapper(*args, **kwargs):
+        calls.append(args)
+        return f(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, _wrapper)
+
+    return calls
+
+
+def test_db_not_loaded(xml_dir, tmpdir, monkeypatch):
+    """Doxygen DBs are only loaded if a document refers to them."""
+    default_loads = _count_calls(monkeypatch, projects, "load_default_db")
+    opened = _count_calls(monkeypatch, projects, "open_db")
+
+    srcdir = str(tmpdir.join("src"))
+    conf = "antidox_projects = {{'net': {!r}}}\n".format(
+                                                    os.path.abspath(xml_dir))
+    _make_project(srcdir, xml_dir, {"index": "", "text": "No Doxygen here."},
+                  conf)
+    app, _ = _build(srcdir, str(tmpdir.join("out")))
+
+    assert not default_loads and not opened
+    assert app.env.antidox_db is None
+    assert app.env.antidox_projects == {}
+
+
+def test_projects(xml_dir, tmpdir, monkeypatch):
+    """References go to the project named in them, or else to that of the
+    parent entity or to antidox_default_project."""
+    arg = "!{}".format(_compounds(xml_dir)[-1].refid)
+    doc = {"index": _directive(arg, children="")}
+
+    _make_project(str(tmpdir.join("plain")), xml_dir, doc)
+    plain_app, _ = _build(str(tmpdir.join("plain")),
+                          str(tmpdir.join("plain_out")))
+    expected = _desc_ids(plain_app)
+    assert expected
+
+    default_loads = _count_calls(monkeypatch, projects, "load_default_db")
+    opened = _count_calls(monkeypatch, projects, "open_db")
+
+    # Only the named project is configured.
+    srcdir = str(tmpdir.join("src"))
+    conf = ("antidox_doxy_xml_dir = ''\n"
+            "antidox_projects = {{'net': {!r}}}\n".format(
+                                                    os.path.abspath(xml_dir)))
+    _make_project(srcdir, xml_dir, {"index": _directive("{net}" + arg,
+                                                        children="")}, conf)
+    app, warnings = _build(srcdir, str(tmpdir.join("out")))
+
+    assert _desc_ids(app) == expected
+    assert "index.rst" not in warnings
+    assert not default_loads
+    assert [settings["xml_dir"] for settings, _ in opened] == [
+                                                    os.path.abspath(xml_dir)]
+    assert app.env.antidox_db is None
+    assert list(app.env.antidox_projects) == ["net"]
+
+    # Without a prefix, the reference goes to the default project.
+    _make_project(srcdir, xml_dir, doc, conf)
+    with pytest.raises(projects.UnknownProject):
+        _build(srcdir, str(tmpdir.join("out")))
+
+    app, warnings = _build(srcdir, str(tmpdir.join("out")),
+                           antidox_default_project="net")
+    assert _desc_ids(app) == expected
+    assert "index.rst" not in warnings
+    assert not default_loads
+
+
+def test_stale_prebuilt_index(xml_dir, tmpdir, monkeypatch):
+    """A prebuilt index is not used if it was made from a different
+    index.xml."""
+    xml_copy = str(tmpdir.join("xml"))
+    shutil.copytree(xml_dir, xml_copy)
+    index_file = str(tmpdir.join("index.db"))
+    index.write_index(doxy.DoxyDB(xml_copy), index_file)
+
+    loaded = _count_calls(monkeypatch, index, "load_index")
+
+    srcdir = str(tmpdir.join("src"))
+    _make_project(srcdir, xml_copy, {"index": _all_children_doc(xml_copy)},
+                  "antidox_prebuilt_index = {!r}\n".format(index_file))
+
+    app, _ = _build(srcdir, str(tmpdir.join("out")))
+    assert len(loaded) == 1
+    expected = _desc_ids(app)
+
+    # The DB does not change, but the fingerprint does.
+    with open(os.path.join(xml_copy, "index.xml"), "a") as f:
+        f.write("\n")
+
+    app, _ = _build(srcdir, str(tmpdir.join("out")))
+    assert len(loaded) == 1
+    assert _desc_ids(app) == expected
+
+
+@pytest.mark.parametrize("named", [False, True])
+def test_prebuilt_only(xml_dir, tmpdir, monkeypatch, named):
+    """A project can be given only as a prebuilt index. It is not loaded
+    again, and its documents are not rebuilt, until the index changes."""
+    index_file = str(tmpdir.join("index.db"))
+    index.write_index(doxy.DoxyDB(os.path.abspath(xml_dir)), index_file)
+
+    arg = "!{}".format(_compounds(xml_dir)[-1].refid)
+    _make_project(str(tmpdir.join("plain")), xml_dir,
+                  {"index": _directive(arg, children="")})
+    plain_app, _ = _build(str(tmpdir.join("plain")),
+                          str(tmpdir.join("plain_out")))
+
+    if named:
+        conf = "antidox_projects = {{'net': {{'prebuilt_index': {!r}}}}}\n"
+        arg = "{net}" + arg
+    else:
+        conf = "antidox_prebuilt_index = {!r}\n"
+
+    srcdir = str(tmpdir.join("src"))
+    outdir = str(tmpdir.join("out"))
+    _make_project(srcdir, xml_dir, {"index": _directive(arg, children="")},
+                  "antidox_doxy_xml_dir = ''\n" + conf.format(index_file))
+
+    # Relative paths must not be resolved against the working directory.
+    monkeypatch.chdir(str(tmpdir))
+    opened = _count_calls(monkeypatch, projects, "open_db")
+
+    app, _ = _build(srcdir, outdir)
+    assert len(opened) == 1
+    assert _desc_ids(app) == _desc_ids(plain_app)
+    read_times = dict(app.env.all_docs)
+
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    assert len(opened) == 1
+    assert app.env.all_docs == read_times
+
+    os.utime(index_file)
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    assert len(opened) == 2
+    assert app.env.all_docs["index"] > read_times["index"]
+
+
+def test_no_op_build(xml_dir, tmpdir, monkeypatch):
+    """An incremental build with no changes does not scan the XML."""
+    xml_copy = str(tmpdir.join("xml"))
+    shutil.copytree(xml_dir, xml_copy)
+
+    srcdir = str(tmpdir.join("src"))
+    outdir = str(tmpdir.join("out"))
+    _make_project(srcdir, xml_copy, {"index": _all_children_doc(xml_copy)})
+
+    scans = _count_calls(monkeypatch, projects, "source_date")
+
+    app, _ = _build(srcdir, outdir)
+    assert len(scans) == 1
+    read_times = dict(app.env.all_docs)
+
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    assert len(scans) == 1
+    assert app.env.all_docs == read_times
+
+    # Doxygen rewrites index.xml every time it runs.
+    with open(os.path.join(xml_copy, "index.xml"), "a") as f:
+        f.write("\n")
+
+    app, _ = _build(srcdir, outdir, freshenv=False)
+    assert len(scans) == 2
+    assert app.env.all_docs["index"] > read_times["index"]
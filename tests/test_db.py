@@ -2,30 +2,46 @@
 
 import os
 import pickle
+import gzip
+import re
+import shutil
+import sqlite3
 import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+
+from lxml import etree
 
 import pytest
 
+from antidox import daemon
 from antidox import doxy
+from antidox import index
+from antidox import inventory
+from antidox import prefetch
+from antidox import projects
+from antidox import stubs
+from antidox import watch
+from antidox import xtransform
+from antidox.directives import ENTITY_RE, shard_docnames
+from antidox.tagfile import TagDoxyDB
 
-EXAMPLES_BASE = os.path.join(os.path.dirname(__file__), "../examples")
-
-@pytest.fixture(scope="module",
-                params=["tinycbor", "riot"])
-def xml_dir(request):
-    example_dir = os.path.join(EXAMPLES_BASE, request.param)
+# Maximum time (in seconds) that importing antidox.doxy may take.
+IMPORT_BUDGET = 0.25
 
-    def _clean_xml():
-        subprocess.run(["make", "-C", example_dir, "clean"])
 
-    request.addfinalizer(_clean_xml)
+def _assert_top_down(walked):
+    """Check that each compound comes after its parents."""
+    position = {c.refid: i for i, (c, _, _) in enumerate(walked)}
+    assert len(position) == len(walked)
 
-    subprocess.run(["make", "-C", example_dir, "doxy-xml"])
+    for i, (_, subcompounds, _) in enumerate(walked):
+        for c in subcompounds:
+            assert position.get(c.refid, i + 1) > i
 
-    with open(os.path.join(example_dir, "doxy-xml")) as f:
-        relative_xml_dir = f.read().strip()
-
-    return os.path.relpath(os.path.join(example_dir, relative_xml_dir))
 
 @pytest.fixture(scope="class")
 def doxy_db(request, xml_dir):
@@ -63,3 +79,980 @@ class TestDB:
         assert all(x == y for x, y in zip(elements1, elements2))
 
 
+
+    def test_bulk_resolution(self):
+        """Bulk resolution must give the same results (and errors) as
+        resolving each target individually."""
+        targets = []
+        for r in self.db.find():
+            try:
+                targets.append(self.db.refid_to_target(r.refid))
+            except (doxy.RefError, doxy.ConsistencyError):
+                pass
+
+        candidates = self.db.resolve_targets_bulk(targets)
+
+        for target in targets:
+            try:
+                expected = self.db.resolve_target(target)
+            except doxy.RefError as e:
+                with pytest.raises(type(e), match=re.escape(e.args[0])):
+                    self.db.pick_candidate(candidates[target], target)
+            else:
+                assert (self.db.pick_candidate(candidates[target], target)
+                        == expected)
+
+    def test_scope_ancestors(self):
+        """Resolving a name with one of the element's ancestors as scope must
+        find the element, unless other candidates are at least as close."""
+        for r in self.db.find():
+            for scope, distance in self.db.find_ancestors(r.refid).items():
+                try:
+                    found = self.db.resolve_name(r.kind, r.name, scope)
+                except doxy.AmbiguousTarget as e:
+                    assert any(self.db.find_ancestors(x).get(scope, 0)
+                               == distance for x in e.args[1]
+                               if x != r.refid)
+                else:
+                    assert (found == r.refid
+                            or self.db.find_ancestors(found)[scope]
+                            <= distance)
+
+    def test_annotate(self):
+        """Annotated trees must render as the plain ones."""
+        xslt = xtransform.get_stylesheet(doxy_db=self.db)
+
+        for r in self.db.find(list(doxy.Kind)):
+            try:
+                plain = self.db.get_tree(r.refid)
+            except doxy.NoXMLError:
+                continue
+
+            original = etree.tostring(plain)
+            tree = xtransform.annotate(plain, self.db)
+
+            # get_tree() returns cached elements, which must not be modified.
+            assert etree.tostring(plain) == original
+            assert etree.tostring(self.db.get_tree(r.refid)) == original
+
+            # The copy is only made once.
+            assert xtransform.annotate(self.db.get_tree(r.refid),
+                                       self.db) is tree
+
+            try:
+                expected = _canonical(xslt(plain).getroot())
+            except (doxy.RefError, doxy.ConsistencyError, ValueError) as e:
+                with pytest.raises(type(e)):
+                    xslt(tree)
+                continue
+
+            assert _canonical(xslt(tree).getroot()) == expected, r
+
+    def test_prefetch(self):
+        """Prefetched trees must be the same, and every request for a queued
+        file must be counted as a hit or a wait."""
+        prefetcher = prefetch.Prefetcher(self.db._xml_dir)
+        # Few enough files to fit in the queue.
+        queued = [r.refid for r, _ in zip(self.db.find(list(doxy.Kind)),
+                                          range(8))]
+
+        for refid in queued:
+            assert prefetcher.prefetch(refid, self.db.xml_file(refid))
+
+        assert prefetcher.queued <= len(queued)
+
+        for refid in queued:
+            prefetcher.wait(refid)
+            assert self.db.get_tree(refid).get("id") == str(refid)
+
+        assert prefetcher.hits + prefetcher.waits == len(queued)
+        assert prefetcher.depth == 0
+
+    def test_walk(self):
+        """Walking the hierarchy gives each compound once, with the same
+        children as find_children."""
+        walked = list(self.db.walk())
+
+        assert ({c.refid for c, _, _ in walked}
+                == {r.refid for r in self.db.find(doxy.Kind.compounds())})
+        _assert_top_down(walked)
+
+        for compound, subcompounds, members in walked:
+            expected_members, expected_compounds = self.db.find_children(
+                                                            compound.refid)
+            assert subcompounds == list(expected_compounds)
+            assert members == [m for m in expected_members
+                               if m.kind not in doxy.Kind.subordinate()]
+
+            for r in subcompounds:
+                assert (r.refid in
+                        {c.refid for c, _, _ in self.db.walk(compound.refid)})
+
+    def test_stubs(self, tmpdir):
+        """Stubs are only written when they change, and stale ones are
+        removed."""
+        output_dir = str(tmpdir)
+        result = stubs.generate(self.db, output_dir)
+
+        assert result.written and not result.unchanged and not result.removed
+
+        stale = os.path.join(output_dir, "gone.rst")
+        with open(stale, "w") as f:
+            f.write(stubs.STUB_MARKER)
+        user_file = os.path.join(output_dir, "intro.rst")
+        with open(user_file, "w") as f:
+            f.write("Intro\n=====\n")
+        mtimes = {n: os.stat(os.path.join(output_dir, n + ".rst")).st_mtime_ns
+                  for n in result.written}
+
+        again = stubs.generate(self.db, output_dir)
+
+        assert not again.written
+        assert sorted(again.unchanged) == sorted(result.written)
+        assert again.removed == ["gone"]
+        assert os.path.exists(user_file)
+        assert mtimes == {
+                n: os.stat(os.path.join(output_dir, n + ".rst")).st_mtime_ns
+                for n in again.unchanged}
+
+    def test_inventory(self, tmpdir):
+        """The inventory can be read by Sphinx and has an entry for every
+        entity that has a C description type."""
+        from sphinx.util.inventory import InventoryFile
+
+        filename = os.path.join(str(tmpdir), "objects.inv")
+        count = inventory.write_inventory(self.db, filename, "test", "1.0",
+                                          docname="api/{refid}")
+
+        with open(filename, "rb") as f:
+            inv = InventoryFile.load(f, "https://example.org", os.path.join)
+
+        # Entities documented in more than one page appear more than once.
+        assert count >= sum(len(v) for v in inv.values())
+
+        for r in self.db.find():
+            try:
+                desctype = self.db.guess_desctype(r.refid)
+            except ValueError:
+                continue
+
+            assert str(r.refid) in inv.get("c:" + desctype, {}), r
+
+        for r in self.db.find(list(inventory.PAGE_KINDS)):
+            page = "api/{}".format(r.refid)
+            assert inv["std:doc"][page][2] == (
+                "https://example.org/{}.html".format(page))
+
+    def test_first_parent(self):
+        """Members defined in several compounds are taken from the smallest
+        file, whatever files are already parsed."""
+        xml_dir = self.db._xml_dir
+
+        for r in self.db.find([doxy.Kind.FUNCTION, doxy.Kind.DEFINE]):
+            parents = [p.refid for p in self.db.find_parents(r.refid)]
+            if len(parents) < 2:
+                continue
+
+            files = ["{}.xml".format(p) for p in parents]
+            smallest = min(files, key=lambda f: self.db._file_sizes[f])
+
+            doxy._parse_xml.cache_clear()
+            assert self.db.xml_file(r.refid) == smallest
+
+            for f in files:
+                doxy._parse_xml.cache_clear()
+                doxy._parse_xml(xml_dir, f)
+                assert self.db.xml_file(r.refid) == smallest
+                assert self.db.get_tree(r.refid).get("id") == str(r.refid)
+
+        doxy._parse_xml.cache_clear()
+
+
+def _canonical(elem):
+    """Convert an element into nested tuples, ignoring namespace
+    declarations and the tail of the root."""
+    if elem is None:
+        return None
+
+    return (elem.tag, dict(elem.attrib), elem.text or "",
+            [_canonical(c) + (c.tail or "",) for c in elem])
+
+
+@pytest.fixture(scope="class", params=doxy.BACKENDS)
+def backend_dbs(request, xml_dir):
+    request.cls.db = doxy.DoxyDB(xml_dir, request.param)
+    request.cls.ref_db = doxy.DoxyDB(xml_dir)
+
+
+def _outcome(f, *args):
+    """Return the result of a call, or the type and arguments of the exception
+    it raised."""
+    try:
+        return f(*args)
+    except (doxy.RefError, doxy.DoxyFormatError, ValueError) as e:
+        return type(e), e.args
+
+
+@pytest.mark.usefixtures("backend_dbs")
+class TestBackends:
+    """Conformance tests: all backends must give the same answers (and
+    errors) as the SQLite one."""
+    def test_find(self):
+        for no_parent in (False, True):
+            assert (list(self.db.find(no_parent=no_parent))
+                    == list(self.ref_db.find(no_parent=no_parent)))
+
+    def test_elements(self):
+        for r in self.ref_db.find(list(doxy.Kind)):
+            for method in ("get", "find_parents", "find_children",
+                           "find_ancestors", "refid_to_target",
+                           "guess_desctype"):
+                result = _outcome(getattr(self.db, method), r.refid)
+                expected = _outcome(getattr(self.ref_db, method), r.refid)
+
+                if method == "find_parents":
+                    result, expected = list(result), list(expected)
+
+                assert result == expected, (method, r)
+
+            assert (_outcome(self.db._first_parent, r.refid, r.kind)
+                    == _outcome(self.ref_db._first_parent, r.refid, r.kind))
+
+    def test_walk(self):
+        assert list(self.db.walk()) == list(self.ref_db.walk())
+
+        for r in self.ref_db.find(doxy.Kind.compounds()):
+            for kinds in (None, [doxy.Kind.STRUCT, doxy.Kind.VARIABLE]):
+                assert (list(self.db.walk(r.refid, kinds))
+                        == list(self.ref_db.walk(r.refid, kinds)))
+
+    def test_resolution(self):
+        for r in self.ref_db.find():
+            scopes = [None] + list(self.ref_db.find_ancestors(r.refid))
+
+            for scope in scopes:
+                assert (_outcome(self.db.resolve_name, r.kind, r.name, scope)
+                        == _outcome(self.ref_db.resolve_name, r.kind, r.name,
+                                    scope))
+
+                target = _outcome(self.ref_db.refid_to_target, r.refid)
+                if isinstance(target, doxy.Target):
+                    assert (_outcome(self.db.resolve_target, target, scope)
+                            == _outcome(self.ref_db.resolve_target, target,
+                                        scope))
+
+    def test_dump(self):
+        restored = pickle.loads(pickle.dumps(self.db))
+
+        assert restored.backend == self.db.backend
+        assert list(restored.find()) == list(self.db.find())
+
+
+@pytest.mark.parametrize("chunk", [doxy.SQLiteBackend._IN_CHUNK, 6])
+def test_bulk_during_find(xml_dir, monkeypatch, chunk):
+    """Bulk resolution works while the cursor of find() is still open, and
+    when the targets do not fit in a single query."""
+    ref_db = doxy.DoxyDB(xml_dir, "memory")
+    targets = []
+    for r in ref_db.find([doxy.Kind.FUNCTION, doxy.Kind.STRUCT]):
+        try:
+            targets.append(ref_db.refid_to_target(r.refid))
+        except (doxy.RefError, doxy.ConsistencyError):
+            pass
+    names = [(r.kind, r.name) for r in ref_db.find()]
+
+    monkeypatch.setattr(doxy.SQLiteBackend, "_IN_CHUNK", chunk)
+    db = doxy.DoxyDB(xml_dir)
+
+    found = db.find()
+    next(found)
+    assert (db.resolve_targets_bulk(targets)
+            == ref_db.resolve_targets_bulk(targets))
+    assert (db.resolve_names_bulk(names)
+            == ref_db.resolve_names_bulk(names))
+    assert len(list(found)) == len(list(ref_db.find())) - 1
+
+
+@pytest.mark.parametrize("backend", doxy.BACKENDS)
+def test_unknown_child(backend):
+    """Adding an unknown child to the hierarchy raises the same error with
+    every backend."""
+    storage = doxy.get_backend(backend)()
+    storage.insert_element(doxy.RefId("parent"), "parent", doxy.Kind.FILE)
+
+    with pytest.raises(doxy.ConsistencyError):
+        storage.insert_hierarchy(doxy.RefId("child"), doxy.RefId("parent"))
+
+
+@pytest.mark.parametrize("backend", doxy.BACKENDS)
+def test_walk_chunks(xml_dir, backend, monkeypatch):
+    """The walk is top-down even when there are more compounds than fit in
+    a single query."""
+    db = doxy.DoxyDB(xml_dir, backend)
+    walked = list(db.walk())
+
+    monkeypatch.setattr(doxy.SQLiteBackend, "_IN_CHUNK", 2)
+    roots = list(db.find(doxy.Kind.compounds(), True))
+    assert len(roots) > doxy.SQLiteBackend._IN_CHUNK
+
+    chunked = list(doxy.DoxyDB(xml_dir, backend).walk())
+    _assert_top_down(chunked)
+    assert chunked == walked
+
+    for r in roots:
+        _assert_top_down(list(db.walk(r.refid)))
+
+
+def _make_doxygen_sqlite3(xml_dir, filename):
+    """Convert Doxygen XML into the subset of the GENERATE_SQLITE3 schema
+    that is used by DoxyDB."""
+    conn = sqlite3.connect(filename)
+    conn.executescript("""
+    CREATE TABLE refid (rowid INTEGER PRIMARY KEY NOT NULL,
+                        refid TEXT NOT NULL UNIQUE);
+    CREATE TABLE compounddef (rowid INTEGER PRIMARY KEY NOT NULL,
+                              name TEXT NOT NULL, kind TEXT NOT NULL);
+    CREATE TABLE memberdef (rowid INTEGER PRIMARY KEY NOT NULL,
+                            name TEXT NOT NULL, kind TEXT NOT NULL);
+    CREATE TABLE member (rowid INTEGER PRIMARY KEY NOT NULL,
+                         scope_rowid INTEGER NOT NULL,
+                         memberdef_rowid INTEGER NOT NULL);
+    CREATE TABLE contains (rowid INTEGER PRIMARY KEY NOT NULL,
+                           inner_rowid INTEGER NOT NULL,
+                           outer_rowid INTEGER NOT NULL);
+    """)
+
+    rowids = {}
+
+    def rowid(refid):
+        if refid not in rowids:
+            rowids[refid] = conn.execute("INSERT INTO refid (refid) VALUES (?)",
+                                         (refid,)).lastrowid
+        return rowids[refid]
+
+    compounds = ET.parse(os.path.join(xml_dir, "index.xml")).findall("compound")
+
+    for compound in compounds:
+        c = rowid(compound.get("refid"))
+        conn.execute("INSERT OR IGNORE INTO compounddef VALUES (?, ?, ?)",
+                     (c, compound.findtext("name"), compound.get("kind")))
+
+        for member in compound.findall("member"):
+            m = rowid(member.get("refid"))
+            conn.execute("INSERT OR IGNORE INTO memberdef VALUES (?, ?, ?)",
+                         (m, member.findtext("name"), member.get("kind")))
+            conn.execute("INSERT INTO member (scope_rowid, memberdef_rowid) "
+                         "VALUES (?, ?)", (c, m))
+
+    for refid in dict.fromkeys(c.get("refid") for c in compounds):
+        tree = ET.parse(os.path.join(xml_dir, refid + ".xml"))
+
+        for elem in tree.iter():
+            if elem.tag.startswith("inner"):
+                conn.execute("INSERT INTO contains (inner_rowid, outer_rowid) "
+                             "VALUES (?, ?)",
+                             (rowid(elem.get("refid")), rowid(refid)))
+
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope="class", params=doxy.BACKENDS)
+def doxygen_sqlite3_dbs(request, xml_dir, tmpdir_factory):
+    filename = str(tmpdir_factory.mktemp("doxygen").join("doxygen.db"))
+    _make_doxygen_sqlite3(xml_dir, filename)
+
+    request.cls.db = doxy.DoxyDB(xml_dir, request.param, filename)
+    request.cls.ref_db = doxy.DoxyDB(xml_dir)
+
+
+@pytest.mark.usefixtures("doxygen_sqlite3_dbs")
+class TestDoxygenSQLite3:
+    """An index loaded from Doxygen's SQLite3 output must have the same
+    contents as one built from the XML. Only the element numbering (and
+    thus the order of some results) may differ."""
+    def test_elements(self):
+        assert sorted(self.db.find()) == sorted(self.ref_db.find())
+
+        for r in self.ref_db.find(list(doxy.Kind)):
+            assert self.db.get(r.refid) == self.ref_db.get(r.refid)
+            assert (self.db.find_children(r.refid)
+                    == self.ref_db.find_children(r.refid))
+            assert (sorted(self.db.find_parents(r.refid))
+                    == sorted(self.ref_db.find_parents(r.refid)))
+            assert (_outcome(self.db.refid_to_target, r.refid)
+                    == _outcome(self.ref_db.refid_to_target, r.refid))
+
+    def test_dump(self):
+        restored = pickle.loads(pickle.dumps(self.db))
+
+        assert restored.doxy_sqlite3 == self.db.doxy_sqlite3
+        assert list(restored.find()) == list(self.db.find())
+
+    def test_not_doxygen(self, tmpdir):
+        filename = os.path.join(tmpdir, "empty.db")
+        sqlite3.connect(filename).close()
+
+        with pytest.raises(doxy.DoxyFormatError):
+            doxy.DoxyDB(self.ref_db._xml_dir, self.db.backend, filename)
+
+
+@pytest.fixture(scope="class", params=doxy.BACKENDS)
+def tag_dbs(request, xml_dir):
+    tagfile = os.path.join(xml_dir, os.pardir, "doxygen.tag")
+    if not os.path.exists(tagfile):
+        pytest.skip("the example does not generate a tagfile")
+
+    request.cls.db = TagDoxyDB(tagfile, request.param)
+    request.cls.ref_db = doxy.DoxyDB(xml_dir)
+
+
+def _resolution(f, *args):
+    """Like _outcome, but ignore the arguments of the exception, since the
+    candidates may be listed in a different order."""
+    outcome = _outcome(f, *args)
+    return outcome[0] if isinstance(outcome, tuple) else outcome
+
+
+@pytest.mark.usefixtures("tag_dbs")
+class TestTagfile:
+    """An index built from a tagfile must resolve references like the one
+    built from the XML."""
+    def test_elements(self):
+        for r in self.db.find(list(doxy.Kind)):
+            for method in ("get", "refid_to_target", "guess_desctype"):
+                assert (_outcome(getattr(self.db, method), r.refid)
+                        == _outcome(getattr(self.ref_db, method), r.refid)
+                        ), (method, r)
+
+    def test_resolution(self):
+        for r in self.db.find():
+            assert (_resolution(self.db.resolve_name, r.kind, r.name)
+                    == _resolution(self.ref_db.resolve_name, r.kind, r.name))
+
+            target = _outcome(self.db.refid_to_target, r.refid)
+            if isinstance(target, doxy.Target):
+                assert (_resolution(self.db.resolve_target, target)
+                        == _resolution(self.ref_db.resolve_target, target))
+
+    def test_get_tree(self):
+        r = next(iter(self.db.find()))
+
+        with pytest.raises(doxy.NoXMLError):
+            self.db.get_tree(r.refid)
+
+    def test_dump(self):
+        restored = pickle.loads(pickle.dumps(self.db))
+
+        assert restored.tagfile == self.db.tagfile
+        assert list(restored.find()) == list(self.db.find())
+
+
+def _pack_xml(xml_dir, dest, packing):
+    """Copy the XML files into a zip archive or gzip them individually.
+    Return the new XML source."""
+    xml_files = [f for f in os.listdir(xml_dir) if f.endswith(".xml")]
+
+    if packing == "zip":
+        source = os.path.join(dest, "xml.zip")
+        with zipfile.ZipFile(source, "w", zipfile.ZIP_DEFLATED) as z:
+            for f in xml_files:
+                z.write(os.path.join(xml_dir, f), "xml/" + f)
+    else:
+        source = os.path.join(dest, "xml")
+        os.mkdir(source)
+        for f in xml_files:
+            with open(os.path.join(xml_dir, f), "rb") as src, \
+                    gzip.open(os.path.join(source, f + ".gz"), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+    return source
+
+
+@pytest.fixture(scope="class", params=["zip", "gzip"])
+def packed_dbs(request, xml_dir, tmpdir_factory):
+    source = _pack_xml(xml_dir, str(tmpdir_factory.mktemp("packed")),
+                       request.param)
+
+    request.cls.db = doxy.DoxyDB(source)
+    request.cls.ref_db = doxy.DoxyDB(xml_dir)
+
+
+@pytest.mark.usefixtures("packed_dbs")
+class TestPackedXML:
+    """Compressed and archived XML must be read like a plain directory."""
+    def test_index(self):
+        assert list(self.db.find()) == list(self.ref_db.find())
+
+    def test_trees(self):
+        for r in self.ref_db.find():
+            assert (etree.tostring(self.db.get_tree(r.refid))
+                    == etree.tostring(self.ref_db.get_tree(r.refid)))
+
+
+@pytest.fixture(scope="class", params=doxy.BACKENDS)
+def index_dbs(request, xml_dir, tmpdir_factory):
+    request.cls.ref_db = doxy.DoxyDB(xml_dir, request.param)
+    request.cls.index_file = str(tmpdir_factory.mktemp("index").join("idx.db"))
+
+    index.write_index(request.cls.ref_db, request.cls.index_file)
+
+
+@pytest.mark.usefixtures("index_dbs")
+class TestIndexFile:
+    """An index file must load back into an equivalent DB, with any
+    backend."""
+    def test_header(self):
+        meta = index.read_header(self.index_file)
+
+        assert meta["format_version"] == str(index.FORMAT_VERSION)
+        assert meta["fingerprint"] == index.fingerprint(self.ref_db._xml_dir)
+
+    @pytest.mark.parametrize("backend", doxy.BACKENDS)
+    def test_load(self, backend):
+        db = index.load_index(self.index_file, backend=backend)
+
+        assert list(db.find()) == list(self.ref_db.find())
+
+        for r in self.ref_db.find(list(doxy.Kind)):
+            for method in ("get", "find_children", "find_ancestors",
+                           "refid_to_target"):
+                assert (_outcome(getattr(db, method), r.refid)
+                        == _outcome(getattr(self.ref_db, method), r.refid))
+
+    def test_not_index(self, tmpdir):
+        filename = os.path.join(tmpdir, "empty.db")
+        sqlite3.connect(filename).close()
+
+        with pytest.raises(doxy.DoxyFormatError):
+            index.read_header(filename)
+
+
+# Time (in seconds) that a daemon may take to start.
+DAEMON_TIMEOUT = 60
+
+
+def _serve(xml_dir, socket_path, **kwargs):
+    """Run an index daemon in a background thread and return a client for
+    it. The DB is created by the thread, since a SQLite connection cannot be
+    shared between threads."""
+    def _run():
+        server = daemon.DoxyServer(doxy.DoxyDB(xml_dir), socket_path,
+                                   **kwargs)
+        server.serve_forever()
+
+    threading.Thread(target=_run, daemon=True).start()
+
+    client = daemon.DoxyClient(socket_path)
+    deadline = time.monotonic() + DAEMON_TIMEOUT
+    while True:
+        try:
+            client.ping()
+            return client
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+@pytest.fixture(scope="class")
+def daemon_client(request, xml_dir, tmpdir_factory):
+    socket_path = str(tmpdir_factory.mktemp("daemon").join("antidox.sock"))
+
+    request.cls.db = _serve(xml_dir, socket_path)
+    request.cls.ref_db = doxy.DoxyDB(xml_dir)
+
+
+@pytest.mark.usefixtures("daemon_client")
+class TestDaemon:
+    """Queries through the daemon must give the same answers (and errors) as
+    the DB itself."""
+    def test_elements(self):
+        assert list(self.db.find()) == list(self.ref_db.find())
+
+        for r in self.ref_db.find(list(doxy.Kind)):
+            for method in ("get", "find_parents", "refid_to_target",
+                           "guess_desctype"):
+                result = _outcome(getattr(self.db, method), r.refid)
+                expected = _outcome(getattr(self.ref_db, method), r.refid)
+
+                if method == "find_parents":
+                    result, expected = list(result), list(expected)
+
+                assert result == expected, (method, r)
+
+            assert ([list(c) for c in self.db.find_children(r.refid)]
+                    == [list(c) for c in self.ref_db.find_children(r.refid)])
+
+    def test_resolution(self):
+        for r in self.ref_db.find():
+            assert (_outcome(self.db.resolve_name, r.kind, r.name)
+                    == _outcome(self.ref_db.resolve_name, r.kind, r.name))
+
+            target = _outcome(self.ref_db.refid_to_target, r.refid)
+            if isinstance(target, doxy.Target):
+                assert (_outcome(self.db.resolve_target, target)
+                        == _outcome(self.ref_db.resolve_target, target))
+
+    def test_get_tree(self):
+        for r in self.ref_db.find(list(doxy.Kind)):
+            expected = _outcome(self.ref_db.get_tree, r.refid)
+            if isinstance(expected, tuple):
+                assert _outcome(self.db.get_tree, r.refid) == expected
+            else:
+                assert (etree.tostring(self.db.get_tree(r.refid))
+                        == etree.tostring(expected, with_tail=False))
+
+    def test_errors(self):
+        with pytest.raises(doxy.RefError):
+            self.db.resolve_target(doxy.Target("no/such/file.h::x"))
+
+        with pytest.raises(daemon.DaemonError, match="Unknown method"):
+            self.db._call("no_such_method")
+
+        # The connection is still usable after an error.
+        assert self.db.ping()
+
+    def test_pickle(self):
+        assert pickle.loads(pickle.dumps(self.db)).ping()
+
+
+def _rename_member(xml_dir, refid, new_name):
+    """Rename a member in index.xml and in the files of its compounds,
+    rewriting them in place like Doxygen does."""
+    for filename in os.listdir(xml_dir):
+        if not filename.endswith(".xml"):
+            continue
+
+        path = os.path.join(xml_dir, filename)
+        tree = etree.parse(path)
+        names = tree.xpath("//member[@refid=$id]/name"
+                           "|//memberdef[@id=$id]/name", id=str(refid))
+        if names:
+            for name in names:
+                name.text = new_name
+            tree.write(path, encoding="UTF-8", xml_declaration=True)
+
+
+def test_daemon_rebuild(xml_dir, tmpdir):
+    """The daemon rebuilds its DB when a file is rewritten, even if the
+    directory's modification time does not change."""
+    copied = str(tmpdir.join("xml"))
+    shutil.copytree(xml_dir, copied)
+    dir_stat = os.stat(copied)
+
+    client = _serve(copied, str(tmpdir.join("antidox.sock")),
+                    check_interval=0, settle=0)
+
+    r = next(iter(client.find([doxy.Kind.FUNCTION])))
+    _rename_member(copied, r.refid, "renamed_function")
+    stale = doxy.RefId("stale_1refid")
+    os.utime(copied, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+    # The DB is checked when a client connects.
+    client = daemon.DoxyClient(client.socket_path)
+
+    assert client.get(r.refid).name == "renamed_function"
+    assert client.get_tree(r.refid).findtext("name") == "renamed_function"
+
+    # The refids interned before the rebuild were released.
+    assert doxy.RefId("stale_1refid") is not stale
+
+    doxy._parse_xml.cache_clear()
+
+
+def _server(xml_dir, tmpdir, **kwargs):
+    """Create (but do not start) a daemon for a copy of the XML."""
+    copied = str(tmpdir.join("xml"))
+    shutil.copytree(xml_dir, copied)
+
+    return daemon.DoxyServer(doxy.DoxyDB(copied), str(tmpdir.join("sock")),
+                             **kwargs)
+
+
+def test_daemon_broken_xml(xml_dir, tmpdir):
+    """The daemon keeps serving the old DB while the XML cannot be read, and
+    rebuilds it once it can."""
+    server = _server(xml_dir, tmpdir, check_interval=0, settle=0)
+    old_db = server.db
+    index_xml = os.path.join(old_db._xml_dir, "index.xml")
+
+    with open(index_xml, "rb") as f:
+        contents = f.read()
+    with open(index_xml, "wb") as f:
+        f.write(contents[:len(contents) // 2])
+
+    server._check_fresh()
+    assert server.db is old_db
+    assert server.handle("ping", ()) == (True, True)
+
+    with open(index_xml, "wb") as f:
+        f.write(contents + b"\n")
+
+    server._check_fresh()
+    assert server.db is not old_db
+
+
+def test_daemon_settle(xml_dir, tmpdir):
+    """The XML is not checked more often than check_interval, and the DB is
+    not rebuilt until the XML stops changing for settle seconds."""
+    server = _server(xml_dir, tmpdir, check_interval=3600, settle=0)
+    old_db = server.db
+
+    _touch_xml(old_db._xml_dir)
+    server._check_fresh()
+    assert server.db is old_db
+
+    server.check_interval = 0
+    server.settle = 0.2
+    server._check_fresh()
+    assert server.db is old_db
+
+    _touch_xml(old_db._xml_dir)
+    time.sleep(0.1)
+    server._check_fresh()
+    assert server.db is old_db
+
+    time.sleep(0.3)
+    server._check_fresh()
+    assert server.db is not old_db
+
+
+def test_daemon_handler_error(xml_dir, tmpdir):
+    """A KeyError raised by a handler is not reported as an unknown method."""
+    server = _server(xml_dir, tmpdir)
+
+    ok, (name, args) = server.handle("no_such_method", ())
+    assert not ok and "Unknown method" in args[0]
+
+    server._handlers["get"] = lambda refid: {}[refid]
+    ok, (name, args) = server.handle("get", ("x",))
+    assert not ok and name == "DaemonError"
+    assert "Unknown method" not in args[0]
+
+
+def _watcher(xml_dir, tmpdir, settle=0, backend="sqlite"):
+    """Create a watcher for a copy of the XML, with no polling delays."""
+    copied = str(tmpdir.join("xml"))
+    if not os.path.exists(copied):
+        shutil.copytree(xml_dir, copied)
+
+    return watch.Watcher(copied, str(tmpdir.join("index.pickle")),
+                         interval=0, settle=settle, backend=backend)
+
+
+def _touch_xml(xml_dir, name="index.xml"):
+    """Rewrite a file in place, changing its size."""
+    with open(os.path.join(xml_dir, name), "a") as f:
+        f.write("\n")
+
+
+def test_watch_poll(xml_dir, tmpdir):
+    watcher = _watcher(xml_dir, tmpdir)
+
+    published = watcher.poll()
+    assert published.files == len(watch.scan_xml_dir(watcher.xml_dir))
+
+    snapshot = watch.load_snapshot(watcher.index_file)
+    assert snapshot.state == watch.scan_xml_dir(watcher.xml_dir)
+    assert list(snapshot.db.find()) == list(doxy.DoxyDB(xml_dir).find())
+
+    assert watcher.poll() is None
+
+    stale = doxy.RefId("stale_1refid")
+    _touch_xml(watcher.xml_dir)
+    assert watcher.poll() is not None
+    assert doxy.RefId("stale_1refid") is not stale
+
+    # A snapshot that is up to date is not published again by a new watcher,
+    # unless it uses a different backend.
+    assert _watcher(xml_dir, tmpdir).poll() is None
+    for backend in doxy.BACKENDS:
+        if backend != "sqlite":
+            assert _watcher(xml_dir, tmpdir, backend=backend).poll()
+
+
+def test_watch_incomplete(xml_dir, tmpdir):
+    """Nothing is published while index.xml is missing."""
+    watcher = _watcher(xml_dir, tmpdir)
+    os.remove(os.path.join(watcher.xml_dir, "index.xml"))
+
+    assert watcher.poll() is None
+    assert not os.path.exists(watcher.index_file)
+
+
+def test_watch_settle(xml_dir, tmpdir, monkeypatch):
+    """The index is built from the XML once it stops changing."""
+    watcher = _watcher(xml_dir, tmpdir, settle=0.2)
+    scan = watch.scan_xml_dir
+    scans = []
+
+    def _scan_while_writing(source):
+        scans.append(source)
+        # Doxygen is still writing during the first scans.
+        if len(scans) in (2, 3):
+            _touch_xml(source)
+        return scan(source)
+
+    monkeypatch.setattr(watch, "scan_xml_dir", _scan_while_writing)
+
+    assert watcher.poll() is not None
+    assert len(scans) > 4
+    assert (watch.load_snapshot(watcher.index_file).state
+            == scan(watcher.xml_dir))
+
+
+def test_watch_changed_while_reading(xml_dir, tmpdir, monkeypatch):
+    """A snapshot is not published if the XML changed while it was being
+    read."""
+    watcher = _watcher(xml_dir, tmpdir)
+    db_class = doxy.DoxyDB
+
+    def _read_while_writing(*args, **kwargs):
+        _touch_xml(watcher.xml_dir)
+        return db_class(*args, **kwargs)
+
+    monkeypatch.setattr(doxy, "DoxyDB", _read_while_writing)
+    assert watcher.poll() is None
+    assert not os.path.exists(watcher.index_file)
+
+    monkeypatch.undo()
+    assert watcher.poll() is not None
+
+
+def test_watch_incompatible_snapshot(xml_dir, tmpdir):
+    """Snapshots written by other versions, or that cannot be read, are
+    replaced."""
+    index_file = str(tmpdir.join("index.pickle"))
+
+    with open(index_file, "wb") as f:
+        pickle.dump((watch.SNAPSHOT_VERSION + 1, {}, None), f)
+
+    assert watch.load_snapshot(index_file) is None
+    assert _watcher(xml_dir, tmpdir).poll() is not None
+
+    with open(index_file, "wb") as f:
+        f.write(b"not a pickle")
+
+    watcher = _watcher(xml_dir, tmpdir)
+    assert watcher.poll() is not None
+    assert (watch.load_snapshot(index_file).state
+            == watch.scan_xml_dir(watcher.xml_dir))
+
+
+def test_watch_broken_xml(xml_dir, tmpdir):
+    """The watcher survives reading a half-written file and indexes it once
+    it is complete."""
+    watcher = _watcher(xml_dir, tmpdir)
+    index_xml = os.path.join(watcher.xml_dir, "index.xml")
+
+    with open(index_xml, "rb") as f:
+        contents = f.read()
+    with open(index_xml, "wb") as f:
+        f.write(contents[:len(contents) // 2])
+
+    assert watcher.poll() is None
+    assert watcher.poll() is None
+    assert not os.path.exists(watcher.index_file)
+
+    with open(index_xml, "wb") as f:
+        f.write(contents)
+
+    assert watcher.poll() is not None
+
+
+def test_load_corrupt_snapshot(xml_dir, tmpdir):
+    """A build ignores an index file that cannot be read."""
+    watcher = _watcher(xml_dir, tmpdir)
+    watcher.poll()
+    state = watch.scan_xml_dir(watcher.xml_dir)
+
+    assert projects._load_snapshot(watcher.index_file, state) is not None
+
+    with open(watcher.index_file, "rb") as f:
+        contents = f.read()
+
+    for corrupt in (contents[:len(contents) // 2], b"not a pickle"):
+        with open(watcher.index_file, "wb") as f:
+            f.write(corrupt)
+
+        assert projects._load_snapshot(watcher.index_file, state) is None
+
+
+@pytest.mark.parametrize("ref_str, project, groups", [
+    ("a/b.h::c", None, {"target": "a/b.h::c"}),
+    ("{net}a/b.h::c", "net", {"target": "a/b.h::c"}),
+    ("{net}group[g]", "net", {"kind": "group", "name": "g"}),
+    ("{my-lib.2}[g]", "my-lib.2", {"name": "g"}),
+    ("{net}!structx", "net", {"refid": "structx"}),
+])
+def test_entity_project(ref_str, project, groups):
+    m = ENTITY_RE.fullmatch(ref_str)
+
+    assert m["project"] == project
+    for k, v in groups.items():
+        assert m[k] == v
+
+
+@pytest.mark.parametrize("ref_str", ["{}a.h::b", "{net a.h::b", "{net}"])
+def test_entity_project_invalid(ref_str):
+    assert ENTITY_RE.fullmatch(ref_str) is None
+
+
+@pytest.mark.parametrize("n_children,size,expected", [
+    (0, 100, []),
+    (100, 100, ["api/_shards/net-group__net-1"]),
+    (250, 100, ["api/_shards/net-group__net-1", "api/_shards/net-group__net-2",
+                "api/_shards/net-group__net-3"]),
+])
+def test_shard_docnames(n_children, size, expected):
+    assert (shard_docnames("api/net", doxy.RefId("group__net"), n_children,
+                           size) == expected)
+
+
+def test_import_cost():
+    """antidox.doxy must not import Sphinx and must be quick to import."""
+    code = ("import sys, time\n"
+            "t0 = time.perf_counter()\n"
+            "import antidox.doxy\n"
+            "print(time.perf_counter() - t0)\n"
+            "print(*(m for m in sys.modules\n"
+            "        if m.partition('.')[0] in ('sphinx', 'docutils')))\n")
+
+    env = dict(os.environ, PYTHONPATH=os.path.join(os.path.dirname(__file__),
+                                                   ".."))
+    elapsed, heavy_modules = subprocess.run(
+                    [sys.executable, "-c", code], env=env, check=True,
+                    stdout=subprocess.PIPE,
+                    universal_newlines=True).stdout.splitlines()
+
+    assert not heavy_modules
+    assert float(elapsed) < IMPORT_BUDGET
+
+
+def test_stylesheet_cache(tmpdir):
+    db1 = doxy.DoxyDB.__new__(doxy.DoxyDB)
+    db2 = doxy.DoxyDB.__new__(doxy.DoxyDB)
+
+    default = xtransform.get_stylesheet(doxy_db=db1)
+    assert xtransform.get_stylesheet(doxy_db=db1) is default
+    assert xtransform.get_stylesheet(doxy_db=db2) is not default
+
+    sty_file = os.path.join(str(tmpdir), "custom.xsl")
+    sty_text = """<xsl:stylesheet version="1.0"
+        xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:import href="antidox:compound"/>
+        %s
+    </xsl:stylesheet>"""
+
+    with open(sty_file, "w") as f:
+        f.write(sty_text % "")
+    custom = xtransform.get_stylesheet(sty_file, doxy_db=db1)
+
+    assert custom is not default
+    assert xtransform.get_stylesheet(sty_file, doxy_db=db1) is custom
+
+    with open(sty_file, "w") as f:
+        f.write(sty_text % '<xsl:param name="x"/>')
+
+    assert xtransform.get_stylesheet(sty_file, doxy_db=db1) is not custom